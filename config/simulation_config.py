@@ -23,7 +23,8 @@ if gpus:
         print(e)
 
 # Communication direction
-DIRECTION = 'downlink'  # 'uplink' or 'downlink'
+# 'duplex' simulates both directions on the same channel realizations
+DIRECTION = 'downlink'  # 'uplink', 'downlink' or 'duplex'
 
 # 3GPP scenario parameters
 SCENARIO = 'umi'  # 'umi', 'uma' or 'rma'
@@ -42,6 +43,16 @@ MIN_BS_UT_DIST = 0   # [m]
 # Carrier frequency
 CARRIER_FREQUENCY = 3.5e9  # [Hz]
 
+# Carriers simulated in a single run, sharing the topology and user mobility.
+# If None, a single carrier at CARRIER_FREQUENCY is simulated. Each carrier is
+# a dictionary with 'carrier_frequency' [Hz] and optionally 'name',
+# 'bs_max_power_dbm' and 'ut_max_power_dbm'. All carriers use the OFDM
+# parameters below, e.g.:
+# CARRIERS = [{'name': '700 MHz', 'carrier_frequency': 700e6},
+#             {'name': '3.5 GHz', 'carrier_frequency': 3.5e9},
+#             {'name': '28 GHz', 'carrier_frequency': 28e9}]
+CARRIERS = None
+
 # Transmit power for base station and user terminals
 BS_MAX_POWER_DBM = 56  # [dBm]
 UT_MAX_POWER_DBM = 26  # [dBm]
@@ -61,9 +72,121 @@ NUM_OFDM_SYM = 1        # n. OFDM symbols, i.e., time samples, in a slot
 NUM_SUBCARRIERS = 128   # N. available subcarriers
 SUBCARRIER_SPACING = 15e3  # [Hz] Subcarrier spacing
 
+# The channel is generated every FREQ_STRIDE subcarriers and interpolated
+# across the band. 1 = full resolution, 12 = one sample per PRB
+FREQ_STRIDE = 1
+FREQ_INTERPOLATION = 'linear'  # 'linear' or 'hold'
+
+# Channel source. 'surrogate' replaces the clustered 3GPP fading with a
+# Kronecker-correlated Rayleigh/Rician model on the same topology, pathloss,
+# shadowing and LSPs, for fast exploratory sweeps. Its mean link gain is not
+# calibrated against the 3GPP model, see the readme: do not use it for
+# absolute performance figures. With CHECK_CHANNEL_FIDELITY, it is compared
+# against the 3GPP model before the run
+CHANNEL_SOURCE = 'tr38901'  # 'tr38901' or 'surrogate'
+CHECK_CHANNEL_FIDELITY = False
+
 # Simulation parameters
 NUM_SLOTS = 1000  # N. slots to simulate
 
+# Adaptive stopping. If not None, the simulation stops as soon as throughput,
+# TBLER and OLLA offset have converged, and NUM_SLOTS is the maximum number of
+# slots. Convergence is assessed via batch means, e.g.:
+# CONVERGENCE = {'rel_precision': 0.02,    # CI half-width / mean
+#                'olla_precision_db': 0.1, # CI half-width of OLLA offset [dB]
+#                'batch_slots': 50,        # slots per batch
+#                'min_batches': 10,
+#                'confidence': 0.95}
+CONVERGENCE = None
+
+# If not None, the simulation runs in consecutive chunks of CHUNK_SLOTS slots,
+# each warm-started from the previous one, so that only the history of one
+# chunk is held on the device
+CHUNK_SLOTS = None
+
+# Device memory budget [GB]. If not None, the peak memory is estimated before
+# the run. Runs exceeding the budget are split into shorter chunks and then run
+# with a smaller batch size if MEMORY_DOWNSCALE is True, and refused otherwise
+MEMORY_BUDGET_GB = None
+MEMORY_DOWNSCALE = True
+
+# If not None, progress (slot, slots/sec, ETA) and TBLER and throughput over
+# the last interval are reported every TELEMETRY_SLOTS slots, at the
+# boundaries of chunks of at most TELEMETRY_SLOTS slots. Reports are appended
+# to TELEMETRY_FILE (JSON lines), written to TELEMETRY_PROMETHEUS_FILE and
+# served on http://localhost:TELEMETRY_PORT/metrics (Prometheus text format).
+# The overhead against an unchunked run is measured by
+# measure_telemetry_overhead in simulation/run_simulation.py
+TELEMETRY_SLOTS = None
+TELEMETRY_FILE = 'telemetry.jsonl'
+TELEMETRY_PROMETHEUS_FILE = None
+TELEMETRY_PORT = None
+
+# Compile the slot loop with XLA. The SINR computation is always compiled with
+# XLA, which masking of numerical failures relies on
+JIT_COMPILE = True
+
+# Use the batch size, chunk length, thread counts and XLA setting found by
+# `python -m simulation.autotune` for this configuration on this host, if any.
+# Thread counts are applied by main.py before TensorFlow is initialized
+USE_TUNING_CACHE = False
+
+# N. initial slots discarded from the statistics (transient of OLLA and PF)
+WARMUP_SLOTS = 0
+
+# Warm start: OLLA, PF scheduler and HARQ/SINR feedback state is loaded from
+# LOAD_STATE_FILE before the run and, if SAVE_STATE_FILE is set, stored after
+# the run. The state is per user, hence requires the same topology
+LOAD_STATE_FILE = None  # e.g. 'sim_state.npz'
+SAVE_STATE_FILE = None
+
+# Traffic model. If None, all users have full buffers. Otherwise, packets
+# arrive at per-user queues following a Poisson process and users with empty
+# queues are not scheduled:
+# - 'model': 'ftp3' (fixed-size files) or 'poisson' (exponential sizes)
+# - 'arrival_rate': packets per user and second
+# - 'packet_size': (mean) packet size [bits]
+# - 'max_queue': max. number of queue entries per user, one per slot with
+#   arrivals, beyond which arriving packets are dropped
+# e.g.: TRAFFIC = {'model': 'ftp3', 'arrival_rate': 1., 'packet_size': 4e6}
+TRAFFIC = None
+
+# Policies evaluated on the same channel realizations in a single run.
+# If None, a single policy defined by the parameters below is simulated.
+# Each policy is a dictionary that can override 'pf_beta', 'fairness_dl',
+# 'guaranteed_power_ratio_dl', 'alpha_ul', 'p0_dbm_ul', 'bler_target' and
+# 'olla_delta_up', e.g.:
+# POLICIES = [{'name': 'PF 0.98', 'pf_beta': 0.98},
+#             {'name': 'PF 0.9, fair', 'pf_beta': 0.9, 'fairness_dl': 1}]
+POLICIES = None
+
+# Compute SINR only for the user scheduled in each sector on each resource
+# element, instead of for all users. In the DL, the RZF precoder is still
+# computed on the channels of all co-sector users, so that the SINR is the same
+ACTIVE_SET_SINR = False
+
+# Cache the DL RZF precoder within each coherence block. The precoder is
+# recomputed only when the per-link fading amplitude changed by more than this
+# relative tolerance (0: every slot, from the cached Gram matrix). None disables
+# the cache
+RZF_CACHE_TOLERANCE = None
+# Max. fraction of the transmitters whose cached precoder is recomputed per
+# slot, those whose fading drifted most first. The others keep their precoder
+# until a later slot
+RZF_CACHE_MAX_UPDATE_RATIO = 1.
+
+# Regularization of the DL RZF precoder, relative to the average channel gain,
+# added to the noise power. A small value, e.g. 1e-6, avoids ill-conditioned
+# matrices. Sectors where the SINR computation still fails are masked in the
+# results of that slot
+SINR_DIAG_LOADING = 0.
+
+# Store effective SINR, pathloss, TX power and PF metric in the result history
+# as float16 [dB], and the OLLA offset as float16, instead of float32: 19
+# instead of 29 bytes per user and slot. MCS, HARQ, allocated REs and decoded
+# bits are always stored as integers
+COMPACT_HIST_FLOAT = False
+
 # Link Adaptation
 BLER_TARGET = 0.1    # Must be in [0, 1]
 OLLA_DELTA_UP = 0.2
@@ -72,6 +195,44 @@ OLLA_DELTA_UP = 0.2
 ALPHA_UL = 1.0       # Pathloss compensation factor, must be in [0, 1]
 P0_DBM_UL = -80.0    # [dBm] Target received power at the base station
 
+# Root directory of on-disk caches. If None, ~/.cache/sionna_sls is used
+CACHE_DIR = None
+
+# Load the interpolated BLER tables of the PHY abstraction from CACHE_DIR
+# instead of interpolating them at every start-up. Requires a Sionna version
+# supported by models.CachedPHYAbstraction
+CACHE_PHY_TABLES = False
+
+# If not None, the BS element field pattern is tabulated on a zenith/azimuth
+# grid of this resolution [deg], stored in CACHE_DIR and bilinearly
+# interpolated during channel generation. Max. gain error of the 38.901
+# element: 0.03 dB at 0.25 deg, 0.07 dB at 0.5 deg, 0.12 dB at 1 deg,
+# 0.26 dB at 2 deg (mostly at the 30 dB attenuation floor)
+ANTENNA_PATTERN_RESOLUTION_DEG = None
+
+# Load hexagonal grid drops from CACHE_DIR when the same drop (scenario, grid,
+# users, distances, seed) was generated before. LoS states, indoor distances
+# and LSPs are still sampled. Entries unused for TOPOLOGY_CACHE_MAX_AGE_DAYS
+# are evicted, then the least recently used ones beyond TOPOLOGY_CACHE_MAX_MB
+CACHE_TOPOLOGY = False
+TOPOLOGY_CACHE_MAX_MB = 1024
+TOPOLOGY_CACHE_MAX_AGE_DAYS = 30
+
+# Draw random numbers from counter-based streams indexed by (seed, DROP_ID,
+# stage, slot) rather than from a single sequential generator. Any chunk of a
+# drop can then be re-simulated in isolation, and chunked runs match
+# unchunked ones. Requires a seed
+RNG_STREAMS = False
+DROP_ID = 0
+
+# If not None, the cleaned history is aggregated into buckets of
+# RESULTS_BUCKET_SLOTS slots (per-user sums, counts, extrema, per-cell
+# histograms, TBLER per MCS), see utils/results_query.py. Averages and
+# queries are computed from the aggregates, which are stored in
+# RESULTS_STORE_FILE if not None
+RESULTS_BUCKET_SLOTS = None
+RESULTS_STORE_FILE = None
+
 # System environment parameters
 TEMPERATURE = 294    # Environment temperature for noise power computation
 O2I_MODEL = 'low'    # 'low' or 'high'
@@ -29,15 +29,23 @@ import numpy as np
 import sionna.phy.config
 #import sionna.phy.dtypes
 
-# Set random seed for reproducibility
-sionna.phy.config.seed = 42
-
 # Internal computational precision
 sionna.phy.config.precision = 'single'  # 'single' or 'double'
 
 # Import our modular components
 import config.simulation_config as config
 from simulation.run_simulation import run_simulation
+from utils.tuning_utils import apply_tuned_thread_settings
+
+# Thread counts found by simulation/autotune.py, applied before TensorFlow is
+# initialized by setting the seed
+if config.USE_TUNING_CACHE:
+    apply_tuned_thread_settings(config,
+                                precision=sionna.phy.config.precision,
+                                cache_dir=config.CACHE_DIR)
+
+# Set random seed for reproducibility
+sionna.phy.config.seed = 42
 
 
 def main():
@@ -50,11 +58,17 @@ def main():
     print(f"Configuration:")
     print(f"  - Direction: {config.DIRECTION}")
     print(f"  - Scenario: {config.SCENARIO}")
-    print(f"  - Carrier frequency: {config.CARRIER_FREQUENCY/1e9:.1f} GHz")
+    if config.CARRIERS is not None:
+        print(f"  - Carrier frequencies: "
+              f"{[carrier['carrier_frequency']/1e9 for carrier in config.CARRIERS]} GHz")
+    else:
+        print(f"  - Carrier frequency: {config.CARRIER_FREQUENCY/1e9:.1f} GHz")
     print(f"  - Number of rings: {config.NUM_RINGS}")
     print(f"  - Users per sector: {config.NUM_UT_PER_SECTOR}")
     print(f"  - Number of slots: {config.NUM_SLOTS}")
     print(f"  - Batch size: {config.BATCH_SIZE}")
+    if config.POLICIES is not None:
+        print(f"  - Policies: {[policy.get('name') for policy in config.POLICIES]}")
     print("=" * 60)
     
     try:
@@ -67,13 +81,21 @@ def main():
         print("=" * 60)
         
         # Print some key metrics
-        results_avg = results['results_avg']
-        print(f"Average TBLER: {np.mean(results_avg['TBLER']):.3f}")
-        print(f"Average MCS: {np.mean(results_avg['MCS']):.1f}")
-        print(f"Average throughput (decoded bits/slot): {np.mean(results_avg['# decoded bits / slot']):.0f}")
-        print(f"Average effective SINR: {np.mean(results_avg['Effective SINR [dB]']):.1f} dB")
-        print(f"Average TX power: {np.mean(results_avg['TX power [dBm]']):.1f} dBm")
-        print("=" * 60)
+        if results['simulator'].multi_policy:
+            results_avg_per_policy = results['results_avg']
+        else:
+            results_avg_per_policy = {None: results['results_avg']}
+        for name, results_avg in results_avg_per_policy.items():
+            if name is not None:
+                print(f"Policy: {name}")
+            print(f"Average TBLER: {np.mean(results_avg['TBLER']):.3f}")
+            print(f"Average MCS: {np.mean(results_avg['MCS']):.1f}")
+            print(f"Average throughput (decoded bits/slot): {np.mean(results_avg['# decoded bits / slot']):.0f}")
+            print(f"Average effective SINR: {np.mean(results_avg['Effective SINR [dB]']):.1f} dB")
+            print(f"Average TX power: {np.mean(results_avg['TX power [dBm]']):.1f} dBm")
+            if 'Packet latency [ms]' in results_avg:
+                print(f"Average packet latency: {np.nanmean(results_avg['Packet latency [ms]']):.1f} ms")
+            print("=" * 60)
         
         # Show all plots
         print("Displaying plots...")
@@ -1,4 +1,8 @@
 # models/__init__.py
 
 from .channel_matrix import ChannelMatrix
+from .surrogate_channel import SurrogateChannel, channel_source_fidelity
 from .system_simulator import SystemLevelSimulator
+from .phy_abstraction import CachedPHYAbstraction, verify_phy_abstraction
+from .antenna_pattern import TabulatedAntennaElement, \
+    tabulate_array_patterns, pattern_table_error
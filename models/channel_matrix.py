@@ -1,10 +1,41 @@
 # models/channel_matrix.py
 
+import numpy as np
 import tensorflow as tf
 from sionna.phy import config, Block
-from sionna.phy.channel import GenerateOFDMChannel
+from sionna.phy.channel import GenerateOFDMChannel, subcarrier_frequencies, \
+    cir_to_ofdm_channel
 from sionna.phy.utils import insert_dims
 
+from models.surrogate_channel import SurrogateChannel
+
+
+def get_freq_samples(num_sc, stride, interpolation='linear'):
+    """ Subcarriers at which a frequency-decimated channel is evaluated, and
+    left/right sample indices and weights interpolating it to all num_sc
+    subcarriers """
+    sc = np.arange(num_sc)
+    if interpolation == 'hold':
+        # One sample at the center of each block of stride subcarriers,
+        # held across the block
+        sample_idx = np.minimum(np.arange(0, num_sc, stride) + stride // 2,
+                                num_sc - 1)
+        left = sc // stride
+        right = left
+        weight = np.zeros(num_sc)
+    else:
+        # Samples at the edge of each block, plus the last subcarrier,
+        # linearly interpolated in between
+        sample_idx = np.arange(0, num_sc, stride)
+        if sample_idx[-1] != num_sc - 1:
+            sample_idx = np.append(sample_idx, num_sc - 1)
+        right = np.minimum(np.searchsorted(sample_idx, sc, side='right'),
+                           len(sample_idx) - 1)
+        left = np.maximum(right - 1, 0)
+        span = np.maximum(sample_idx[right] - sample_idx[left], 1)
+        weight = np.clip((sc - sample_idx[left]) / span, 0, 1)
+    return sample_idx, left, right, weight
+
 
 class ChannelMatrix(Block):
     def __init__(self,
@@ -13,22 +44,92 @@ class ChannelMatrix(Block):
                  num_rx,
                  num_tx,
                  coherence_time,
+                 freq_stride=1,
+                 freq_interpolation='linear',
+                 rng=None,
+                 rng_stream=None,
+                 channel_source='tr38901',
                  precision=None):
         super().__init__(precision=precision)
+        assert freq_interpolation in ['linear', 'hold']
+        assert channel_source in ['tr38901', 'surrogate']
         self.resource_grid = resource_grid
         self.coherence_time = coherence_time
         self.batch_size = batch_size
+        # If not None, RNGStreams from which channel realizations and fading
+        # are drawn per coherence block and per slot. Otherwise, the global
+        # generator is used
+        self.rng = rng
+        # If not None, additional counter of the channel realization streams,
+        # e.g., the carrier index, so that the generators of several carriers
+        # draw independent realizations. Fading is common to all of them
+        self.rng_counters = () if rng_stream is None else (rng_stream,)
+        # 'surrogate' replaces clustered 3GPP fading with a correlated
+        # Rayleigh/Rician model built on the same topology and LSPs
+        self.channel_source = channel_source
+        self.surrogate = SurrogateChannel(precision=precision) \
+            if channel_source == 'surrogate' else None
         # Fading autoregressive coefficient initialization
-        self.rho_fading = config.tf_rng.uniform([batch_size, num_rx, num_tx],
-                                                minval=.95,
-                                                maxval=.99,
-                                                dtype=self.rdtype)
-        # Fading initialization
+        if rng is None:
+            self.rho_fading = config.tf_rng.uniform(
+                [batch_size, num_rx, num_tx],
+                minval=.95,
+                maxval=.99,
+                dtype=self.rdtype)
+        else:
+            self.rho_fading = tf.random.stateless_uniform(
+                [batch_size, num_rx, num_tx],
+                seed=rng.seed('fading_init'),
+                minval=.95,
+                maxval=.99,
+                dtype=self.rdtype)
+        # Fading at the start of a run. The fading of the following slots is
+        # returned by apply_fading and carried in the slot loop state
         self.fading = tf.ones([batch_size, num_rx, num_tx],
                               dtype=self.rdtype)
 
+        # Frequency-decimated generation: the channel is evaluated every
+        # freq_stride subcarriers and interpolated across the band on demand
+        self.freq_stride = int(freq_stride)
+        self.freq_interpolation = freq_interpolation
+        self._setup_freq_grid()
+
+    def _setup_freq_grid(self):
+        """ Subcarriers at which the channel is evaluated and interpolation
+        weights towards the full subcarrier grid """
+        num_sc = self.resource_grid.fft_size
+        sample_idx, left, right, weight = get_freq_samples(
+            num_sc, self.freq_stride, self.freq_interpolation)
+
+        self.num_freq_samples = len(sample_idx)
+        frequencies = subcarrier_frequencies(num_sc,
+                                             self.resource_grid.subcarrier_spacing,
+                                             precision=self.precision)
+        # [num_freq_samples]
+        self._frequencies = tf.gather(frequencies, sample_idx)
+        self._interp_left = tf.constant(left, tf.int32)
+        self._interp_right = tf.constant(right, tf.int32)
+        self._interp_weight = tf.cast(weight, self.cdtype)
+
+    def _generate(self, channel_model, frequencies):
+        """ Sample the channel impulse response and evaluate it at the given
+        frequencies """
+        if self.surrogate is not None:
+            return self.surrogate(channel_model,
+                                  self.batch_size,
+                                  self.resource_grid.num_ofdm_symbols,
+                                  frequencies)
+        a, tau = channel_model(self.batch_size,
+                               self.resource_grid.num_ofdm_symbols,
+                               1. / self.resource_grid.ofdm_symbol_duration)
+        return cir_to_ofdm_channel(frequencies, a, tau)
+
     def call(self, channel_model):
         """ Generate OFDM channel matrix"""
+        if self.freq_stride > 1 or self.surrogate is not None:
+            # [batch_size, num_rx, num_rx_ant, num_tx, num_tx_ant,
+            #  num_ofdm_symbols, num_freq_samples]
+            return self._generate(channel_model, self._frequencies)
 
         # Instantiate the OFDM channel generator
         ofdm_channel = GenerateOFDMChannel(channel_model,
@@ -38,35 +139,80 @@ class ChannelMatrix(Block):
         h_freq = ofdm_channel(self.batch_size)
         return h_freq
 
+    def expand(self, h_freq):
+        """ Interpolate a frequency-decimated channel matrix to all
+        subcarriers. Identity if the channel is generated at full
+        resolution """
+        if self.freq_stride == 1:
+            return h_freq
+        h_left = tf.gather(h_freq, self._interp_left, axis=-1)
+        h_right = tf.gather(h_freq, self._interp_right, axis=-1)
+        # [batch_size, num_rx, num_rx_ant, num_tx, num_tx_ant,
+        #  num_ofdm_symbols, num_subcarriers]
+        return h_left + self._interp_weight * (h_right - h_left)
+
+    def decimation_error(self, channel_model):
+        """ Normalized mean squared error [dB] of the decimated and
+        interpolated channel against the full-resolution channel, computed on
+        one common channel impulse response """
+        frequencies = subcarrier_frequencies(self.resource_grid.fft_size,
+                                             self.resource_grid.subcarrier_spacing,
+                                             precision=self.precision)
+        a, tau = channel_model(self.batch_size,
+                               self.resource_grid.num_ofdm_symbols,
+                               1. / self.resource_grid.ofdm_symbol_duration)
+        h_full = cir_to_ofdm_channel(frequencies, a, tau)
+        h_interp = self.expand(cir_to_ofdm_channel(self._frequencies, a, tau))
+        err = tf.reduce_sum(tf.abs(h_full - h_interp)**2)
+        energy = tf.reduce_sum(tf.abs(h_full)**2)
+        return 10 * np.log10(float(err / energy) + 1e-30)
+
+    def generate(self,
+                 channel_model,
+                 slot):
+        """ Generate the channel realization of the coherence block
+        containing slot """
+        if self.rng is not None:
+            self.rng.reset_global('channel', slot // self.coherence_time,
+                                  *self.rng_counters)
+        return self.call(channel_model)
+
     def update(self,
                channel_model,
                h_freq,
                slot):
         """ Update channel matrix every coherence_time slots """
-        # Generate new channel realization
-        h_freq_new = self.call(channel_model)
-
-        # Change to new channel every coherence_time slots
-        change = tf.cast(tf.math.mod(
-            slot, self.coherence_time) == 0, self.cdtype)
-        h_freq = change * h_freq_new + \
-            (tf.cast(1, self.cdtype) - change) * h_freq
-        return h_freq
+        # Change to new channel every coherence_time slots. The channel is
+        # only generated in those slots
+        return tf.cond(tf.math.mod(slot, self.coherence_time) == 0,
+                       lambda: self.generate(channel_model, slot),
+                       lambda: h_freq)
 
     def apply_fading(self,
-                     h_freq):
-        """ Apply fading, modeled as an autoregressive process, to channel matrix """
+                     h_freq,
+                     fading,
+                     slot=None):
+        """ Apply fading, modeled as an autoregressive process, to channel
+        matrix. fading is the fading factor of the previous slot. Returns the
+        channel matrix and the fading factor of the current slot """
+        # Fading noise, drawn from the stream of the slot if available
+        if self.rng is None or slot is None:
+            noise = config.tf_rng.uniform(
+                fading.shape, minval=-.1, maxval=.1, dtype=self.rdtype)
+        else:
+            noise = tf.random.stateless_uniform(
+                fading.shape, seed=self.rng.seed('fading', slot),
+                minval=-.1, maxval=.1, dtype=self.rdtype)
         # Multiplicative fading factor evolving via an AR process
         # [batch_size, num_rx, num_tx]
-        self.fading = tf.cast(1, self.rdtype) - self.rho_fading + self.rho_fading * self.fading + \
-            config.tf_rng.uniform(
-                self.fading.shape, minval=-.1, maxval=.1, dtype=self.rdtype)
-        self.fading = tf.maximum(self.fading, tf.cast(0, self.rdtype))
+        fading = tf.cast(1, self.rdtype) - self.rho_fading + self.rho_fading * fading + \
+            noise
+        fading = tf.maximum(fading, tf.cast(0, self.rdtype))
         # [batch_size, num_rx, 1, num_tx, 1, 1, 1]
-        fading_expand = insert_dims(self.fading, 1, axis=2)
+        fading_expand = insert_dims(fading, 1, axis=2)
         fading_expand = insert_dims(fading_expand, 3, axis=4)
 
         # Channel matrix in the current slot
         h_freq_fading = tf.cast(tf.math.sqrt(
             fading_expand), self.cdtype) * h_freq
-        return h_freq_fading
+        return h_freq_fading, fading
@@ -0,0 +1,167 @@
+# models/phy_abstraction.py
+
+import os
+import json
+import numpy as np
+import tensorflow as tf
+import sionna
+from sionna.phy import config
+from sionna.sys import PHYAbstraction
+
+from utils.cache_utils import get_cache_dir, hash_key, file_signature
+
+# CachedPHYAbstraction overrides private methods and reads private attributes
+# of PHYAbstraction, which were checked against these Sionna versions
+SIONNA_VERSIONS = ['1.1']
+PHY_ABSTRACTION_HOOKS = ['_interpolate_bler', '_interpolate_snr',
+                         'snr_db_interp_min_max_delta',
+                         'cbs_interp_min_max_delta', 'bler_interp_delta']
+
+
+def phy_tables_supported():
+    """ Whether the installed Sionna version supports CachedPHYAbstraction """
+    version = '.'.join(sionna.__version__.split('.')[:2])
+    return version in SIONNA_VERSIONS and \
+        all(hasattr(PHYAbstraction, hook) for hook in PHY_ABSTRACTION_HOOKS)
+
+
+class CachedPHYAbstraction(PHYAbstraction):
+    """ PHY abstraction whose interpolated BLER/SINR tables are precomputed
+    once and stored on disk.
+
+    The tables are dense tensors on a uniform (category, MCS table, MCS, CBS,
+    SINR) grid, saved as ``.npy`` files and loaded into memory as tensors, so
+    that building a simulator skips the BLER interpolation. The per-slot
+    lookup is that of :class:`~sionna.sys.PHYAbstraction`, hence the BLER,
+    decoded bits and HARQ feedback are unchanged. If verify is True and the
+    tables are built, the cached object is checked against PHYAbstraction
+    with verify_phy_abstraction, which interpolates the tables once more.
+
+    Requires a Sionna version listed in SIONNA_VERSIONS.
+    """
+
+    def __init__(self, cache_dir=None, verify=False, precision=None,
+                 **kwargs):
+        assert phy_tables_supported(), \
+            f"Cached PHY tables are not supported with Sionna " \
+            f"{sionna.__version__} (supported: {SIONNA_VERSIONS})"
+        # Must be set before the parent constructor triggers the interpolation
+        self._table_cache_dir = get_cache_dir('bler_tables', cache_dir)
+        self._tables_built = False
+        super().__init__(precision=precision, **kwargs)
+        if verify and self._tables_built:
+            # The reference interpolates the tables, the candidate loads them
+            # from the cache
+            mismatch = verify_phy_abstraction(
+                PHYAbstraction(precision=precision, **kwargs),
+                CachedPHYAbstraction(cache_dir=cache_dir, precision=precision,
+                                     **kwargs))
+            assert not any(mismatch.values()), \
+                f"Cached PHY tables differ from PHYAbstraction: {mismatch}"
+
+    def _table_cache_path(self, which):
+        """ Directory storing the interpolated table for the current BLER
+        tables and interpolation grid """
+        key = {'which': which,
+               'files': [file_signature(f) for f in self.bler_table_filenames
+                         if os.path.isfile(f)],
+               'snr_grid': list(self.snr_db_interp_min_max_delta),
+               'cbs_grid': list(self.cbs_interp_min_max_delta),
+               'interp_fun': type(self._bler_interp_fun.__self__).__name__
+               if hasattr(self._bler_interp_fun, '__self__') else
+               repr(self._bler_interp_fun),
+               'kwargs': self._kwargs,
+               'dtype': self.rdtype.name}
+        if which == 'snr':
+            key['bler_grid'] = self.bler_interp_delta
+        return os.path.join(self._table_cache_dir, hash_key(key))
+
+    def _load_table(self, which):
+        """ Load a cached table, if available. The table is copied into a
+        tensor, hence held in memory as the interpolated one """
+        path = os.path.join(self._table_cache_path(which), 'table.npy')
+        if not os.path.isfile(path):
+            return None
+        return tf.convert_to_tensor(np.load(path), dtype=self.rdtype)
+
+    def _save_table(self, which, table):
+        """ Store a table atomically, so that concurrent runs never read a
+        partially written file """
+        path = self._table_cache_path(which)
+        os.makedirs(path, exist_ok=True)
+        tmp_filename = os.path.join(path, f'table.{os.getpid()}.tmp.npy')
+        np.save(tmp_filename, table.numpy())
+        os.replace(tmp_filename, os.path.join(path, 'table.npy'))
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'shape': list(table.shape),
+                       'snr_db_interp_min_max_delta':
+                           list(self.snr_db_interp_min_max_delta),
+                       'cbs_interp_min_max_delta':
+                           list(self.cbs_interp_min_max_delta)}, f)
+
+    def _interpolate_bler(self):
+        """ Load the (CBS, SINR) -> BLER table from cache, or interpolate and
+        store it """
+        table = self._load_table('bler')
+        if table is None:
+            super()._interpolate_bler()
+            self._save_table('bler', self._bler_table_interp)
+            self._tables_built = True
+        else:
+            self._bler_table_interp = table
+
+    def _interpolate_snr(self):
+        """ Load the (CBS, BLER) -> SINR table from cache, or interpolate and
+        store it """
+        table = self._load_table('snr')
+        if table is None:
+            super()._interpolate_snr()
+            self._save_table('snr', self._snr_table_interp)
+            self._tables_built = True
+        else:
+            self._snr_table_interp = table
+
+
+def verify_phy_abstraction(reference,
+                           candidate,
+                           batch_shape=(1, 21, 10),
+                           num_ofdm_sym=1,
+                           num_subcarriers=128,
+                           mcs_table_index=1,
+                           mcs_category=1,
+                           seed=42):
+    """ Check that two PHY abstraction objects return the same BLER, decoded
+    bits and HARQ feedback on random SINR and MCS inputs.
+
+    Both objects are called with the same random seed, so that HARQ feedback
+    is drawn from identical random numbers. The state of the global
+    generator is restored afterwards. Returns a dictionary with the number of
+    mismatching users per output.
+    """
+    batch_shape = list(batch_shape)
+    rng = np.random.default_rng(seed)
+    # [..., num_ofdm_sym, num_subcarriers, num_ut, num_streams_per_ut]
+    sinr_db = rng.uniform(-10, 35, batch_shape[:-1] +
+                          [num_ofdm_sym, num_subcarriers, batch_shape[-1], 1])
+    # Unscheduled resources have zero SINR
+    sinr = np.where(rng.uniform(size=sinr_db.shape) < .5,
+                    10**(sinr_db/10), 0.)
+    # MCS indices 0 to 28
+    mcs_index = rng.integers(0, 29, batch_shape)
+
+    rng_state = tf.identity(config.tf_rng.state)
+    outputs = []
+    for phy_abs in [reference, candidate]:
+        config.tf_rng.reset_from_seed(seed)
+        outputs.append(phy_abs(tf.constant(mcs_index, tf.int32),
+                               sinr=tf.constant(sinr, phy_abs.rdtype),
+                               mcs_table_index=mcs_table_index,
+                               mcs_category=mcs_category))
+    config.tf_rng.reset(rng_state)
+
+    mismatch = {}
+    for key, ref, cand in zip(['num_decoded_bits', 'harq_feedback',
+                               'sinr_eff', 'tbler', 'bler'],
+                              outputs[0], outputs[1]):
+        mismatch[key] = int(np.sum(ref.numpy() != cand.numpy()))
+    return mismatch
@@ -0,0 +1,278 @@
+# models/surrogate_channel.py
+
+import time
+import numpy as np
+import tensorflow as tf
+import sionna
+from sionna.phy import config, Block, PI, SPEED_OF_LIGHT
+
+from models.phy_abstraction import SIONNA_VERSIONS
+
+# Private members of the Sionna 3GPP system-level channel model read by the
+# surrogate
+SURROGATE_HOOKS = ['_scenario', '_lsp_sampler', '_always_generate_lsp',
+                   '_cir_sampler._gcs_to_lcs']
+
+
+def surrogate_supported(channel_model=None):
+    """ Whether the installed Sionna version supports SurrogateChannel and,
+    if given, channel_model exposes the members it reads """
+    version = '.'.join(sionna.__version__.split('.')[:2])
+    if version not in SIONNA_VERSIONS:
+        return False
+    if channel_model is None:
+        return True
+    for hook in SURROGATE_HOOKS:
+        obj = channel_model
+        for attr in hook.split('.'):
+            if not hasattr(obj, attr):
+                return False
+            obj = getattr(obj, attr)
+    return True
+
+
+class SurrogateChannel(Block):
+    """ Low-cost statistical surrogate of the 3GPP TR 38.901 system-level
+    channel.
+
+    The channel of each BS-UT link is built from the topology and LSPs of
+    the 3GPP channel model (pathloss, shadow fading, LoS state, K-factor,
+    delay and angular spreads), without sampling clusters and rays:
+    - Rician fading: a deterministic LoS component between the antenna
+      arrays, weighted by the K-factor in LoS, plus a Rayleigh component
+    - Kronecker spatial correlation at each end, from the antenna positions
+      and the angular spreads under a Gaussian angular spectrum.
+      Cross-polarized elements are uncorrelated
+    - Frequency correlation from a tapped delay line of num_taps taps with
+      an exponential power delay profile of the link delay spread
+    - Element gains of both arrays in the LoS direction for the LoS
+      component, and averaged over the angular spreads around it for the
+      Rayleigh component
+    The channel is constant over the OFDM symbols of a slot.
+    Reads private members of the Sionna channel model, hence requires a
+    Sionna version listed in SIONNA_VERSIONS.
+    """
+
+    def __init__(self, num_taps=8, max_delay_spreads=4., precision=None):
+        assert surrogate_supported(), \
+            f"The surrogate channel is not supported with Sionna " \
+            f"{sionna.__version__} (supported: {SIONNA_VERSIONS})"
+        super().__init__(precision=precision)
+        self.num_taps = num_taps
+        # Taps span [0, max_delay_spreads * delay spread]
+        self.max_delay_spreads = max_delay_spreads
+
+    def _lcs_direction(self, channel_model, orientations, zenith, azimuth):
+        """ Zenith and azimuth [rad] in the local coordinate system of the
+        array, from global angles [deg] of shape [batch_size, num_bs,
+        num_ut]. orientations are broadcastable to [batch_size, num_bs,
+        num_ut, 3] """
+        deg = tf.cast(PI / 180., self.rdtype)
+        return channel_model._cir_sampler._gcs_to_lcs(
+            orientations, zenith * deg, azimuth * deg)
+
+    def _element_gain(self, array, theta, phi):
+        """ Power gain of the array elements in direction (theta, phi) """
+        f_theta, f_phi = array.ant_pol1.field(theta, phi)
+        return f_theta**2 + f_phi**2
+
+    def _mean_element_gain(self, channel_model, array, orientations, zenith,
+                           azimuth, zenith_spread, azimuth_spread):
+        """ Power gain of the array elements averaged over a Gaussian
+        angular spectrum around the global direction (zenith, azimuth) [deg],
+        of spreads [deg], with a 3-point Gauss-Hermite rule per angle """
+        nodes = [(0., 2. / 3.), (-np.sqrt(3.), 1. / 6.), (np.sqrt(3.), 1. / 6.)]
+        gain = 0.
+        for zenith_node, zenith_weight in nodes:
+            for azimuth_node, azimuth_weight in nodes:
+                theta, phi = self._lcs_direction(
+                    channel_model, orientations,
+                    tf.clip_by_value(zenith + zenith_node * zenith_spread,
+                                     0., 180.),
+                    azimuth + azimuth_node * azimuth_spread)
+                gain += zenith_weight * azimuth_weight * \
+                    self._element_gain(array, theta, phi)
+        return gain
+
+    def _steering_vector(self, array, theta, phi, wavelength):
+        """ Array response [..., num_ant] in direction (theta, phi) """
+        # [..., 3]
+        direction = tf.stack([tf.sin(theta) * tf.cos(phi),
+                              tf.sin(theta) * tf.sin(phi),
+                              tf.cos(theta)], axis=-1)
+        # [..., num_ant]
+        phase = 2. * PI / wavelength * tf.linalg.matvec(
+            tf.cast(array.ant_pos, self.rdtype), direction)
+        return tf.exp(tf.complex(tf.zeros_like(phase), phase))
+
+    def _correlation_sqrt(self, array, azimuth_spread, zenith_spread,
+                          wavelength):
+        """ Square root [..., num_ant, num_ant] of the spatial correlation
+        matrix of an array, for angular spreads [deg] of shape [...] """
+        deg = tf.cast(PI / 180., self.rdtype)
+        pos = tf.cast(array.ant_pos, self.rdtype) / wavelength
+        # Horizontal (y) and vertical (z) separations [wavelengths]
+        # [num_ant, num_ant]
+        dy = pos[:, tf.newaxis, 1] - pos[tf.newaxis, :, 1]
+        dz = pos[:, tf.newaxis, 2] - pos[tf.newaxis, :, 2]
+        sigma_az = (azimuth_spread * deg)[..., tf.newaxis, tf.newaxis]
+        sigma_zen = (zenith_spread * deg)[..., tf.newaxis, tf.newaxis]
+        corr = tf.exp(-2. * PI**2 * ((dy * sigma_az)**2 + (dz * sigma_zen)**2))
+        if array.polarization == 'dual':
+            # Elements of different polarization are uncorrelated
+            pol = np.zeros(array.num_ant)
+            pol[array.ant_ind_pol2.numpy()] = 1
+            corr *= tf.cast(pol[:, None] == pol[None, :], self.rdtype)
+        corr += 1e-6 * tf.eye(array.num_ant, dtype=self.rdtype)
+        return tf.cast(tf.linalg.cholesky(corr), self.cdtype)
+
+    def call(self, channel_model, batch_size, num_ofdm_symbols, frequencies):
+        """ Generate the channel frequency response [batch_size, num_rx,
+        num_rx_ant, num_tx, num_tx_ant, num_ofdm_symbols, num_freq] at the
+        given frequencies, in the link direction of channel_model """
+        assert surrogate_supported(channel_model), \
+            f"The channel model does not expose {SURROGATE_HOOKS}"
+        scenario = channel_model._scenario
+        if channel_model._always_generate_lsp:
+            lsp = channel_model._lsp_sampler()
+        else:
+            lsp = channel_model._lsp
+        bs_array, ut_array = scenario.bs_array, scenario.ut_array
+        wavelength = tf.cast(SPEED_OF_LIGHT / scenario.carrier_frequency,
+                             self.rdtype)
+
+        # Directions of the LoS path in each local coordinate system
+        # [batch_size, num_bs, num_ut]
+        theta_bs, phi_bs = self._lcs_direction(
+            channel_model, scenario.bs_orientations[:, :, tf.newaxis],
+            scenario.los_zod, scenario.los_aod)
+        theta_ut, phi_ut = self._lcs_direction(
+            channel_model, scenario.ut_orientations[:, tf.newaxis],
+            scenario.los_zoa, scenario.los_aoa)
+
+        # Element gains of the LoS and of the Rayleigh components. The
+        # clusters of the latter arrive from directions spread around the
+        # LoS one
+        # [batch_size, num_bs, num_ut]
+        gain_los = self._element_gain(bs_array, theta_bs, phi_bs) * \
+            self._element_gain(ut_array, theta_ut, phi_ut)
+        gain_nlos = self._mean_element_gain(
+            channel_model, bs_array, scenario.bs_orientations[:, :, tf.newaxis],
+            scenario.los_zod, scenario.los_aod, lsp.zsd, lsp.asd) * \
+            self._mean_element_gain(
+                channel_model, ut_array, scenario.ut_orientations[:, tf.newaxis],
+                scenario.los_zoa, scenario.los_aoa, lsp.zsa, lsp.asa)
+
+        # Large-scale power gain of each link
+        # [batch_size, num_bs, num_ut]
+        gain = tf.ones_like(gain_los)
+        if scenario.pathloss_enabled:
+            pl_db = channel_model._lsp_sampler.sample_pathloss()
+            gain *= tf.pow(tf.cast(10., self.rdtype), -pl_db / 10.)
+        if scenario.shadow_fading_enabled:
+            gain *= lsp.sf
+
+        # Rician K-factor, in LoS only
+        k_factor = tf.where(scenario.los, lsp.k_factor,
+                            tf.zeros_like(lsp.k_factor))
+        los_weight = tf.cast(tf.sqrt(gain_los * k_factor / (k_factor + 1.)),
+                             self.cdtype)
+        nlos_weight = tf.cast(tf.sqrt(gain_nlos / (k_factor + 1.)),
+                              self.cdtype)
+
+        # LoS component
+        # [batch_size, num_bs, num_ut, num_ut_ant, num_bs_ant]
+        a_bs = self._steering_vector(bs_array, theta_bs, phi_bs, wavelength)
+        a_ut = self._steering_vector(ut_array, theta_ut, phi_ut, wavelength)
+        h_los = a_ut[..., :, tf.newaxis] * a_bs[..., tf.newaxis, :]
+
+        # Rayleigh component: Kronecker-correlated taps
+        # [batch_size, num_bs, num_ut, num_ant, num_ant]
+        sqrt_corr_bs = self._correlation_sqrt(bs_array, lsp.asd, lsp.zsd,
+                                              wavelength)
+        sqrt_corr_ut = self._correlation_sqrt(ut_array, lsp.asa, lsp.zsa,
+                                              wavelength)
+        shape = [batch_size, scenario.num_bs, scenario.num_ut, self.num_taps,
+                 ut_array.num_ant, bs_array.num_ant]
+        w = tf.complex(config.tf_rng.normal(shape, dtype=self.rdtype),
+                       config.tf_rng.normal(shape, dtype=self.rdtype)) / \
+            tf.cast(tf.sqrt(2.), self.cdtype)
+        # [batch_size, num_bs, num_ut, num_taps, num_ut_ant, num_bs_ant]
+        h_taps = tf.matmul(tf.matmul(sqrt_corr_ut[:, :, :, tf.newaxis], w),
+                           sqrt_corr_bs[:, :, :, tf.newaxis], adjoint_b=True)
+
+        # Exponential power delay profile over the taps
+        # [batch_size, num_bs, num_ut, num_taps]
+        tap_idx = tf.range(self.num_taps, dtype=self.rdtype)
+        delays = lsp.ds[..., tf.newaxis] * self.max_delay_spreads * \
+            tap_idx / self.num_taps
+        powers = tf.exp(-delays / lsp.ds[..., tf.newaxis])
+        powers /= tf.reduce_sum(powers, axis=-1, keepdims=True)
+        h_taps *= tf.cast(tf.sqrt(powers), self.cdtype)[..., tf.newaxis,
+                                                          tf.newaxis]
+
+        # Frequency response of the taps
+        # [batch_size, num_bs, num_ut, num_taps, num_freq]
+        phase = -2. * PI * delays[..., tf.newaxis] * \
+            tf.cast(frequencies, self.rdtype)
+        # [batch_size, num_bs, num_ut, num_ut_ant, num_bs_ant, num_freq]
+        h_nlos = tf.einsum('...tij,...tf->...ijf', h_taps,
+                           tf.exp(tf.complex(tf.zeros_like(phase), phase)))
+        h = los_weight[..., tf.newaxis, tf.newaxis, tf.newaxis] * \
+            h_los[..., tf.newaxis] + \
+            nlos_weight[..., tf.newaxis, tf.newaxis, tf.newaxis] * h_nlos
+        h *= tf.cast(tf.sqrt(gain), self.cdtype)[..., tf.newaxis, tf.newaxis,
+                                                  tf.newaxis]
+
+        if scenario.direction == 'downlink':
+            # [batch_size, num_ut, num_ut_ant, num_bs, num_bs_ant, num_freq]
+            h = tf.transpose(h, [0, 2, 3, 1, 4, 5])
+        else:
+            # [batch_size, num_bs, num_bs_ant, num_ut, num_ut_ant, num_freq]
+            h = tf.transpose(h, [0, 1, 4, 2, 3, 5])
+        # Constant over the OFDM symbols of the slot
+        h = tf.expand_dims(h, axis=-2)
+        return tf.tile(h, [1] * 5 + [num_ofdm_symbols, 1])
+
+
+def channel_source_fidelity(channel_matrix, surrogate_matrix, channel_model,
+                            num_realizations=4):
+    """ Compare the surrogate channel against the full 3GPP model on the same
+    topology and LSPs. Returns the mean and standard deviation [dB] of the
+    per-link gain difference, the mean frequency correlation at one PRB and
+    the mean correlation of adjacent BS antennas of each model, and the
+    speedup of the surrogate in generation time """
+    stats = {}
+    for name, matrix in [('tr38901', channel_matrix),
+                         ('surrogate', surrogate_matrix)]:
+        gains, freq_corr, ant_corr = [], [], []
+        start = time.perf_counter()
+        for _ in range(num_realizations):
+            # [batch_size, num_rx, num_rx_ant, num_tx, num_tx_ant,
+            #  num_ofdm_symbols, num_subcarriers]
+            h = matrix.expand(matrix.call(channel_model)).numpy()
+            gains.append(np.mean(np.abs(h)**2, axis=(2, 4, 5, 6)))
+            h = h[..., 0, :]
+            lag = min(12, h.shape[-1] - 1)
+            freq_corr.append(np.abs(np.mean(h[..., lag:] *
+                                            np.conj(h[..., :-lag]))) /
+                             np.mean(np.abs(h)**2))
+            if h.shape[4] > 1:
+                ant_corr.append(np.abs(np.mean(h[:, :, :, :, 1:] *
+                                               np.conj(h[:, :, :, :, :-1]))) /
+                                np.mean(np.abs(h)**2))
+        stats[name] = {'elapsed': time.perf_counter() - start,
+                       'gain_db': 10 * np.log10(np.mean(gains, axis=0) +
+                                                1e-30),
+                       'freq_corr': float(np.mean(freq_corr)),
+                       'ant_corr': float(np.mean(ant_corr))
+                       if ant_corr else float('nan')}
+    diff_db = stats['surrogate']['gain_db'] - stats['tr38901']['gain_db']
+    return {'gain_diff_mean_db': float(np.mean(diff_db)),
+            'gain_diff_std_db': float(np.std(diff_db)),
+            'freq_corr_prb': (stats['tr38901']['freq_corr'],
+                              stats['surrogate']['freq_corr']),
+            'tx_ant_corr': (stats['tr38901']['ant_corr'],
+                            stats['surrogate']['ant_corr']),
+            'speedup': stats['tr38901']['elapsed'] /
+                       stats['surrogate']['elapsed']}
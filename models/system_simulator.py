@@ -1,5 +1,6 @@
 # models/system_simulator.py
 
+import sionna
 import tensorflow as tf
 from sionna.phy import config, Block
 from sionna.phy.constants import BOLTZMANN_CONSTANT
@@ -8,12 +9,103 @@ from sionna.phy.channel.tr38901 import UMi, UMa, RMa
 from sionna.sys import PHYAbstraction, OuterLoopLinkAdaptation, \
     gen_hexgrid_topology, get_pathloss, open_loop_uplink_power_control, \
     downlink_fair_power_control, get_num_hex_in_grid, PFSchedulerSUMIMO
+from sionna.sys.topology import HexGrid
 from sionna.sys.utils import spread_across_subcarriers
 
-from models.channel_matrix import ChannelMatrix
+from models.channel_matrix import ChannelMatrix, get_freq_samples
+from models.phy_abstraction import CachedPHYAbstraction
+from models.surrogate_channel import channel_source_fidelity
 from utils.stream_management import get_stream_management
-from utils.sinr_utils import get_sinr, estimate_achievable_rate
+from utils.sinr_utils import get_sinr, get_sinr_active_set, \
+    estimate_achievable_rate, sanitize_sinr
+from utils.precoder_cache import RZFPrecoderCache
+from utils.topology_cache import TopologyCache
+from utils.rng_utils import RNGStreams
 from utils.results_utils import init_result_history, record_results
+from utils.convergence_utils import normalize_convergence, \
+    init_convergence_state, slot_metrics, update_convergence_state, \
+    confidence_interval, is_converged
+from utils.traffic_utils import normalize_traffic, init_queue, \
+    init_traffic_counters, draw_arrivals, enqueue_arrivals, is_backlogged, \
+    drain_queue, QUEUE_KEYS
+
+
+# Parameters that can be set per policy branch. Keys that are not specified
+# fall back to the constructor/call arguments of SystemLevelSimulator
+POLICY_KEYS = ['name', 'pf_beta', 'fairness_dl', 'guaranteed_power_ratio_dl',
+               'alpha_ul', 'p0_dbm_ul', 'bler_target', 'olla_delta_up']
+
+# Parameters that can be set per carrier. Keys that are not specified fall
+# back to the constructor arguments of SystemLevelSimulator
+CARRIER_KEYS = ['name', 'carrier_frequency', 'ut_array', 'bs_array',
+                'bs_max_power_dbm', 'ut_max_power_dbm']
+
+
+def normalize_policies(policies, pf_beta, directions=('downlink',),
+                       carriers=None):
+    """ Validate the list of policies and fill in names and PF beta.
+    With several link directions, each policy is simulated in every
+    direction and the direction is appended to its name. If a list of
+    carrier names is provided, each policy is simulated on every carrier,
+    the carrier name is prepended to its name and the carrier index is
+    stored in 'carrier'. Branches are ordered by carrier """
+    if policies is None:
+        policies = [{'name': 'default'}]
+    assert len(policies) > 0, "At least one policy is required"
+    normalized = []
+    for carrier_idx, carrier in enumerate(carriers or [None]):
+        for ii, policy in enumerate(policies):
+            unknown = set(policy) - set(POLICY_KEYS)
+            assert not unknown, \
+                f"Unknown policy parameters: {sorted(unknown)}"
+            for direction in directions:
+                branch = dict(policy)
+                branch.setdefault('name', f'policy_{ii}')
+                branch.setdefault('pf_beta', pf_beta)
+                if len(directions) > 1:
+                    branch['name'] = f"{branch['name']}/{direction}"
+                # Name of the policy across carriers
+                branch['policy'] = branch['name']
+                if carrier is not None:
+                    branch['name'] = f"{carrier}/{branch['name']}"
+                branch['direction'] = direction
+                branch['carrier'] = carrier_idx
+                normalized.append(branch)
+    names = [policy['name'] for policy in normalized]
+    assert len(set(names)) == len(names), "Policy names must be unique"
+    return normalized
+
+
+def normalize_carriers(carriers, carrier_frequency, ut_array, bs_array,
+                       bs_max_power_dbm, ut_max_power_dbm):
+    """ Validate the list of carriers and fill in names, antenna arrays and
+    transmit powers. If carriers is None, a single carrier is defined by the
+    constructor arguments of SystemLevelSimulator """
+    if carriers is None:
+        carriers = [{'name': 'default',
+                     'carrier_frequency': carrier_frequency}]
+    assert len(carriers) > 0, "At least one carrier is required"
+    normalized = []
+    for ii, carrier in enumerate(carriers):
+        unknown = set(carrier) - set(CARRIER_KEYS)
+        assert not unknown, f"Unknown carrier parameters: {sorted(unknown)}"
+        assert 'carrier_frequency' in carrier, \
+            "The carrier frequency of each carrier is required"
+        carrier = dict(carrier)
+        carrier.setdefault('name', f'carrier_{ii}')
+        carrier.setdefault('ut_array', ut_array)
+        carrier.setdefault('bs_array', bs_array)
+        carrier.setdefault('bs_max_power_dbm', bs_max_power_dbm)
+        carrier.setdefault('ut_max_power_dbm', ut_max_power_dbm)
+        # Channels of all carriers share the same dimensions
+        assert carrier['ut_array'].num_ant == ut_array.num_ant and \
+            carrier['bs_array'].num_ant == bs_array.num_ant and \
+            carrier['bs_array'].polarization == bs_array.polarization, \
+            "All carriers must have the same number of antennas"
+        normalized.append(carrier)
+    names = [carrier['name'] for carrier in normalized]
+    assert len(set(names)) == len(names), "Carrier names must be unique"
+    return normalized
 
 
 class SystemLevelSimulator(Block):
@@ -37,78 +129,304 @@ class SystemLevelSimulator(Block):
                  o2i_model='low',
                  average_street_width=20.0,
                  average_building_height=5.0,
+                 policies=None,
+                 cache_phy_tables=False,
+                 cache_dir=None,
+                 freq_stride=1,
+                 freq_interpolation='linear',
+                 convergence=None,
+                 active_set_sinr=False,
+                 rzf_cache_tolerance=None,
+                 rzf_cache_max_update_ratio=1.,
+                 compact_hist_float=False,
+                 jit_compile=True,
+                 sinr_diag_loading=0.,
+                 topology_cache=None,
+                 rng_streams=False,
+                 drop_id=0,
+                 channel_source='tr38901',
+                 carriers=None,
+                 traffic=None,
                  precision=None):
         super().__init__(precision=precision)
 
         assert scenario in ['umi', 'uma', 'rma']
-        assert direction in ['uplink', 'downlink']
+        assert direction in ['uplink', 'downlink', 'duplex']
         self.scenario = scenario
         self.batch_size = int(batch_size)
         self.resource_grid = resource_grid
         self.num_ut_per_sector = int(num_ut_per_sector)
         self.direction = direction
+        # In duplex mode, the channel is generated in the downlink and the
+        # uplink channel is obtained by reciprocity
+        if direction == 'duplex':
+            self.link_directions = ['downlink', 'uplink']
+            self.channel_direction = 'downlink'
+        else:
+            self.link_directions = [direction]
+            self.channel_direction = direction
         self.bs_max_power_dbm = bs_max_power_dbm  # [dBm]
         self.ut_max_power_dbm = ut_max_power_dbm  # [dBm]
         self.coherence_time = tf.cast(coherence_time, tf.int32)  # [slots]
+        # The channel is generated every freq_stride subcarriers
+        self.freq_stride = int(freq_stride)
+        self.freq_interpolation = freq_interpolation
+        # 'tr38901' or 'surrogate', see ChannelMatrix
+        self.channel_source = channel_source
         num_cells = get_num_hex_in_grid(num_rings)
         self.num_bs = num_cells * 3
         self.num_ut = self.num_bs * self.num_ut_per_sector
-        self.num_ut_ant = ut_array.num_ant
-        self.num_bs_ant = bs_array.num_ant
-        if bs_array.polarization == 'dual':
-            self.num_bs_ant *= 2
-        if self.direction == 'uplink':
+        # Antenna elements of both polarizations are counted by num_ant: it
+        # must not be doubled for dual polarization, as these counts size the
+        # channel carried across runs
+        self.num_ut_ant = int(ut_array.num_ant)
+        self.num_bs_ant = int(bs_array.num_ant)
+        # Transmitters and receivers of the generated channel
+        if self.channel_direction == 'uplink':
             self.num_tx, self.num_rx = self.num_ut, self.num_bs
             self.num_tx_ant, self.num_rx_ant = self.num_ut_ant, self.num_bs_ant
-            self.num_tx_per_sector = self.num_ut_per_sector
         else:
             self.num_tx, self.num_rx = self.num_bs, self.num_ut
             self.num_tx_ant, self.num_rx_ant = self.num_bs_ant, self.num_ut_ant
-            self.num_tx_per_sector = 1
 
-        # Assume 1 stream for UT antenna
-        self.num_streams_per_ut = resource_grid.num_streams_per_tx
+        # Assume 1 stream for UT antenna. Stored as a Python int, as it
+        # determines static shapes and storage types within the slot loop
+        self.num_streams_per_ut = int(resource_grid.num_streams_per_tx)
+
+        # Compute SINR only for the scheduled user of each sector, on a
+        # compact channel with one transmitter and one receiver per sector
+        self.active_set_sinr = active_set_sinr
+
+        # Set TX-RX pairs via StreamManagement, for each link direction
+        self.links = {}
+        for link_direction in self.link_directions:
+            if link_direction == 'uplink':
+                num_tx, num_rx = self.num_ut, self.num_bs
+                num_tx_per_sector = self.num_ut_per_sector
+            else:
+                num_tx, num_rx = self.num_bs, self.num_ut
+                num_tx_per_sector = 1
+            self.links[link_direction] = {
+                'num_tx_per_sector': num_tx_per_sector,
+                'stream_management': get_stream_management(
+                    link_direction,
+                    num_rx,
+                    num_tx,
+                    self.num_streams_per_ut,
+                    num_ut_per_sector),
+                'stream_management_active': get_stream_management(
+                    link_direction,
+                    self.num_bs,
+                    self.num_bs,
+                    self.num_streams_per_ut,
+                    1)}
+
+        # Stream management of the generated channel
+        self.stream_management = \
+            self.links[self.channel_direction]['stream_management']
+        self.num_tx_per_sector = \
+            self.links[self.channel_direction]['num_tx_per_sector']
 
-        # Set TX-RX pairs via StreamManagement
-        self.stream_management = get_stream_management(direction,
-                                                       self.num_rx,
-                                                       self.num_tx,
-                                                       self.num_streams_per_ut,
-                                                       num_ut_per_sector)
         # Noise power per subcarrier
         self.no = tf.cast(BOLTZMANN_CONSTANT * temperature *
                           resource_grid.subcarrier_spacing, self.rdtype)
 
+        # If not None, the DL RZF precoder is cached per coherence block and
+        # only recomputed when the fading amplitudes changed by more than
+        # rzf_cache_tolerance (relative), for at most rzf_cache_max_update_ratio
+        # of the transmitters per slot
+        self.precoder_cache = None
+        if rzf_cache_tolerance is not None and \
+                self.channel_direction == 'downlink':
+            self.precoder_cache = RZFPrecoderCache(
+                resource_grid,
+                self.stream_management,
+                alpha=self.no,
+                tolerance=rzf_cache_tolerance,
+                diag_loading=sinr_diag_loading,
+                max_update_ratio=rzf_cache_max_update_ratio,
+                precision=self.precision)
+
+        # Regularization of the RZF precoder relative to the channel gain, on
+        # top of the noise power
+        self.sinr_diag_loading = sinr_diag_loading
+
+        # Store effective SINR and pathloss as float16 [dB] in the history
+        self.compact_hist_float = compact_hist_float
+
         # Slot duration [sec]
         self.slot_duration = resource_grid.ofdm_symbol_duration * \
             resource_grid.num_ofdm_symbols
 
-        # Initialize channel model based on scenario
-        self._setup_channel_model(
-            scenario, carrier_frequency, o2i_model, ut_array, bs_array,
-            average_street_width, average_building_height)
+        # Carriers sharing the topology and user mobility, each with its own
+        # channel model. If no carrier is provided, a single carrier is
+        # simulated at carrier_frequency
+        self.multi_carrier = carriers is not None
+        self.carriers = normalize_carriers(carriers, carrier_frequency,
+                                           ut_array, bs_array,
+                                           bs_max_power_dbm, ut_max_power_dbm)
+        self.num_carriers = len(self.carriers)
+        self.carrier_names = [carrier['name'] for carrier in self.carriers]
+
+        # Initialize channel model based on scenario, per carrier
+        self.channel_models = [
+            self._setup_channel_model(
+                scenario, carrier['carrier_frequency'], o2i_model,
+                carrier['ut_array'], carrier['bs_array'],
+                average_street_width, average_building_height)
+            for carrier in self.carriers]
+        # Channel model of the first carrier, on which the drop is generated
+        self.channel_model = self.channel_models[0]
+
+        # Counter-based random streams per (seed, drop, stage, slot), so that
+        # any slot range of a drop can be recomputed in isolation
+        self.rng = None
+        if rng_streams:
+            assert config.seed is not None, \
+                "Random streams require sionna.phy.config.seed to be set"
+            self.rng = RNGStreams(config.seed, drop_id)
+            self.rng.reset_global('topology')
 
-        # Generate multicell topology
-        self._setup_topology(num_rings, min_bs_ut_dist, max_bs_ut_dist)
+        # Generate multicell topology, or load it from the topology cache.
+        # The drop is determined by the parameters below and by the state of
+        # the random number generator. Drops are not cached without a seed
+        topology_params = None
+        if topology_cache is not None and config.seed is not None:
+            topology_params = {
+                'scenario': scenario,
+                'num_rings': num_rings,
+                'num_ut_per_sector': self.num_ut_per_sector,
+                'batch_size': self.batch_size,
+                'min_bs_ut_dist': min_bs_ut_dist,
+                'max_bs_ut_dist': max_bs_ut_dist,
+                'seed': config.seed,
+                'rng_state': config.tf_rng.state.numpy().tolist(),
+                'precision': self.rdtype.name,
+                'sionna_version': sionna.__version__}
+        self._setup_topology(num_rings, min_bs_ut_dist, max_bs_ut_dist,
+                             topology_cache=topology_cache,
+                             topology_params=topology_params)
+        # The other carriers share the drop
+        for channel_model in self.channel_models[1:]:
+            channel_model.set_topology(
+                self.ut_loc, self.bs_loc, self.ut_orientations,
+                self.bs_orientations, self.ut_velocities,
+                self.in_state, self.los, self.bs_virtual_loc)
+        # UT locations at the end of the last run, from which a warm-started
+        # run continues
+        self.ut_loc_last = tf.Variable(self.ut_loc)
+        # UT locations and coherence block with which the channel topology
+        # was set at the start of the last cold-started run
+        self._channel_topology_ut_loc = tf.Variable(self.ut_loc)
+        self._channel_topology_block = tf.Variable(0, dtype=tf.int32)
 
         # Instantiate a PHY abstraction object
-        self.phy_abs = PHYAbstraction(precision=self.precision)
-
-        # Instantiate a link adaptation object
-        self.olla = OuterLoopLinkAdaptation(
-            self.phy_abs,
-            self.num_ut_per_sector,
-            batch_size=[self.batch_size, self.num_bs])
-
-        # Instantiate a scheduler object
-        self.scheduler = PFSchedulerSUMIMO(
-            self.num_ut_per_sector,
-            resource_grid.fft_size,
-            resource_grid.num_ofdm_symbols,
-            batch_size=[self.batch_size, self.num_bs],
-            num_streams_per_ut=self.num_streams_per_ut,
-            beta=pf_beta,
-            precision=self.precision)
+        if cache_phy_tables:
+            # Interpolated BLER tables are loaded from disk
+            self.phy_abs = CachedPHYAbstraction(cache_dir=cache_dir,
+                                                precision=self.precision)
+        else:
+            self.phy_abs = PHYAbstraction(precision=self.precision)
+
+        # Policy branches sharing the same channel realizations, on each
+        # carrier. If no policy and no carrier is provided, a single default
+        # branch is simulated and the output of call() is unchanged
+        self.multi_policy = policies is not None or direction == 'duplex' \
+            or self.multi_carrier
+        self.policies = normalize_policies(
+            policies, pf_beta, self.link_directions,
+            carriers=self.carrier_names if self.multi_carrier else None)
+        self.num_policies = len(self.policies)
+        self.policy_names = [policy['name'] for policy in self.policies]
+        # Branches of a policy on different carriers serve the same users,
+        # hence share one traffic queue per user. Index of the branch holding
+        # the queues of each branch, on the first carrier
+        policy_keys = [policy['policy'] for policy in self.policies]
+        self.queue_owner = [policy_keys.index(policy['policy'])
+                            for policy in self.policies]
+
+        # Instantiate one link adaptation and one scheduler object per policy
+        self.ollas, self.schedulers = [], []
+        for policy in self.policies:
+            self.ollas.append(OuterLoopLinkAdaptation(
+                self.phy_abs,
+                self.num_ut_per_sector,
+                batch_size=[self.batch_size, self.num_bs]))
+
+            self.schedulers.append(PFSchedulerSUMIMO(
+                self.num_ut_per_sector,
+                resource_grid.fft_size,
+                resource_grid.num_ofdm_symbols,
+                batch_size=[self.batch_size, self.num_bs],
+                num_streams_per_ut=self.num_streams_per_ut,
+                beta=policy['pf_beta'],
+                precision=self.precision))
+
+        # Objects of the first policy branch
+        self.olla = self.ollas[0]
+        self.scheduler = self.schedulers[0]
+
+        # If not None, the slot loop stops as soon as the network-level
+        # metrics reach the target precision, up to num_slots slots
+        self.convergence = normalize_convergence(convergence)
+
+        # Batch-means accumulators at the end of the last run, per policy,
+        # from which a warm-started run continues, e.g., the next chunk
+        if self.convergence is not None:
+            self._convergence_state = [
+                {key: tf.Variable(value) for key, value in
+                 init_convergence_state(self.rdtype).items()}
+                for _ in self.policies]
+
+        # Finite-buffer traffic. If None, all users have full buffers.
+        # Otherwise, packets arrive at per-user queues drained by the decoded
+        # bits, and users with empty queues are not scheduled
+        self.traffic = normalize_traffic(traffic)
+
+        # HARQ/SINR feedback at the end of the last run, per policy. Together
+        # with the OLLA and scheduler variables, it allows warm-starting a
+        # new run from the steady state of a previous one
+        shape = [self.batch_size, self.num_bs, self.num_ut_per_sector]
+        self._feedback = [
+            {'harq_feedback': tf.Variable(-tf.ones(shape, tf.int32)),
+             'sinr_eff_feedback': tf.Variable(tf.ones(shape, self.rdtype)),
+             'num_decoded_bits': tf.Variable(tf.zeros(shape, tf.int32))}
+            for _ in self.policies]
+        if self.traffic is not None:
+            # Traffic queues are carried across runs as well
+            for feedback in self._feedback:
+                for key, value in init_queue(
+                        shape, self.traffic['max_queue']).items():
+                    feedback[key] = tf.Variable(value)
+
+        # Channel realization, fading factor and fading AR coefficients at
+        # the end of the last run, per carrier. A warm-started run continues
+        # the coherence block and the fading process of the last run
+        num_freq_samples = len(get_freq_samples(
+            resource_grid.fft_size, freq_stride, freq_interpolation)[0])
+        h_shape = [self.batch_size, self.num_rx, self.num_rx_ant,
+                   self.num_tx, self.num_tx_ant,
+                   resource_grid.num_ofdm_symbols, num_freq_samples]
+        fading_shape = [self.batch_size, self.num_rx, self.num_tx]
+        self._channel_state = [
+            {'h_freq': tf.Variable(tf.zeros(h_shape, self.cdtype)),
+             'fading': tf.Variable(tf.ones(fading_shape, self.rdtype)),
+             'rho_fading': tf.Variable(tf.zeros(fading_shape, self.rdtype))}
+            for _ in self.carriers]
+        # Whether the channel state was stored by a run of this simulator
+        # since the last load_state
+        self._channel_state_valid = tf.Variable(False)
+
+        # The slot loop is compiled with XLA, or run as a plain graph if
+        # jit_compile is False
+        self.call = tf.function(self.call, jit_compile=jit_compile)
+        if not jit_compile:
+            # Failed SINR computations are masked by sanitize_sinr, which
+            # relies on XLA returning NaN on a singular Cholesky
+            # factorization. The TensorFlow kernels raise an error instead,
+            # hence the SINR computation is compiled with XLA in any case
+            self._compute_sinr = tf.function(self._compute_sinr,
+                                             jit_compile=True)
 
     def _setup_channel_model(self, scenario, carrier_frequency, o2i_model,
                              ut_array, bs_array, average_street_width,
@@ -118,51 +436,178 @@ class SystemLevelSimulator(Block):
             'carrier_frequency': carrier_frequency,
             'ut_array': ut_array,
             'bs_array': bs_array,
-            'direction': self.direction,
+            'direction': self.channel_direction,
             'enable_pathloss': True,
             'enable_shadow_fading': True,
             'precision': self.precision
         }
 
         if scenario == 'umi':  # Urban micro-cell
-            self.channel_model = UMi(o2i_model=o2i_model, **common_params)
+            return UMi(o2i_model=o2i_model, **common_params)
         elif scenario == 'uma':  # Urban macro-cell
-            self.channel_model = UMa(o2i_model=o2i_model, **common_params)
+            return UMa(o2i_model=o2i_model, **common_params)
         elif scenario == 'rma':  # Rural macro-cell
-            self.channel_model = RMa(
+            return RMa(
                 average_street_width=average_street_width,
                 average_building_height=average_building_height,
                 **common_params)
 
-    def _setup_topology(self, num_rings, min_bs_ut_dist, max_bs_ut_dist):
+    def _setup_topology(self, num_rings, min_bs_ut_dist, max_bs_ut_dist,
+                        topology_cache=None, topology_params=None):
         """Generate and set up network topology """
-        self.ut_loc, self.bs_loc, self.ut_orientations, self.bs_orientations, \
-            self.ut_velocities, self.in_state, self.los, self.bs_virtual_loc, self.grid = \
-            gen_hexgrid_topology(
-                batch_size=self.batch_size,
-                num_rings=num_rings,
-                num_ut_per_sector=self.num_ut_per_sector,
-                min_bs_ut_dist=min_bs_ut_dist,
-                max_bs_ut_dist=max_bs_ut_dist,
-                scenario=self.scenario,
-                los=True,
-                return_grid=True,
-                precision=self.precision)
+        drop = None
+        if topology_params is not None:
+            drop = topology_cache.load(topology_params)
 
-        # Set topology in channel model
+        if drop is not None:
+            self._restore_drop(drop, num_rings)
+        else:
+            self.ut_loc, self.bs_loc, self.ut_orientations, self.bs_orientations, \
+                self.ut_velocities, self.in_state, self.los, self.bs_virtual_loc, self.grid = \
+                gen_hexgrid_topology(
+                    batch_size=self.batch_size,
+                    num_rings=num_rings,
+                    num_ut_per_sector=self.num_ut_per_sector,
+                    min_bs_ut_dist=min_bs_ut_dist,
+                    max_bs_ut_dist=max_bs_ut_dist,
+                    scenario=self.scenario,
+                    los=True,
+                    return_grid=True,
+                    precision=self.precision)
+            if topology_params is not None:
+                topology_cache.save(topology_params, self._export_drop())
+
+        # Set topology in channel model. LoS states, indoor distances and
+        # LSPs are sampled here, also for a cached drop
         self.channel_model.set_topology(
             self.ut_loc, self.bs_loc, self.ut_orientations,
             self.bs_orientations, self.ut_velocities,
             self.in_state, self.los, self.bs_virtual_loc)
 
+    def _export_drop(self):
+        """ Hexagonal grid drop and random generator state after the drop, as
+        NumPy arrays """
+        drop = {'ut_loc': self.ut_loc,
+                'bs_loc': self.bs_loc,
+                'ut_orientations': self.ut_orientations,
+                'bs_orientations': self.bs_orientations,
+                'ut_velocities': self.ut_velocities,
+                'in_state': self.in_state,
+                'los': self.los,
+                'bs_virtual_loc': self.bs_virtual_loc,
+                'rng_state': config.tf_rng.state,
+                'isd': self.grid.isd,
+                'cell_height': self.grid.cell_height}
+        return {key: tf.convert_to_tensor(value).numpy()
+                for key, value in drop.items()}
+
+    def _restore_drop(self, drop, num_rings):
+        """ Set a cached hexagonal grid drop and continue from the random
+        generator state following it """
+        for key in ['ut_loc', 'bs_loc', 'ut_orientations', 'bs_orientations',
+                    'ut_velocities', 'bs_virtual_loc']:
+            setattr(self, key, tf.constant(drop[key], self.rdtype))
+        self.in_state = tf.constant(drop['in_state'], tf.bool)
+        self.los = bool(drop['los'])
+        self.grid = HexGrid(num_rings,
+                            isd=float(drop['isd']),
+                            cell_height=float(drop['cell_height']),
+                            precision=self.precision)
+        config.tf_rng.reset(tf.constant(drop['rng_state'],
+                                        config.tf_rng.state.dtype))
+
+    def _new_channel_matrix(self, channel_source=None, carrier_idx=0):
+        """ Instantiate the channel matrix generator of a carrier """
+        return ChannelMatrix(self.resource_grid,
+                             self.batch_size,
+                             self.num_rx,
+                             self.num_tx,
+                             self.coherence_time,
+                             freq_stride=self.freq_stride,
+                             freq_interpolation=self.freq_interpolation,
+                             rng=self.rng,
+                             rng_stream=carrier_idx or None,
+                             channel_source=channel_source or
+                             self.channel_source,
+                             precision=self.precision)
+
+    def _set_channel_topology(self, ut_loc, block):
+        """ Set the topology in the channel model of each carrier. With random
+        streams, LSPs are drawn from the stream of the coherence block, and
+        of the carrier beyond the first one """
+        for ii, channel_model in enumerate(self.channel_models):
+            if self.rng is not None:
+                self.rng.reset_global('lsp', block, *([ii] if ii else []))
+            channel_model.set_topology(
+                ut_loc, self.bs_loc, self.ut_orientations,
+                self.bs_orientations, self.ut_velocities,
+                self.in_state, self.los, self.bs_virtual_loc)
+
+    def channel_decimation_error(self):
+        """ Normalized mean squared error [dB] of the frequency-decimated
+        channel generation against full-resolution generation """
+        return self._new_channel_matrix().decimation_error(self.channel_model)
+
+    def channel_source_fidelity(self, num_realizations=4):
+        """ Gain, frequency and spatial correlation statistics and speedup of
+        the surrogate channel against the 3GPP model, on the current
+        topology """
+        return channel_source_fidelity(
+            self._new_channel_matrix(channel_source='tr38901'),
+            self._new_channel_matrix(channel_source='surrogate'),
+            self.channel_model,
+            num_realizations=num_realizations)
+
+    def export_state(self):
+        """ Return the OLLA, PF scheduler and HARQ/SINR feedback state at the
+        end of the last run, as a dictionary of NumPy arrays per policy """
+        state = {}
+        for ii, name in enumerate(self.policy_names):
+            state[name] = {
+                'olla_offset': self.ollas[ii].offset.numpy(),
+                'sinr_eff_db_last': self.ollas[ii].sinr_eff_db_last.numpy(),
+                'rate_achieved_past':
+                    self.schedulers[ii].rate_achieved_past.numpy()}
+            for key, value in self._feedback[ii].items():
+                state[name][key] = value.numpy()
+        return state
+
+    def load_state(self, state):
+        """ Load a state returned by export_state, possibly from another
+        simulator with the same topology. The next call with
+        warm_start=True starts from it """
+        for ii, name in enumerate(self.policy_names):
+            # Policies are matched by name, or by position otherwise
+            policy_state = state[name] if name in state else \
+                list(state.values())[ii]
+            self.ollas[ii].offset.assign(policy_state['olla_offset'])
+            self.ollas[ii].sinr_eff_db_last = policy_state['sinr_eff_db_last']
+            self.schedulers[ii].rate_achieved_past.assign(
+                policy_state['rate_achieved_past'])
+            for key, value in self._feedback[ii].items():
+                value.assign(policy_state[key])
+        # The channel is not part of the state, and is generated anew.
+        # Convergence statistics restart
+        self._channel_state_valid.assign(False)
+        if self.convergence is not None:
+            for convergence_state in self._convergence_state:
+                for key, value in init_convergence_state(
+                        self.rdtype).items():
+                    convergence_state[key].assign(value)
+
     def _reset(self,
                bler_target,
-               olla_delta_up):
-        """  Reset OLLA and HARQ/SINR feedback """
+               olla_delta_up,
+               policy_idx=0,
+               warm_start=False):
+        """  Reset OLLA and HARQ/SINR feedback. If warm_start is True, the
+        state left by the last run or by load_state is kept instead.
+        warm_start can be a boolean tensor """
         # Link Adaptation
-        self.olla.reset()
-        self.olla.bler_target = bler_target
-        self.olla.olla_delta_up = olla_delta_up
+        olla = self.ollas[policy_idx]
+        tf.cond(warm_start, lambda: None, olla.reset)
+        olla.bler_target = bler_target
+        olla.olla_delta_up = olla_delta_up
 
         # HARQ feedback (no feedback, -1)
         last_harq_feedback = - tf.ones(
@@ -178,7 +623,14 @@ class SystemLevelSimulator(Block):
         num_decoded_bits = tf.zeros(
             [self.batch_size, self.num_bs, self.num_ut_per_sector],
             tf.int32)
-        return last_harq_feedback, sinr_eff_feedback, num_decoded_bits
+
+        feedback = self._feedback[policy_idx]
+        return tf.where(warm_start, feedback['harq_feedback'],
+                        last_harq_feedback), \
+            tf.where(warm_start, feedback['sinr_eff_feedback'],
+                     sinr_eff_feedback), \
+            tf.where(warm_start, feedback['num_decoded_bits'],
+                     num_decoded_bits)
 
     def _group_by_sector(self,
                          tensor):
@@ -193,7 +645,252 @@ class SystemLevelSimulator(Block):
         # [batch_size, num_bs, num_ofdm_symbols, num_ut_per_sector]
         return tf.transpose(tensor, [0, 1, 3, 2])
 
-    @tf.function(jit_compile=True)
+    def _compute_sinr(self, tx_power, is_scheduled, direction, h_freq_fading,
+                      precoder=None):
+        """ Per-stream SINR of the scheduled users, on all users or on the
+        active set only. precoder is the cached DL precoder, if any """
+        link = self.links[direction]
+        if direction != 'downlink':
+            precoder = None
+        if self.active_set_sinr:
+            return get_sinr_active_set(tx_power,
+                                       is_scheduled,
+                                       link['stream_management'],
+                                       link['stream_management_active'],
+                                       self.no,
+                                       direction,
+                                       h_freq_fading,
+                                       self.num_bs,
+                                       self.num_ut_per_sector,
+                                       self.num_streams_per_ut,
+                                       self.resource_grid,
+                                       precoder=precoder,
+                                       diag_loading=self.sinr_diag_loading)
+        return get_sinr(tx_power,
+                        link['stream_management'],
+                        self.no,
+                        direction,
+                        h_freq_fading,
+                        self.num_bs,
+                        self.num_ut_per_sector,
+                        self.num_streams_per_ut,
+                        self.resource_grid,
+                        precoder=precoder,
+                        diag_loading=self.sinr_diag_loading)
+
+    def _simulate_policy(self,
+                         policy_idx,
+                         slot,
+                         state,
+                         h_freq_fading,
+                         pathloss_serving_cell,
+                         interference_dl,
+                         alpha_ul,
+                         p0_dbm_ul,
+                         mcs_table_index,
+                         fairness_dl,
+                         guaranteed_power_ratio_dl,
+                         warmup_slots,
+                         first_slot=0,
+                         precoder=None):
+        """ Scheduling, power control, SINR, link adaptation and PHY
+        abstraction of one policy branch over a shared channel realization.
+        With finite-buffer traffic, the queues in state already hold the
+        packets arrived in this slot, and the bits left by the branches of
+        the same policy on the previous carriers """
+        policy = self.policies[policy_idx]
+        carrier = self.carriers[policy['carrier']]
+        olla = self.ollas[policy_idx]
+        scheduler = self.schedulers[policy_idx]
+        direction = policy['direction']
+        link = self.links[direction]
+
+        # --------- #
+        # Scheduler #
+        # --------- #
+        # Estimate achievable rate
+        # [batch_size, num_bs, num_ofdm_sym, num_subcarriers, num_ut_per_sector]
+        rate_achievable_est = estimate_achievable_rate(
+            olla.sinr_eff_db_last,
+            self.resource_grid.num_ofdm_symbols,
+            self.resource_grid.fft_size)
+
+        backlogged = None
+        if self.traffic is not None:
+            queue = {key: state[key] for key in QUEUE_KEYS}
+            traffic_counters = state['traffic_counters']
+            # Users with empty buffers are not eligible for scheduling
+            # [batch_size, num_bs, num_ut_per_sector]
+            backlogged = is_backlogged(queue)
+            rate_achievable_est = tf.where(
+                backlogged[:, :, tf.newaxis, tf.newaxis, :],
+                rate_achievable_est,
+                tf.zeros_like(rate_achievable_est))
+
+        # SU-MIMO Proportional Fairness scheduler
+        # [batch_size, num_bs, num_ofdm_sym, num_subcarriers,
+        #  num_ut_per_sector, num_streams_per_ut]
+        is_scheduled = scheduler(
+            state['num_decoded_bits'],
+            rate_achievable_est)
+        if backlogged is not None:
+            # Resources of sectors without backlogged users stay unused.
+            # Idle users get neither resources nor transmit power
+            is_scheduled = tf.logical_and(
+                is_scheduled,
+                backlogged[:, :, tf.newaxis, tf.newaxis, :, tf.newaxis])
+
+        # N. allocated subcarriers
+        num_allocated_sc = tf.minimum(tf.reduce_sum(
+            tf.cast(is_scheduled, tf.int32), axis=-1), 1)
+        # [batch_size, num_bs, num_ofdm_sym, num_ut_per_sector]
+        num_allocated_sc = tf.reduce_sum(
+            num_allocated_sc, axis=-2)
+
+        # N. allocated resources per slot
+        # [batch_size, num_bs, num_ut_per_sector]
+        num_allocated_re = \
+            tf.reduce_sum(tf.cast(is_scheduled, tf.int32),
+                          axis=[-1, -3, -4])
+
+        # ------------- #
+        # Power control #
+        # ------------- #
+        if direction == 'uplink':
+            # Open-loop uplink power control
+            # [batch_size, num_bs, num_ofdm_symbols, num_ut_per_sector]
+            tx_power_per_ut = open_loop_uplink_power_control(
+                pathloss_serving_cell,
+                num_allocated_sc,
+                alpha=policy.get('alpha_ul', alpha_ul),
+                p0_dbm=policy.get('p0_dbm_ul', p0_dbm_ul),
+                ut_max_power_dbm=carrier['ut_max_power_dbm'])
+        else:
+            # Fair downlink power allocation
+            # [batch_size, num_bs, num_ofdm_symbols, num_ut_per_sector]
+            tx_power_per_ut, _ = downlink_fair_power_control(
+                pathloss_serving_cell,
+                interference_dl + self.no,
+                num_allocated_sc,
+                bs_max_power_dbm=carrier['bs_max_power_dbm'],
+                guaranteed_power_ratio=policy.get(
+                    'guaranteed_power_ratio_dl', guaranteed_power_ratio_dl),
+                fairness=policy.get('fairness_dl', fairness_dl),
+                precision=self.precision)
+
+        # For each user, distribute the power uniformly across
+        # subcarriers and streams
+        # [batch_size, num_bs, num_tx_per_sector,
+        #  num_streams_per_tx, num_ofdm_sym, num_subcarriers]
+        tx_power = spread_across_subcarriers(
+            tx_power_per_ut,
+            is_scheduled,
+            num_tx=link['num_tx_per_sector'],
+            precision=self.precision)
+
+        # --------------- #
+        # Per-stream SINR #
+        # --------------- #
+        # [batch_size, num_bs, num_ofdm_sym, num_subcarriers,
+        #  num_ut_per_sector, num_streams_per_ut]
+        sinr = self._compute_sinr(tx_power, is_scheduled, direction,
+                                  h_freq_fading, precoder)
+
+        # Sectors where the SINR computation failed numerically are masked
+        # and the loop goes on
+        # [batch_size, num_bs]
+        sinr, sector_failed = sanitize_sinr(sinr)
+
+        # --------------- #
+        # Link adaptation #
+        # --------------- #
+        # [batch_size, num_bs, num_ut_per_sector]
+        mcs_index = olla(num_allocated_re,
+                         harq_feedback=state['harq_feedback'],
+                         sinr_eff=state['sinr_eff_feedback'])
+
+        # --------------- #
+        # PHY abstraction #
+        # --------------- #
+        if self.rng is not None:
+            # HARQ outcomes are drawn from the stream of the slot and policy
+            self.rng.reset_global('phy', first_slot + slot, policy_idx)
+        # [batch_size, num_bs, num_ut_per_sector]
+        num_decoded_bits, harq_feedback, sinr_eff, _, _ = self.phy_abs(
+            mcs_index,
+            sinr=sinr,
+            mcs_table_index=mcs_table_index,
+            mcs_category=int(direction == 'downlink'))
+
+        # No HARQ feedback and no decoded bits in failed sectors
+        # [batch_size, num_bs, 1]
+        failed = sector_failed[..., tf.newaxis]
+        harq_feedback = tf.where(failed,
+                                 tf.cast(-1, harq_feedback.dtype),
+                                 harq_feedback)
+        num_decoded_bits = tf.where(failed,
+                                    tf.cast(0, num_decoded_bits.dtype),
+                                    num_decoded_bits)
+        sinr_eff = tf.where(failed, tf.cast(0, sinr_eff.dtype), sinr_eff)
+
+        if self.traffic is not None:
+            # Drain the buffers by the decoded bits. Bits decoded beyond the
+            # buffered ones are padding and are not counted as throughput
+            queue, traffic_counters, num_decoded_bits = drain_queue(
+                queue,
+                traffic_counters,
+                num_decoded_bits,
+                first_slot + slot,
+                self.slot_duration,
+                count=slot >= warmup_slots)
+
+        # ------------- #
+        # SINR feedback #
+        # ------------- #
+        # [batch_size, num_bs, num_ut_per_sector]
+        sinr_eff_feedback = tf.where(num_allocated_re > 0,
+                                     sinr_eff,
+                                     tf.cast(0., self.rdtype))
+
+        # Record results
+        hist = record_results(state['hist'],
+                              slot,
+                              sim_failed=False,
+                              pathloss_serving_cell=tf.reduce_sum(
+                                  pathloss_serving_cell, axis=-2),
+                              num_allocated_re=num_allocated_re,
+                              tx_power_per_ut=tf.reduce_sum(
+                                  tx_power_per_ut, axis=-2),
+                              num_decoded_bits=num_decoded_bits,
+                              mcs_index=mcs_index,
+                              harq_feedback=harq_feedback,
+                              olla_offset=olla.offset,
+                              sinr_eff=sinr_eff,
+                              pf_metric=scheduler.pf_metric,
+                              valid=tf.broadcast_to(tf.logical_not(failed),
+                                                    harq_feedback.shape))
+
+        policy_state = {'hist': hist,
+                        'harq_feedback': harq_feedback,
+                        'sinr_eff_feedback': sinr_eff_feedback,
+                        'num_decoded_bits': num_decoded_bits,
+                        'num_sector_failures': state['num_sector_failures'] +
+                        tf.reduce_sum(tf.cast(sector_failed, tf.int32))}
+        if self.traffic is not None:
+            policy_state.update(queue)
+            policy_state['traffic_counters'] = traffic_counters
+
+        # Batch-means statistics for adaptive stopping
+        if self.convergence is not None:
+            policy_state['convergence'] = update_convergence_state(
+                state['convergence'],
+                slot_metrics(num_decoded_bits, harq_feedback, olla.offset,
+                             dtype=self.rdtype),
+                slot,
+                self.convergence['batch_slots'],
+                warmup_slots=warmup_slots)
+        return policy_state
+
     def call(self,
              num_slots,
              alpha_ul,
@@ -202,86 +899,217 @@ class SystemLevelSimulator(Block):
              olla_delta_up,
              mcs_table_index=1,
              fairness_dl=0,
-             guaranteed_power_ratio_dl=0.5):
+             guaranteed_power_ratio_dl=0.5,
+             warm_start=False,
+             warmup_slots=0,
+             first_slot=0,
+             max_slots=None):
+        """ Simulate num_slots slots. first_slot is the index of the first
+        slot within the drop, from which channel blocks and random streams
+        are counted, e.g., when a long run is split into chunks. warm_start
+        and warmup_slots can be tensors, so that the chunks of a run share
+        one traced function. If max_slots is not None, the history holds
+        max_slots slots, of which the first num_slots are valid, so that
+        chunks of different lengths share one compiled function """
+        warm_start = tf.cast(warm_start, tf.bool)
 
         # -------------- #
         # Initialization #
         # -------------- #
-        # Initialize result history
-        hist = init_result_history(self.batch_size,
-                                   num_slots,
-                                   self.num_bs,
-                                   self.num_ut_per_sector)
-
-        # Reset OLLA and HARQ/SINR feedback
-        last_harq_feedback, sinr_eff_feedback, num_decoded_bits = \
-            self._reset(bler_target, olla_delta_up)
-
-        # Initialize channel matrix
-        self.channel_matrix = ChannelMatrix(self.resource_grid,
-                                            self.batch_size,
-                                            self.num_rx,
-                                            self.num_tx,
-                                            self.coherence_time,
-                                            precision=self.precision)
-        # [batch_size, num_rx, num_rx_ant, num_tx, num_tx_ant, num_ofdm_sym,
-        #  num_subcarriers]
-        h_freq = self.channel_matrix(self.channel_model)
+        policy_states = []
+        for ii, policy in enumerate(self.policies):
+            # Initialize result history
+            hist = init_result_history(
+                self.batch_size,
+                num_slots if max_slots is None else max_slots,
+                self.num_bs,
+                self.num_ut_per_sector,
+                max_num_re=self.resource_grid.num_ofdm_symbols *
+                self.resource_grid.fft_size * self.num_streams_per_ut,
+                compact_float=self.compact_hist_float)
+
+            # Reset OLLA and HARQ/SINR feedback
+            last_harq_feedback, sinr_eff_feedback, num_decoded_bits = \
+                self._reset(policy.get('bler_target', bler_target),
+                            policy.get('olla_delta_up', olla_delta_up),
+                            policy_idx=ii,
+                            warm_start=warm_start)
+            policy_state = {'hist': hist,
+                            'harq_feedback': last_harq_feedback,
+                            'sinr_eff_feedback': sinr_eff_feedback,
+                            'num_decoded_bits': num_decoded_bits,
+                            'num_sector_failures': tf.zeros([], tf.int32)}
+            if self.convergence is not None:
+                # Batch means, continued from the last run on warm start
+                convergence_state = init_convergence_state(self.rdtype)
+                policy_state['convergence'] = {
+                    key: tf.where(warm_start,
+                                  self._convergence_state[ii][key], value)
+                    for key, value in convergence_state.items()}
+            if self.traffic is not None:
+                # Traffic queues, continued from the last run on warm start
+                queue = init_queue(
+                    [self.batch_size, self.num_bs, self.num_ut_per_sector],
+                    self.traffic['max_queue'])
+                policy_state.update(
+                    {key: tf.where(warm_start, self._feedback[ii][key],
+                                   queue[key])
+                     for key in QUEUE_KEYS})
+                policy_state['traffic_counters'] = init_traffic_counters(
+                    [self.batch_size, self.num_bs, self.num_ut_per_sector],
+                    self.rdtype)
+            policy_states.append(policy_state)
+
+        # UT locations at the start of the run
+        ut_loc = tf.where(warm_start, self.ut_loc_last, self.ut_loc)
+        # The channel model topology is set within this run, as the one left
+        # by a previous run may refer to tensors of another graph. The slot
+        # loop body is traced once with this topology, hence the channel
+        # realizations of a run are all generated with it. A warm-started
+        # run sets the topology of the last cold-started run, so that a run
+        # split into chunks generates the channel of a single run
+        topology_ut_loc = tf.where(warm_start, self._channel_topology_ut_loc,
+                                   ut_loc)
+        topology_block = tf.where(warm_start, self._channel_topology_block,
+                                  first_slot // self.coherence_time)
+        self._channel_topology_ut_loc.assign(topology_ut_loc)
+        self._channel_topology_block.assign(topology_block)
+        self._set_channel_topology(topology_ut_loc, topology_block)
+
+        # Initialize channel matrix, per carrier
+        self.channel_matrices = [
+            self._new_channel_matrix(carrier_idx=ii)
+            for ii in range(self.num_carriers)]
+        self.channel_matrix = self.channel_matrices[0]
+        # On warm start, the run continues from the channel and fading of the
+        # last slot of the last run, which the first slot updates as within
+        # a single run. Otherwise, the channel of the coherence block
+        # containing the first slot is generated
+        continue_channel = tf.logical_and(warm_start,
+                                          self._channel_state_valid)
+        h_freq, fading = [], []
+        for channel_matrix, channel_model, channel_state in zip(
+                self.channel_matrices, self.channel_models,
+                self._channel_state):
+            # [batch_size, num_rx, num_rx_ant, num_tx, num_tx_ant,
+            #  num_ofdm_sym, num_freq_samples]
+            h_freq.append(tf.cond(
+                continue_channel,
+                lambda channel_state=channel_state: tf.identity(
+                    channel_state['h_freq']),
+                lambda channel_matrix=channel_matrix,
+                channel_model=channel_model: channel_matrix.generate(
+                    channel_model, first_slot)))
+            # [batch_size, num_rx, num_tx]
+            fading.append(tf.where(continue_channel,
+                                   channel_state['fading'],
+                                   channel_matrix.fading))
+            channel_matrix.rho_fading = tf.where(continue_channel,
+                                                 channel_state['rho_fading'],
+                                                 channel_matrix.rho_fading)
+
+        # Cached DL precoder, carried across slots, per carrier
+        precoder_state = [{} for _ in range(self.num_carriers)]
+        if self.precoder_cache is not None:
+            precoder_state = [
+                self.precoder_cache.init_state(
+                    channel_matrix.expand(h_freq_carrier), fading_carrier)
+                for channel_matrix, h_freq_carrier, fading_carrier in
+                zip(self.channel_matrices, h_freq, fading)]
 
         # --------------- #
         # Simulate a slot #
         # --------------- #
         def simulate_slot(slot,
-                          hist,
-                          harq_feedback,
-                          sinr_eff_feedback,
-                          num_decoded_bits,
-                          h_freq):
-            try:
+                          policy_states,
+                          h_freq,
+                          fading,
+                          precoder_state,
+                          ut_loc,
+                          converged):
+            # Index of the slot within the drop
+            drop_slot = first_slot + slot
+            policy_states = list(policy_states)
+            h_freq = list(h_freq)
+            fading = list(fading)
+            precoder_state = list(precoder_state)
+
+            # ------- #
+            # Traffic #
+            # ------- #
+            # Packets arriving in this slot, drawn independently per link
+            # direction and offered to every policy. They are appended once
+            # to the queues shared by the branches of a policy on all
+            # carriers
+            queues = {}
+            if self.traffic is not None:
+                arrivals = {}
+                for dd, link_direction in enumerate(self.link_directions):
+                    if self.rng is not None:
+                        seed = self.rng.seed('traffic', drop_slot, dd)
+                    else:
+                        seed = config.tf_rng.make_seeds(1)[:, 0]
+                    arrivals[link_direction] = draw_arrivals(
+                        self.traffic,
+                        [self.batch_size, self.num_bs,
+                         self.num_ut_per_sector],
+                        self.slot_duration,
+                        seed,
+                        dtype=self.rdtype)
+                for ii, policy in enumerate(self.policies):
+                    if self.queue_owner[ii] != ii:
+                        continue
+                    queue, traffic_counters = enqueue_arrivals(
+                        {key: policy_states[ii][key] for key in QUEUE_KEYS},
+                        policy_states[ii]['traffic_counters'],
+                        *arrivals[policy['direction']],
+                        drop_slot,
+                        count=slot >= warmup_slots)
+                    queues[ii] = dict(queue,
+                                      traffic_counters=traffic_counters)
+
+            # All carriers are simulated within the same slot. Each carrier
+            # has its own channel, and its policy branches are simulated
+            # right after its channel stage
+            for cc, carrier in enumerate(self.carriers):
+                channel_matrix = self.channel_matrices[cc]
+                channel_model = self.channel_models[cc]
+
                 # ------- #
                 # Channel #
                 # ------- #
-                # Update channel matrix
-                h_freq = self.channel_matrix.update(self.channel_model,
-                                                    h_freq,
-                                                    slot)
+                # Update channel matrix. Unless the channel of the last run
+                # is continued, the first slot uses the channel generated at
+                # initialization
+                h_freq[cc] = tf.cond(
+                    tf.logical_or(slot > 0, continue_channel),
+                    lambda: channel_matrix.update(
+                        channel_model, h_freq[cc], drop_slot),
+                    lambda: h_freq[cc])
 
                 # Apply fading
-                h_freq_fading = self.channel_matrix.apply_fading(h_freq)
-
-                # --------- #
-                # Scheduler #
-                # --------- #
-                # Estimate achievable rate
-                # [batch_size, num_bs, num_ofdm_sym, num_subcarriers, num_ut_per_sector]
-                rate_achievable_est = estimate_achievable_rate(
-                    self.olla.sinr_eff_db_last,
-                    self.resource_grid.num_ofdm_symbols,
-                    self.resource_grid.fft_size)
-
-                # SU-MIMO Proportional Fairness scheduler
-                # [batch_size, num_bs, num_ofdm_sym, num_subcarriers,
-                #  num_ut_per_sector, num_streams_per_ut]
-                is_scheduled = self.scheduler(
-                    num_decoded_bits,
-                    rate_achievable_est)
-
-                # N. allocated subcarriers
-                num_allocated_sc = tf.minimum(tf.reduce_sum(
-                    tf.cast(is_scheduled, tf.int32), axis=-1), 1)
-                # [batch_size, num_bs, num_ofdm_sym, num_ut_per_sector]
-                num_allocated_sc = tf.reduce_sum(
-                    num_allocated_sc, axis=-2)
-
-                # N. allocated resources per slot
-                # [batch_size, num_bs, num_ut_per_sector]
-                num_allocated_re = \
-                    tf.reduce_sum(tf.cast(is_scheduled, tf.int32),
-                                  axis=[-1, -3, -4])
-
-                # ------------- #
-                # Power control #
-                # ------------- #
+                h_freq_fading, fading[cc] = channel_matrix.apply_fading(
+                    h_freq[cc], fading[cc], drop_slot)
+
+                if self.precoder_cache is not None:
+                    # Recompute the Gram matrix only for a new channel
+                    # realization, and the precoder only if the fading
+                    # changed beyond the tolerance
+                    precoder_state[cc] = self.precoder_cache.update_state(
+                        precoder_state[cc],
+                        lambda: channel_matrix.expand(h_freq[cc]),
+                        fading[cc],
+                        tf.math.mod(drop_slot, self.coherence_time) == 0)
+
+                # Interpolate to all subcarriers if generated on a
+                # decimated frequency grid
+                # [batch_size, num_rx, num_rx_ant, num_tx, num_tx_ant,
+                #  num_ofdm_sym, num_subcarriers]
+                h_freq_fading = channel_matrix.expand(h_freq_fading)
+
+                # -------- #
+                # Pathloss #
+                # -------- #
                 # Compute pathloss
                 # [batch_size, num_rx, num_tx, num_ofdm_symbols], [batch_size, num_ut, num_ofdm_symbols]
                 pathloss_all_pairs, pathloss_serving_cell = get_pathloss(
@@ -293,16 +1121,8 @@ class SystemLevelSimulator(Block):
                 pathloss_serving_cell = self._group_by_sector(
                     pathloss_serving_cell)
 
-                if self.direction == 'uplink':
-                    # Open-loop uplink power control
-                    # [batch_size, num_bs, num_ofdm_symbols, num_ut_per_sector]
-                    tx_power_per_ut = open_loop_uplink_power_control(
-                        pathloss_serving_cell,
-                        num_allocated_sc,
-                        alpha=alpha_ul,
-                        p0_dbm=p0_dbm_ul,
-                        ut_max_power_dbm=self.ut_max_power_dbm)
-                else:
+                interference_dl = None
+                if 'downlink' in self.link_directions:
                     # Channel quality estimation:
                     # Estimate interference from neighboring base stations
                     # [batch_size, num_ut, num_ofdm_symbols]
@@ -317,118 +1137,139 @@ class SystemLevelSimulator(Block):
                     rx_power_tot = self._group_by_sector(rx_power_tot)
 
                     # Interference from neighboring base stations
-                    interference_dl = rx_power_tot - one / pathloss_serving_cell
-                    interference_dl *= dbm_to_watt(self.bs_max_power_dbm)
-
-                    # Fair downlink power allocation
-                    # [batch_size, num_bs, num_ofdm_symbols, num_ut_per_sector]
-                    tx_power_per_ut, _ = downlink_fair_power_control(
-                        pathloss_serving_cell,
-                        interference_dl + self.no,
-                        num_allocated_sc,
-                        bs_max_power_dbm=self.bs_max_power_dbm,
-                        guaranteed_power_ratio=guaranteed_power_ratio_dl,
-                        fairness=fairness_dl,
-                        precision=self.precision)
-
-                # For each user, distribute the power uniformly across
-                # subcarriers and streams
-                # [batch_size, num_bs, num_tx_per_sector,
-                #  num_streams_per_tx, num_ofdm_sym, num_subcarriers]
-                tx_power = spread_across_subcarriers(
-                    tx_power_per_ut,
-                    is_scheduled,
-                    num_tx=self.num_tx_per_sector,
-                    precision=self.precision)
+                    interference_dl = rx_power_tot - \
+                        one / pathloss_serving_cell
+                    interference_dl *= dbm_to_watt(
+                        carrier['bs_max_power_dbm'])
 
-                # --------------- #
-                # Per-stream SINR #
-                # --------------- #
-                # [batch_size, num_bs, num_ofdm_sym, num_subcarriers,
-                #  num_ut_per_sector, num_streams_per_ut]
-                sinr = get_sinr(tx_power,
-                                self.stream_management,
-                                self.no,
-                                self.direction,
-                                h_freq_fading,
-                                self.num_bs,
-                                self.num_ut_per_sector,
-                                self.num_streams_per_ut,
-                                self.resource_grid)
+                # Channel of each link direction. In duplex mode, the
+                # uplink channel is the reciprocal of the downlink one
+                # [batch_size, num_rx, num_rx_ant, num_tx, num_tx_ant,
+                #  num_ofdm_sym, num_subcarriers]
+                h_freq_link = {self.channel_direction: h_freq_fading}
+                for link_direction in self.link_directions:
+                    if link_direction != self.channel_direction:
+                        h_freq_link[link_direction] = tf.transpose(
+                            h_freq_fading, [0, 3, 4, 1, 2, 5, 6])
 
                 # --------------- #
-                # Link adaptation #
+                # Policy branches #
                 # --------------- #
-                # [batch_size, num_bs, num_ut_per_sector]
-                mcs_index = self.olla(num_allocated_re,
-                                      harq_feedback=harq_feedback,
-                                      sinr_eff=sinr_eff_feedback)
+                # The channel stage above is shared by all policies of the
+                # carrier
+                for ii, policy in enumerate(self.policies):
+                    if policy['carrier'] != cc:
+                        continue
+                    state = policy_states[ii]
+                    if self.traffic is not None:
+                        # Queues left by the previous carriers
+                        state = dict(state, **queues[self.queue_owner[ii]])
+                    policy_states[ii] = self._simulate_policy(
+                        ii,
+                        slot,
+                        state,
+                        h_freq_link[policy['direction']],
+                        pathloss_serving_cell,
+                        interference_dl,
+                        alpha_ul,
+                        p0_dbm_ul,
+                        mcs_table_index,
+                        fairness_dl,
+                        guaranteed_power_ratio_dl,
+                        warmup_slots,
+                        first_slot=first_slot,
+                        precoder=precoder_state[cc].get('precoder'))
+                    if self.traffic is not None:
+                        queues[self.queue_owner[ii]] = {
+                            key: policy_states[ii][key]
+                            for key in QUEUE_KEYS + ['traffic_counters']}
 
-                # --------------- #
-                # PHY abstraction #
-                # --------------- #
-                # [batch_size, num_bs, num_ut_per_sector]
-                num_decoded_bits, harq_feedback, sinr_eff, _, _ = self.phy_abs(
-                    mcs_index,
-                    sinr=sinr,
-                    mcs_table_index=mcs_table_index,
-                    mcs_category=int(self.direction == 'downlink'))
-
-                # ------------- #
-                # SINR feedback #
-                # ------------- #
-                # [batch_size, num_bs, num_ut_per_sector]
-                sinr_eff_feedback = tf.where(num_allocated_re > 0,
-                                             sinr_eff,
-                                             tf.cast(0., self.rdtype))
-
-                # Record results
-                hist = record_results(hist,
-                                      slot,
-                                      sim_failed=False,
-                                      pathloss_serving_cell=tf.reduce_sum(
-                                          pathloss_serving_cell, axis=-2),
-                                      num_allocated_re=num_allocated_re,
-                                      tx_power_per_ut=tf.reduce_sum(
-                                          tx_power_per_ut, axis=-2),
-                                      num_decoded_bits=num_decoded_bits,
-                                      mcs_index=mcs_index,
-                                      harq_feedback=harq_feedback,
-                                      olla_offset=self.olla.offset,
-                                      sinr_eff=sinr_eff,
-                                      pf_metric=self.scheduler.pf_metric)
-
-            except tf.errors.InvalidArgumentError as e:
-                print(f"SINR computation did not succeed at slot {slot}.\n"
-                      f"Error message: {e}. Skipping slot...")
-                hist = record_results(hist, slot,
-                                      shape=[self.batch_size,
-                                             self.num_bs,
-                                             self.num_ut_per_sector], sim_failed=True)
+            if self.traffic is not None:
+                # All branches of a policy hold its queues at the end of the
+                # slot
+                for ii in range(self.num_policies):
+                    policy_states[ii] = dict(
+                        policy_states[ii], **queues[self.queue_owner[ii]])
 
             # ------------- #
             # User mobility #
             # ------------- #
-            self.ut_loc = self.ut_loc + self.ut_velocities * self.slot_duration
+            # Common to all carriers
+            ut_loc = ut_loc + self.ut_velocities * self.slot_duration
 
-            # Set topology in channel model
-            self.channel_model.set_topology(
-                self.ut_loc, self.bs_loc, self.ut_orientations,
-                self.bs_orientations, self.ut_velocities,
-                self.in_state, self.los, self.bs_virtual_loc)
+            # Set topology in channel models. The channel realizations of
+            # this run are generated with the topology set before the loop
+            self._set_channel_topology(
+                ut_loc, (drop_slot + 1) // self.coherence_time)
+
+            # ----------------- #
+            # Adaptive stopping #
+            # ----------------- #
+            if self.convergence is not None:
+                # Stop when all policies have converged
+                converged = tf.reduce_all(
+                    [is_converged(policy_state['convergence'],
+                                  self.convergence)
+                     for policy_state in policy_states])
 
-            return [slot + 1, hist, harq_feedback, sinr_eff_feedback,
-                    num_decoded_bits, h_freq]
+            return [slot + 1, policy_states, h_freq, fading, precoder_state,
+                    ut_loc, converged]
 
         # --------------- #
         # Simulation loop #
         # --------------- #
-        _, hist, *_ = tf.while_loop(
-            lambda i, *_: i < num_slots,
-            simulate_slot,
-            [0, hist, last_harq_feedback, sinr_eff_feedback,
-             num_decoded_bits, h_freq])
-
-        for key in hist:
-            hist[key] = hist[key].stack()
-        return hist
+        num_slots_simulated, policy_states, h_freq, fading, _, ut_loc, _ = \
+            tf.while_loop(
+                lambda i, _, __, ___, ____, _____, converged: tf.logical_and(
+                    i < num_slots, tf.logical_not(converged)),
+                simulate_slot,
+                [0, policy_states, h_freq, fading, precoder_state, ut_loc,
+                 False])
+
+        # Store the final UT locations for warm-starting the next run
+        self.ut_loc_last.assign(ut_loc)
+
+        # Store the final channel and fading for warm-starting the next run
+        for channel_state, channel_matrix, h_freq_carrier, fading_carrier in \
+                zip(self._channel_state, self.channel_matrices, h_freq,
+                    fading):
+            channel_state['h_freq'].assign(h_freq_carrier)
+            channel_state['fading'].assign(fading_carrier)
+            channel_state['rho_fading'].assign(channel_matrix.rho_fading)
+        self._channel_state_valid.assign(True)
+
+        # Store the final feedback for warm-starting the next run
+        for feedback, policy_state in zip(self._feedback, policy_states):
+            for key, value in feedback.items():
+                value.assign(policy_state[key])
+
+        # Store the batch means for warm-starting the next run
+        if self.convergence is not None:
+            for convergence_state, policy_state in zip(
+                    self._convergence_state, policy_states):
+                for key, value in convergence_state.items():
+                    value.assign(policy_state['convergence'][key])
+
+        hists = []
+        for policy_state in policy_states:
+            hist = policy_state['hist']
+            for key in hist:
+                hist[key] = hist[key].stack()
+            # N. (slot, sector) pairs where the SINR computation failed
+            hist['num_sector_failures'] = policy_state['num_sector_failures']
+            if self.traffic is not None:
+                # Per-user packet counters and latency
+                hist.update(policy_state['traffic_counters'])
+            if self.convergence is not None or max_slots is not None:
+                # Slots after num_slots_simulated are not valid
+                hist['num_slots_simulated'] = num_slots_simulated
+            if self.convergence is not None:
+                hist['convergence_mean'], hist['convergence_ci'] = \
+                    confidence_interval(policy_state['convergence'],
+                                        self.convergence['confidence'])
+            hists.append(hist)
+
+        # One history per policy in multi-policy mode
+        if self.multi_policy:
+            return hists
+        return hists[0]
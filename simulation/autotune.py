@@ -0,0 +1,218 @@
+# simulation/autotune.py
+
+"""
+Throughput auto-tuner of the system-level simulator.
+
+Short trials are run in separate processes, since TensorFlow thread counts
+cannot be changed once TensorFlow is initialized. XLA compilation, intra- and
+inter-op thread counts, batch size and chunk length are tuned one at a time,
+in this order, keeping the best value found for the previous ones. The
+configuration with the highest number of simulated user-slots per second is
+stored in the per-host tuning cache, where run_simulation picks it up.
+
+Usage:
+    python -m simulation.autotune --budget-gb 8 --batch-sizes 1 2 4 8
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# Prefix of the line carrying the result of a trial
+RESULT_PREFIX = 'AUTOTUNE_RESULT '
+
+
+def run_trial(trial, num_slots):
+    """ Measure the throughput of one setting. Must run in a fresh process,
+    before TensorFlow is initialized """
+    import tensorflow as tf
+    from utils.tuning_utils import apply_thread_settings
+    if not apply_thread_settings(trial):
+        raise RuntimeError("TensorFlow already initialized, thread counts "
+                           f"of trial {trial} cannot be applied")
+
+    import sionna.phy.config
+    sionna.phy.config.seed = 42
+    import config.simulation_config as config
+    from simulation.run_simulation import initialize_system_simulator, \
+        run_in_chunks
+
+    sls = initialize_system_simulator(config,
+                                      batch_size=trial['batch_size'],
+                                      jit_compile=trial['jit_compile'])
+    args = [tf.constant(config.ALPHA_UL, tf.float32),
+            tf.constant(config.P0_DBM_UL, tf.float32),
+            tf.constant(config.BLER_TARGET, tf.float32),
+            tf.constant(config.OLLA_DELTA_UP, tf.float32)]
+
+    def run():
+        if trial['chunk_slots'] is None or trial['chunk_slots'] >= num_slots:
+            return sls(tf.constant(num_slots, tf.int32), *args)
+        return run_in_chunks(sls, num_slots, trial['chunk_slots'], *args)
+
+    # The first run includes tracing and compilation
+    start = time.perf_counter()
+    run()
+    compile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    return {'num_slots': num_slots,
+            'compile_time': compile_time,
+            'elapsed': elapsed,
+            'user_slots_per_sec':
+                trial['batch_size'] * sls.num_ut * num_slots / elapsed}
+
+
+def launch_trial(trial, num_slots, timeout=None):
+    """ Run a trial in a subprocess. Returns None if it failed, e.g., by
+    running out of memory """
+    cmd = [sys.executable, '-m', 'simulation.autotune',
+           '--trial', json.dumps(trial), '--num-slots', str(num_slots)]
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        out = subprocess.run(cmd, cwd=root_dir, capture_output=True,
+                             text=True, timeout=timeout, check=False)
+    except subprocess.TimeoutExpired:
+        return None
+    for line in out.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    return None
+
+
+def autotune(config,
+             budget_gb=None,
+             batch_sizes=(1, 2, 4, 8, 16),
+             chunk_slots=(None,),
+             intra_op_threads=None,
+             inter_op_threads=(0, 1, 2),
+             jit_compile=(True, False),
+             target_seconds=10.,
+             min_slots=20,
+             timeout=None,
+             precision='single'):
+    """
+    Tune batch size, chunk length, thread counts and XLA compilation for the
+    configuration, store the best setting in the tuning cache and return it
+    with the results of all trials.
+    - budget_gb: settings whose estimated peak memory exceeds it are skipped
+    - target_seconds: approximate duration of the timed run of each trial.
+      The number of slots is calibrated on the first trial
+    - thread counts: 0 is the TensorFlow default. By default, the intra-op
+      thread count is tuned over 0, half and all CPU cores
+    """
+    from simulation.run_simulation import estimate_config_memory
+    from utils.tuning_utils import save_tuning
+
+    if intra_op_threads is None:
+        num_cores = os.cpu_count() or 1
+        intra_op_threads = sorted({0, max(num_cores // 2, 1), num_cores})
+
+    def fits(trial, num_slots):
+        if budget_gb is None:
+            return True
+        chunk = num_slots if trial['chunk_slots'] is None else \
+            min(trial['chunk_slots'], num_slots)
+        estimate = estimate_config_memory(config, trial['batch_size'], chunk)
+        return estimate['peak'] <= budget_gb * 1e9
+
+    best = {'batch_size': min(batch_sizes),
+            'chunk_slots': chunk_slots[0],
+            'intra_op_threads': 0,
+            'inter_op_threads': 0,
+            'jit_compile': jit_compile[0]}
+
+    # Calibrate the number of slots of a trial on the initial setting
+    result = launch_trial(best, min_slots, timeout=timeout)
+    if result is None:
+        raise RuntimeError(f"Auto-tuning trial failed for {best}")
+    num_slots = max(min_slots,
+                    int(min_slots * target_seconds / result['elapsed']))
+    print(f"Trials simulate {num_slots} slots")
+
+    trials = []
+    best_throughput = 0.
+    for key, values in [('jit_compile', jit_compile),
+                        ('intra_op_threads', intra_op_threads),
+                        ('inter_op_threads', inter_op_threads),
+                        ('batch_size', batch_sizes),
+                        ('chunk_slots', chunk_slots)]:
+        best_value = best[key]
+        for value in values:
+            trial = dict(best, **{key: value})
+            if any(t['setting'] == trial for t in trials):
+                continue
+            if not fits(trial, num_slots):
+                print(f"Skipping {trial}: exceeds the memory budget")
+                continue
+            result = launch_trial(trial, num_slots, timeout=timeout)
+            trials.append({'setting': trial, 'result': result})
+            if result is None:
+                print(f"{trial}: failed")
+                continue
+            print(f"{trial}: {result['user_slots_per_sec']:.1f} user-slots/s")
+            if result['user_slots_per_sec'] > best_throughput:
+                best_throughput = result['user_slots_per_sec']
+                best_value = value
+        best[key] = best_value
+
+    tuning = dict(best, user_slots_per_sec=best_throughput)
+    save_tuning(config, tuning, precision=precision,
+                cache_dir=config.CACHE_DIR)
+    return tuning, trials
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Auto-tune the throughput of the system-level simulator')
+    parser.add_argument('--budget-gb', type=float, default=None)
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16])
+    parser.add_argument('--chunk-slots', type=int, nargs='+', default=[0],
+                        help='Chunk lengths [slots], 0 for no chunking')
+    parser.add_argument('--intra-op-threads', type=int, nargs='+',
+                        default=None)
+    parser.add_argument('--inter-op-threads', type=int, nargs='+',
+                        default=[0, 1, 2])
+    parser.add_argument('--no-jit-search', action='store_true',
+                        help='Keep XLA compilation on')
+    parser.add_argument('--target-seconds', type=float, default=10.)
+    parser.add_argument('--min-slots', type=int, default=20)
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='Timeout of each trial [s]')
+    # Internal: run a single trial
+    parser.add_argument('--trial', type=str, default=None,
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--num-slots', type=int, default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.trial is not None:
+        result = run_trial(json.loads(args.trial), args.num_slots)
+        print(RESULT_PREFIX + json.dumps(result))
+        return
+
+    import config.simulation_config as config
+    import sionna.phy.config
+    tuning, _ = autotune(
+        config,
+        budget_gb=args.budget_gb,
+        batch_sizes=args.batch_sizes,
+        chunk_slots=[c if c > 0 else None for c in args.chunk_slots],
+        intra_op_threads=args.intra_op_threads,
+        inter_op_threads=args.inter_op_threads,
+        jit_compile=(True,) if args.no_jit_search else (True, False),
+        target_seconds=args.target_seconds,
+        min_slots=args.min_slots,
+        timeout=args.timeout,
+        precision=sionna.phy.config.precision)
+    print(f"Best setting: {tuning}")
+
+
+if __name__ == '__main__':
+    main()
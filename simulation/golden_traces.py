@@ -0,0 +1,283 @@
+# simulation/golden_traces.py
+
+"""
+Golden-trace equivalence harness of the fast execution paths.
+
+Reference traces (cleaned result history and per-user averages) are recorded
+with a fixed seed for a matrix of small UMi/UMa/RMa, uplink/downlink
+configurations. A candidate execution mode, i.e., a set of configuration
+overrides enabling an optimized path, is then run on the same configurations
+and compared against them:
+- exact modes must reproduce every metric bit-exactly
+- approximate modes must pass, per metric, a two-sample Kolmogorov-Smirnov
+  test on the per-slot values and a relative error bound on the mean
+Slots per second of the reference and of the candidate are reported
+alongside.
+
+Usage:
+    python -m simulation.golden_traces record
+    python -m simulation.golden_traces check freq_stride
+"""
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+from utils.results_utils import TRACE_KEYS
+
+# Small configurations covering scenarios and link directions
+GOLDEN_SCENARIOS = {'umi': {'MIN_BS_UT_DIST': 0, 'MAX_BS_UT_DIST': 80},
+                    'uma': {'MIN_BS_UT_DIST': 35, 'MAX_BS_UT_DIST': 200},
+                    'rma': {'MIN_BS_UT_DIST': 35, 'MAX_BS_UT_DIST': 800}}
+GOLDEN_DIRECTIONS = ['uplink', 'downlink']
+GOLDEN_BASE = {'NUM_RINGS': 1,
+               'NUM_UT_PER_SECTOR': 4,
+               'BATCH_SIZE': 1,
+               'NUM_SLOTS': 200,
+               'COHERENCE_TIME': 50,
+               'NUM_SUBCARRIERS': 48,
+               'POLICIES': None,
+               'CARRIERS': None,
+               'TRAFFIC': None,
+               'CONVERGENCE': None,
+               'WARMUP_SLOTS': 0,
+               'LOAD_STATE_FILE': None,
+               'SAVE_STATE_FILE': None,
+               'MEMORY_BUDGET_GB': None,
+               'USE_TUNING_CACHE': False,
+               'TELEMETRY_SLOTS': None,
+               'CACHE_PHY_TABLES': False,
+               'CACHE_TOPOLOGY': False}
+GOLDEN_SEED = 42
+
+# Candidate execution modes: overrides of the reference configuration, and
+# whether the results must be bit-exact
+CANDIDATE_MODES = {
+    'reference': ({}, True),
+    'no_jit': ({'JIT_COMPILE': False}, False),
+    'cached_phy_tables': ({'CACHE_PHY_TABLES': True}, True),
+    'cached_topology': ({'CACHE_TOPOLOGY': True}, True),
+    'freq_stride': ({'FREQ_STRIDE': 4}, False),
+    'freq_stride_prb': ({'FREQ_STRIDE': 12}, False),
+    'rzf_cache': ({'RZF_CACHE_TOLERANCE': 0.}, False),
+    'rzf_cache_approx': ({'RZF_CACHE_TOLERANCE': .05}, False),
+    'rzf_cache_budget': ({'RZF_CACHE_TOLERANCE': .05,
+                          'RZF_CACHE_MAX_UPDATE_RATIO': .25}, False),
+    'active_set_sinr': ({'ACTIVE_SET_SINR': True}, False),
+    'compact_hist': ({'COMPACT_HIST_FLOAT': True}, False),
+    'chunked': ({'CHUNK_SLOTS': 50}, False),
+    'rng_streams': ({'RNG_STREAMS': True}, False),
+    'surrogate_channel': ({'CHANNEL_SOURCE': 'surrogate'}, False),
+    'antenna_pattern_table': ({'ANTENNA_PATTERN_RESOLUTION_DEG': .5}, False),
+}
+
+# Modes reading an on-disk cache. The candidate is run twice, and the second
+# run, which reads the cache populated by the first, is compared
+CACHED_MODES = ['cached_phy_tables', 'cached_topology']
+
+# Default statistical tolerances of approximate modes
+KS_ALPHA = .01
+MEAN_REL_TOL = .05
+
+
+def golden_configs():
+    """ Name and overrides of each golden configuration """
+    configs = {}
+    for scenario, distances in GOLDEN_SCENARIOS.items():
+        for direction in GOLDEN_DIRECTIONS:
+            configs[f'{scenario}_{direction}'] = dict(
+                GOLDEN_BASE, SCENARIO=scenario, DIRECTION=direction,
+                **distances)
+    return configs
+
+
+def get_golden_dir(golden_dir=None):
+    if golden_dir is None:
+        golden_dir = os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            'golden')
+    os.makedirs(golden_dir, exist_ok=True)
+    return golden_dir
+
+
+def run_traced(config, overrides):
+    """ Run a configuration with a fixed seed. Returns the trace (cleaned
+    history and per-user averages) and the slots per second of the run,
+    including tracing and compilation """
+    import tensorflow as tf
+    import sionna.phy.config
+    from simulation.run_simulation import override_config, run_simulation
+
+    # The global generator must be created before op determinism is enabled,
+    # which forbids non-deterministic initial states
+    sionna.phy.config.seed = GOLDEN_SEED
+    # Bit-exact comparisons require deterministic kernels
+    tf.config.experimental.enable_op_determinism()
+    run_config = override_config(config, overrides)
+    start = time.perf_counter()
+    results = run_simulation(run_config, make_plots=False)
+    elapsed = time.perf_counter() - start
+
+    trace = {}
+    for key in TRACE_KEYS:
+        trace[f'hist/{key}'] = np.asarray(results['results'][key])
+    for key, value in results['results_avg'].items():
+        trace[f'avg/{key}'] = np.asarray(value)
+    return trace, run_config.NUM_SLOTS / elapsed
+
+
+def record_reference(config, golden_dir=None, names=None):
+    """ Record the reference trace of each golden configuration """
+    golden_dir = get_golden_dir(golden_dir)
+    for name, overrides in golden_configs().items():
+        if names is not None and name not in names:
+            continue
+        trace, slots_per_sec = run_traced(config, overrides)
+        trace['slots_per_sec'] = np.array(slots_per_sec)
+        trace['overrides'] = np.array(json.dumps(overrides))
+        np.savez_compressed(os.path.join(golden_dir, f'{name}.npz'), **trace)
+        print(f"{name}: recorded, {slots_per_sec:.1f} slots/s")
+
+
+def ks_two_sample(x, y):
+    """ Two-sample Kolmogorov-Smirnov statistic and asymptotic p-value """
+    x, y = np.sort(x), np.sort(y)
+    n, m = len(x), len(y)
+    values = np.concatenate([x, y])
+    cdf_x = np.searchsorted(x, values, side='right') / n
+    cdf_y = np.searchsorted(y, values, side='right') / m
+    d = np.max(np.abs(cdf_x - cdf_y))
+    # Kolmogorov distribution, with the small-sample correction of Stephens
+    en = np.sqrt(n * m / (n + m))
+    lam = (en + .12 + .11 / en) * d
+    k = np.arange(1, 101)
+    p_value = 2 * np.sum((-1)**(k - 1) * np.exp(-2 * k**2 * lam**2))
+    return d, float(np.clip(p_value, 0., 1.))
+
+
+def compare_traces(reference, candidate, exact,
+                   ks_alpha=KS_ALPHA, mean_rel_tol=MEAN_REL_TOL):
+    """ Compare a candidate trace against the reference, per metric.
+    Returns a dictionary of per-metric reports with a 'passed' flag """
+    report = {}
+    for key in reference:
+        if not key.startswith(('hist/', 'avg/')):
+            continue
+        ref = np.asarray(reference[key], np.float64)
+        cand = np.asarray(candidate[key], np.float64)
+        if exact:
+            passed = ref.shape == cand.shape and \
+                np.array_equal(ref, cand, equal_nan=True)
+            num_mismatch = int(np.sum(~((ref == cand) |
+                                        (np.isnan(ref) & np.isnan(cand))))) \
+                if ref.shape == cand.shape else ref.size
+            report[key] = {'passed': bool(passed),
+                           'num_mismatch': num_mismatch}
+            continue
+        ref, cand = ref[np.isfinite(ref)], cand[np.isfinite(cand)]
+        if ref.size == 0 or cand.size == 0:
+            report[key] = {'passed': ref.size == cand.size}
+            continue
+        rel_err = abs(cand.mean() - ref.mean()) / max(abs(ref.mean()), 1e-12)
+        entry = {'rel_err_mean': float(rel_err)}
+        passed = rel_err <= mean_rel_tol
+        if key.startswith('hist/'):
+            # Distributions are compared on per-slot values
+            entry['ks_stat'], entry['ks_p_value'] = ks_two_sample(ref, cand)
+            passed = passed and entry['ks_p_value'] >= ks_alpha
+        entry['passed'] = bool(passed)
+        report[key] = entry
+    return report
+
+
+def check_mode(config, mode, golden_dir=None, names=None,
+               ks_alpha=KS_ALPHA, mean_rel_tol=MEAN_REL_TOL):
+    """ Run a candidate mode on each recorded golden configuration and
+    compare it against the reference. Modes in CACHED_MODES are compared
+    on a cache hit. Returns the per-configuration reports and whether all
+    metrics passed """
+    mode_overrides, exact = CANDIDATE_MODES[mode]
+    golden_dir = get_golden_dir(golden_dir)
+    reports = {}
+    all_passed = True
+    for name, overrides in golden_configs().items():
+        filename = os.path.join(golden_dir, f'{name}.npz')
+        if (names is not None and name not in names) or \
+                not os.path.isfile(filename):
+            continue
+        with np.load(filename) as data:
+            reference = {key: data[key] for key in data.files}
+        if json.loads(str(reference['overrides'])) != overrides:
+            raise ValueError(f"Golden trace {name} was recorded with another "
+                             f"configuration, record it again")
+        if mode in CACHED_MODES:
+            # Populate the cache
+            run_traced(config, dict(overrides, **mode_overrides))
+        candidate, slots_per_sec = run_traced(
+            config, dict(overrides, **mode_overrides))
+        metrics = compare_traces(reference, candidate, exact,
+                                 ks_alpha=ks_alpha, mean_rel_tol=mean_rel_tol)
+        passed = all(entry['passed'] for entry in metrics.values())
+        all_passed = all_passed and passed
+        reports[name] = {
+            'passed': passed,
+            'exact': exact,
+            'metrics': metrics,
+            'slots_per_sec_reference': float(reference['slots_per_sec']),
+            'slots_per_sec_candidate': slots_per_sec}
+    return reports, all_passed
+
+
+def format_report(mode, reports):
+    """ Summarize the reports of check_mode """
+    lines = []
+    for name, report in reports.items():
+        speedup = report['slots_per_sec_candidate'] / \
+            report['slots_per_sec_reference']
+        status = 'PASS' if report['passed'] else 'FAIL'
+        lines.append(f"{mode} on {name}: {status} "
+                     f"({'bit-exact' if report['exact'] else 'statistical'}), "
+                     f"{report['slots_per_sec_candidate']:.1f} vs "
+                     f"{report['slots_per_sec_reference']:.1f} slots/s "
+                     f"(x{speedup:.2f})")
+        for key, entry in report['metrics'].items():
+            if not entry['passed']:
+                details = ', '.join(f'{k}={v:.3g}' for k, v in entry.items()
+                                    if k != 'passed')
+                lines.append(f"  {key}: {details}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Golden-trace equivalence harness of execution modes')
+    parser.add_argument('command', choices=['record', 'check'])
+    parser.add_argument('mode', nargs='?', default='reference',
+                        choices=sorted(CANDIDATE_MODES))
+    parser.add_argument('--configs', nargs='+', default=None,
+                        choices=sorted(golden_configs()))
+    parser.add_argument('--golden-dir', type=str, default=None)
+    parser.add_argument('--ks-alpha', type=float, default=KS_ALPHA)
+    parser.add_argument('--mean-rel-tol', type=float, default=MEAN_REL_TOL)
+    args = parser.parse_args()
+
+    import config.simulation_config as config
+    if args.command == 'record':
+        record_reference(config, golden_dir=args.golden_dir,
+                         names=args.configs)
+        return
+    reports, all_passed = check_mode(config, args.mode,
+                                     golden_dir=args.golden_dir,
+                                     names=args.configs,
+                                     ks_alpha=args.ks_alpha,
+                                     mean_rel_tol=args.mean_rel_tol)
+    if not reports:
+        raise SystemExit("No golden traces found, run 'record' first")
+    print(format_report(args.mode, reports))
+    raise SystemExit(0 if all_passed else 1)
+
+
+if __name__ == '__main__':
+    main()
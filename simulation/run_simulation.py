@@ -1,20 +1,38 @@
 # simulation/run_simulation.py
 
+import os
+import time
 import tensorflow as tf
 import numpy as np
+from types import SimpleNamespace
+from sionna.phy import config as sionna_config
 from sionna.phy.channel.tr38901 import PanelArray
 from sionna.phy.ofdm import ResourceGrid
 
 from models.system_simulator import SystemLevelSimulator
-from utils.results_utils import clean_hist
+from models.antenna_pattern import tabulate_array_patterns
+from utils.results_utils import clean_hist, compute_results_avg, \
+    concat_hists, aggregate_carrier_throughput, compute_traffic_avg
+from utils.topology_cache import TopologyCache
+from utils.telemetry import Telemetry
+from utils.results_query import ResultsStore, compute_results_avg_from_store
+from utils.tuning_utils import load_tuning, apply_thread_settings
+from utils.memory_utils import estimate_memory, format_memory_estimate, \
+    fit_to_budget
+from utils.convergence_utils import format_convergence_report
+from utils.state_utils import save_sim_state, load_sim_state
 from visualization.plots import (plot_performance_metrics, show_network_topology,
                                 plot_sinr_mcs_throughput, plot_bler_mcs_olla, 
-                                plot_pf_resources_mcs)
+                                plot_pf_resources_mcs, plot_policy_comparison)
 
 
-def create_antenna_arrays(carrier_frequency):
+def create_antenna_arrays(carrier_frequency,
+                          pattern_resolution_deg=None,
+                          cache_dir=None):
     """
-    Create the antenna arrays for base stations and user terminals
+    Create the antenna arrays for base stations and user terminals. If
+    pattern_resolution_deg is not None, element patterns are tabulated with
+    this angular resolution and interpolated
     """
     # Create the antenna arrays at the base stations
     bs_array = PanelArray(num_rows_per_panel=2,
@@ -31,10 +49,33 @@ def create_antenna_arrays(carrier_frequency):
                           polarization_type='V',
                           antenna_pattern='omni',
                           carrier_frequency=carrier_frequency)
+
+    if pattern_resolution_deg is not None:
+        for array in [bs_array, ut_array]:
+            tabulate_array_patterns(array,
+                                    resolution_deg=pattern_resolution_deg,
+                                    cache_dir=cache_dir)
     
     return bs_array, ut_array
 
 
+def create_carriers(config):
+    """
+    Carriers of a multi-carrier run, with the antenna arrays of each carrier
+    frequency. None if config.CARRIERS is None
+    """
+    if config.CARRIERS is None:
+        return None
+    carriers = []
+    for carrier in config.CARRIERS:
+        bs_array, ut_array = create_antenna_arrays(
+            carrier['carrier_frequency'],
+            pattern_resolution_deg=config.ANTENNA_PATTERN_RESOLUTION_DEG,
+            cache_dir=config.CACHE_DIR)
+        carriers.append(dict(carrier, bs_array=bs_array, ut_array=ut_array))
+    return carriers
+
+
 def create_resource_grid(num_ofdm_sym, num_subcarriers, subcarrier_spacing, 
                         num_ut_per_sector, ut_array):
     """
@@ -48,12 +89,56 @@ def create_resource_grid(num_ofdm_sym, num_subcarriers, subcarrier_spacing,
     return resource_grid
 
 
-def initialize_system_simulator(config):
+def estimate_config_memory(config, batch_size=None, num_slots=None):
     """
-    Initialize the system level simulator with given configuration
+    Estimate the device memory of a run with given configuration.
+    batch_size and num_slots override the configuration, e.g., for a chunk
+    """
+    bs_array, ut_array = create_antenna_arrays(
+        config.CARRIER_FREQUENCY,
+        pattern_resolution_deg=config.ANTENNA_PATTERN_RESOLUTION_DEG,
+        cache_dir=config.CACHE_DIR)
+    resource_grid = create_resource_grid(
+        config.NUM_OFDM_SYM,
+        config.NUM_SUBCARRIERS,
+        config.SUBCARRIER_SPACING,
+        config.NUM_UT_PER_SECTOR,
+        ut_array
+    )
+    num_policies = 1 if config.POLICIES is None else len(config.POLICIES)
+    if config.DIRECTION == 'duplex':
+        num_policies *= 2
+    num_carriers = 1 if config.CARRIERS is None else len(config.CARRIERS)
+    num_policies *= num_carriers
+    return estimate_memory(
+        config.BATCH_SIZE if batch_size is None else batch_size,
+        config.NUM_RINGS,
+        config.NUM_UT_PER_SECTOR,
+        bs_array,
+        ut_array,
+        resource_grid,
+        config.NUM_SLOTS if num_slots is None else num_slots,
+        direction=config.DIRECTION,
+        freq_stride=config.FREQ_STRIDE,
+        num_policies=num_policies,
+        num_carriers=num_carriers,
+        active_set_sinr=config.ACTIVE_SET_SINR,
+        rzf_cache=config.RZF_CACHE_TOLERANCE is not None,
+        compact_hist_float=config.COMPACT_HIST_FLOAT,
+        precision=sionna_config.precision)
+
+
+def initialize_system_simulator(config, batch_size=None, jit_compile=None):
+    """
+    Initialize the system level simulator with given configuration.
+    If not None, batch_size and jit_compile override config.BATCH_SIZE and
+    config.JIT_COMPILE
     """
     # Create antenna arrays
-    bs_array, ut_array = create_antenna_arrays(config.CARRIER_FREQUENCY)
+    bs_array, ut_array = create_antenna_arrays(
+        config.CARRIER_FREQUENCY,
+        pattern_resolution_deg=config.ANTENNA_PATTERN_RESOLUTION_DEG,
+        cache_dir=config.CACHE_DIR)
     
     # Create resource grid
     resource_grid = create_resource_grid(
@@ -64,9 +149,17 @@ def initialize_system_simulator(config):
         ut_array
     )
     
+    # On-disk cache of topology drops
+    topology_cache = None
+    if config.CACHE_TOPOLOGY:
+        topology_cache = TopologyCache(
+            cache_dir=config.CACHE_DIR,
+            max_size_mb=config.TOPOLOGY_CACHE_MAX_MB,
+            max_age_days=config.TOPOLOGY_CACHE_MAX_AGE_DAYS)
+
     # Initialize SystemLevelSimulator
     sls = SystemLevelSimulator(
-        config.BATCH_SIZE,
+        config.BATCH_SIZE if batch_size is None else batch_size,
         config.NUM_RINGS,
         config.NUM_UT_PER_SECTOR,
         config.CARRIER_FREQUENCY,
@@ -83,21 +176,221 @@ def initialize_system_simulator(config):
         temperature=config.TEMPERATURE,
         o2i_model=config.O2I_MODEL,
         average_street_width=config.AVERAGE_STREET_WIDTH,
-        average_building_height=config.AVERAGE_BUILDING_HEIGHT
+        average_building_height=config.AVERAGE_BUILDING_HEIGHT,
+        policies=config.POLICIES,
+        cache_phy_tables=config.CACHE_PHY_TABLES,
+        cache_dir=config.CACHE_DIR,
+        freq_stride=config.FREQ_STRIDE,
+        freq_interpolation=config.FREQ_INTERPOLATION,
+        convergence=config.CONVERGENCE,
+        active_set_sinr=config.ACTIVE_SET_SINR,
+        rzf_cache_tolerance=config.RZF_CACHE_TOLERANCE,
+        rzf_cache_max_update_ratio=config.RZF_CACHE_MAX_UPDATE_RATIO,
+        compact_hist_float=config.COMPACT_HIST_FLOAT,
+        jit_compile=config.JIT_COMPILE if jit_compile is None else jit_compile,
+        sinr_diag_loading=config.SINR_DIAG_LOADING,
+        topology_cache=topology_cache,
+        rng_streams=config.RNG_STREAMS,
+        drop_id=config.DROP_ID,
+        channel_source=config.CHANNEL_SOURCE,
+        carriers=create_carriers(config),
+        traffic=config.TRAFFIC
     )
     
     return sls
 
 
-def run_simulation(config):
+def run_in_chunks(sls,
+                  num_slots,
+                  chunk_slots,
+                  alpha_ul,
+                  p0_dbm_ul,
+                  bler_target,
+                  olla_delta_up,
+                  warm_start=False,
+                  warmup_slots=0,
+                  telemetry=None):
     """
-    Run the complete system-level simulation
+    Simulate num_slots slots as consecutive runs of at most chunk_slots
+    slots, so that the device only holds the history of one chunk. Each chunk
+    is warm-started from the OLLA, scheduler and feedback state of the
+    previous one, and from the UT locations, channel and fading it ended at.
+    With random streams (RNG_STREAMS), the result matches that of a single
+    run.
+    If telemetry is not None, progress is reported after each chunk
     """
-    print("Initializing system...")
+    hists = []
+    slot = 0
+    if telemetry is not None:
+        telemetry.start(num_slots)
+    while slot < num_slots:
+        num_slots_chunk = min(chunk_slots, num_slots - slot)
+        hist = sls(tf.constant(num_slots_chunk, tf.int32),
+                   alpha_ul,
+                   p0_dbm_ul,
+                   bler_target,
+                   olla_delta_up,
+                   warm_start=tf.constant(warm_start or slot > 0),
+                   warmup_slots=tf.constant(max(warmup_slots - slot, 0),
+                                            tf.int32),
+                   first_slot=tf.constant(slot, tf.int32),
+                   max_slots=chunk_slots)
+        hist = hist if sls.multi_policy else [hist]
+        if telemetry is not None:
+            # Copied to the host once, for both reporting and merging
+            hist = [{key: np.asarray(value) for key, value in hist_policy.items()}
+                    for hist_policy in hist]
+        hists.append(hist)
+        slot += num_slots_chunk
+        if telemetry is not None:
+            telemetry.report(min(slot, num_slots), hist)
+
+        # Stop as soon as metrics have converged within a chunk
+        if sls.convergence is not None and \
+                int(hists[-1][0]['num_slots_simulated']) < num_slots_chunk:
+            break
+    if telemetry is not None:
+        telemetry.stop()
+
+    # Merge the chunks of each policy
+    hist = [concat_hists([hists_chunk[ii] for hists_chunk in hists])
+            for ii in range(sls.num_policies)]
+    return hist if sls.multi_policy else hist[0]
+
+
+def measure_telemetry_overhead(config, telemetry_slots=None):
+    """ Time the slot loop of the configuration without chunks, then split
+    into chunks of telemetry_slots slots (by default TELEMETRY_SLOTS) with
+    telemetry, on simulators initialized alike. Both times include the
+    setup, tracing and compilation of the loop and the copy of the history
+    to the host. Reports are not written to files. Returns both times [s]
+    and the relative overhead of the chunked run """
+    telemetry_slots = telemetry_slots or config.TELEMETRY_SLOTS
+    args = [tf.constant(config.ALPHA_UL, tf.float32),
+            tf.constant(config.P0_DBM_UL, tf.float32),
+            tf.constant(config.BLER_TARGET, tf.float32),
+            tf.constant(config.OLLA_DELTA_UP, tf.float32)]
+    rng_state = tf.identity(sionna_config.tf_rng.state)
+
     sls = initialize_system_simulator(config)
+    start = time.perf_counter()
+    hist = sls(tf.constant(config.NUM_SLOTS, tf.int32), *args,
+               warmup_slots=config.WARMUP_SLOTS)
+    tf.nest.map_structure(np.asarray, hist)
+    reference_time = time.perf_counter() - start
+
+    # Same drop and random draws as the unchunked run
+    sionna_config.tf_rng.reset(rng_state)
+    sls = initialize_system_simulator(config)
+    telemetry = Telemetry(policy_names=sls.policy_names,
+                          slot_duration=sls.slot_duration)
+    run_in_chunks(sls, config.NUM_SLOTS, telemetry_slots, *args,
+                  warmup_slots=config.WARMUP_SLOTS, telemetry=telemetry)
+    return {'reference_time': reference_time,
+            'telemetry_time': telemetry.run_time(),
+            'overhead_ratio': telemetry.overhead_ratio(reference_time)}
+
+
+def build_results_store(config, hist, name=None):
+    """ Aggregate a cleaned history into a ResultsStore, stored in
+    RESULTS_STORE_FILE if not None, with the policy name appended """
+    store = ResultsStore(bucket_slots=config.RESULTS_BUCKET_SLOTS)
+    store.add(hist, drop=config.DROP_ID)
+    if config.RESULTS_STORE_FILE is not None:
+        filename = config.RESULTS_STORE_FILE
+        if name is not None:
+            root, ext = os.path.splitext(filename)
+            filename = f'{root}_{name}{ext}'
+        store.save(filename)
+    return store
+
+
+def override_config(config, overrides):
+    """ Copy of the configuration module as a namespace, with the given
+    parameters replaced, e.g., for the points of a parameter sweep """
+    params = {key: value for key, value in vars(config).items()
+              if key.isupper()}
+    unknown = set(overrides) - set(params)
+    assert not unknown, f"Unknown configuration parameters: {sorted(unknown)}"
+    params.update(overrides)
+    return SimpleNamespace(**params)
+
+
+def run_simulation(config, make_plots=True):
+    """
+    Run the complete system-level simulation. If make_plots is False, no
+    figures are created, e.g., for batch runs without a display
+    """
+    batch_size = config.BATCH_SIZE
+    chunk_slots = config.CHUNK_SLOTS
+    jit_compile = config.JIT_COMPILE
+    if config.USE_TUNING_CACHE:
+        # Settings found by simulation/autotune.py on this host
+        tuning = load_tuning(config, precision=sionna_config.precision,
+                             cache_dir=config.CACHE_DIR)
+        if tuning is not None:
+            batch_size = tuning['batch_size']
+            chunk_slots = tuning['chunk_slots']
+            jit_compile = tuning['jit_compile']
+            if not apply_thread_settings(tuning):
+                print("TensorFlow already initialized, tuned thread counts "
+                      "are not applied (see apply_tuned_thread_settings)")
+            print(f"Using tuned settings: {tuning}")
+
+    if config.MEMORY_BUDGET_GB is not None:
+        # Admission control: refuse or downscale runs exceeding the budget
+        requested_batch_size, requested_chunk_slots = batch_size, chunk_slots
+        batch_size, chunk_slots, estimate = fit_to_budget(
+            lambda batch_size, num_slots: estimate_config_memory(
+                config, batch_size, num_slots),
+            config.MEMORY_BUDGET_GB * 1e9,
+            batch_size,
+            config.NUM_SLOTS,
+            chunk_slots=chunk_slots,
+            downscale=config.MEMORY_DOWNSCALE)
+        print(format_memory_estimate(estimate))
+        if batch_size != requested_batch_size:
+            print(f"Batch size reduced to {batch_size} to fit the memory "
+                  f"budget")
+        if chunk_slots != requested_chunk_slots:
+            print(f"Simulating chunks of {chunk_slots} slots to fit the "
+                  f"memory budget")
+
+    telemetry = None
+    if config.TELEMETRY_SLOTS is not None:
+        # Progress is reported at chunk boundaries
+        chunk_slots = config.TELEMETRY_SLOTS if chunk_slots is None else \
+            min(chunk_slots, config.TELEMETRY_SLOTS)
+
+    print("Initializing system...")
+    sls = initialize_system_simulator(config,
+                                      batch_size=batch_size,
+                                      jit_compile=jit_compile)
+
+    if config.TELEMETRY_SLOTS is not None:
+        telemetry = Telemetry(metrics_file=config.TELEMETRY_FILE,
+                              prometheus_file=config.TELEMETRY_PROMETHEUS_FILE,
+                              port=config.TELEMETRY_PORT,
+                              policy_names=sls.policy_names,
+                              slot_duration=sls.slot_duration)
     
-    print("Showing network topology...")
-    topology_fig = show_network_topology(sls)
+    topology_fig = None
+    if make_plots:
+        print("Showing network topology...")
+        topology_fig = show_network_topology(sls)
+
+    channel_decimation_nmse_db = None
+    if config.FREQ_STRIDE > 1:
+        channel_decimation_nmse_db = sls.channel_decimation_error()
+        print(f"Channel generated every {config.FREQ_STRIDE} subcarriers, "
+              f"interpolation NMSE: {channel_decimation_nmse_db:.1f} dB")
+
+    if config.CHANNEL_SOURCE == 'surrogate' and config.CHECK_CHANNEL_FIDELITY:
+        fidelity = sls.channel_source_fidelity()
+        print(f"Surrogate channel: link gain difference "
+              f"{fidelity['gain_diff_mean_db']:.2f} "
+              f"+/- {fidelity['gain_diff_std_db']:.2f} dB, "
+              f"generation x{fidelity['speedup']:.1f} faster")
     
     print("Running simulation...")
     # Convert configuration values to TensorFlow constants
@@ -107,45 +400,137 @@ def run_simulation(config):
     alpha_ul = tf.constant(config.ALPHA_UL, tf.float32)
     p0_dbm_ul = tf.constant(config.P0_DBM_UL, tf.float32)
     
+    # Warm start from the steady state of a previous run
+    warm_start = config.LOAD_STATE_FILE is not None
+    if warm_start:
+        print(f"Loading simulator state from {config.LOAD_STATE_FILE}...")
+        sls.load_state(load_sim_state(config.LOAD_STATE_FILE))
+
     # System-level simulations
-    hist = sls(num_slots,
-               alpha_ul,
-               p0_dbm_ul,
-               bler_target,
-               olla_delta_up)
+    if telemetry is None and \
+            (chunk_slots is None or chunk_slots >= config.NUM_SLOTS):
+        hist = sls(num_slots,
+                   alpha_ul,
+                   p0_dbm_ul,
+                   bler_target,
+                   olla_delta_up,
+                   warm_start=warm_start,
+                   warmup_slots=config.WARMUP_SLOTS)
+    else:
+        hist = run_in_chunks(sls,
+                             config.NUM_SLOTS,
+                             chunk_slots,
+                             alpha_ul,
+                             p0_dbm_ul,
+                             bler_target,
+                             olla_delta_up,
+                             warm_start=warm_start,
+                             warmup_slots=config.WARMUP_SLOTS,
+                             telemetry=telemetry)
+    if telemetry is not None:
+        print(f"Telemetry reporting: {100 * telemetry.reporting_ratio():.3f}% "
+              f"of the run time")
+        telemetry.close()
+
+    if config.SAVE_STATE_FILE is not None:
+        save_sim_state(config.SAVE_STATE_FILE, sls.export_state())
     
     print("Processing results...")
-    hist = clean_hist(hist)
+    if sls.multi_policy:
+        # One history per policy, all simulated on the same channels
+        results = {}
+        results_avg = {}
+        stores = {}
+        for name, hist_policy in zip(sls.policy_names, hist):
+            results[name] = clean_hist(hist_policy,
+                                       warmup_slots=config.WARMUP_SLOTS)
+            if config.RESULTS_BUCKET_SLOTS is not None:
+                stores[name] = build_results_store(config, results[name],
+                                                   name=name)
+                results_avg[name] = compute_results_avg_from_store(
+                    stores[name])
+                if config.TRAFFIC is not None:
+                    results_avg[name].update(
+                        compute_traffic_avg(results[name]))
+            else:
+                results_avg[name] = compute_results_avg(results[name])
+            if results[name]['num_sector_failures'] > 0:
+                print(f"Policy {name}: SINR computation failed in "
+                      f"{int(results[name]['num_sector_failures'])} "
+                      f"sector-slots, which were masked")
+            if config.CONVERGENCE is not None:
+                print(f"Policy {name}")
+                print(format_convergence_report(results[name]))
+
+        carrier_throughput = None
+        if sls.multi_carrier:
+            # Per-user throughput of each policy across carriers
+            carrier_throughput = aggregate_carrier_throughput(
+                results_avg, sls.policies, sls.carrier_names,
+                sls.slot_duration)
+            for policy, throughput in carrier_throughput.items():
+                summary = ', '.join(f'{carrier}: {np.nanmean(value):.2f}'
+                                    for carrier, value in throughput.items())
+                print(f"Policy {policy}, mean user throughput [Mbps]: "
+                      f"{summary}")
+
+        figures = {}
+        if make_plots:
+            print("Creating plots...")
+            figures = {
+                'topology': topology_fig,
+                'policy_comparison': plot_policy_comparison(
+                    results_avg, config.BLER_TARGET)
+            }
+        return {
+            'simulator': sls,
+            'results': results,
+            'results_avg': results_avg,
+            'stores': stores,
+            'carrier_throughput': carrier_throughput,
+            'channel_decimation_nmse_db': channel_decimation_nmse_db,
+            'figures': figures
+        }
+
+    hist = clean_hist(hist, warmup_slots=config.WARMUP_SLOTS)
+    store = None
+    if config.RESULTS_BUCKET_SLOTS is not None:
+        store = build_results_store(config, hist)
+    if hist['num_sector_failures'] > 0:
+        print(f"SINR computation failed in {int(hist['num_sector_failures'])} "
+              f"sector-slots, which were masked")
+    if config.CONVERGENCE is not None:
+        print(format_convergence_report(hist))
     
     # Average across slots and store in dictionary
-    results_avg = {
-        'TBLER': (1 - np.nanmean(hist['harq'], axis=0)).flatten(),
-        'MCS': np.nanmean(hist['mcs_index'], axis=0).flatten(),
-        '# decoded bits / slot': np.nanmean(hist['num_decoded_bits'], axis=0).flatten(),
-        'Effective SINR [dB]': 10*np.log10(np.nanmean(hist['sinr_eff'], axis=0).flatten()),
-        'OLLA offset': np.nanmean(hist['olla_offset'], axis=0).flatten(),
-        'TX power [dBm]': 10*np.log10(np.nanmean(hist['tx_power'], axis=0).flatten()) + 30,
-        'Pathloss [dB]': 10*np.log10(np.nanmean(hist['pathloss_serving_cell'], axis=0).flatten()),
-        '# allocated REs / slot': np.nanmean(hist['num_allocated_re'], axis=0).flatten(),
-        'PF metric': np.nanmean(hist['pf_metric'], axis=0).flatten()
-    }
-    
-    print("Creating plots...")
-    # Generate all plots
-    metrics_fig = plot_performance_metrics(results_avg, config.BLER_TARGET)
-    sinr_fig, sinr_axs = plot_sinr_mcs_throughput(results_avg)
-    bler_fig, bler_axs = plot_bler_mcs_olla(results_avg, config.BLER_TARGET)
-    pf_fig, pf_axs = plot_pf_resources_mcs(results_avg)
+    if store is not None:
+        results_avg = compute_results_avg_from_store(store)
+        if config.TRAFFIC is not None:
+            results_avg.update(compute_traffic_avg(hist))
+    else:
+        results_avg = compute_results_avg(hist)
     
-    return {
-        'simulator': sls,
-        'results': hist,
-        'results_avg': results_avg,
-        'figures': {
+    figures = {}
+    if make_plots:
+        print("Creating plots...")
+        # Generate all plots
+        metrics_fig = plot_performance_metrics(results_avg, config.BLER_TARGET)
+        sinr_fig, sinr_axs = plot_sinr_mcs_throughput(results_avg)
+        bler_fig, bler_axs = plot_bler_mcs_olla(results_avg, config.BLER_TARGET)
+        pf_fig, pf_axs = plot_pf_resources_mcs(results_avg)
+        figures = {
             'topology': topology_fig,
             'metrics': metrics_fig,
             'sinr_mcs_throughput': sinr_fig,
             'bler_mcs_olla': bler_fig,
             'pf_resources_mcs': pf_fig
         }
+
+    return {
+        'simulator': sls,
+        'results': hist,
+        'results_avg': results_avg,
+        'store': store,
+        'channel_decimation_nmse_db': channel_decimation_nmse_db,
+        'figures': figures
     }
@@ -0,0 +1,415 @@
+# simulation/work_queue.py
+
+"""
+File-backed work queue to spread drops and sweep points across hosts sharing
+a filesystem.
+
+Each task (configuration overrides + seed) is a JSON file, which moves
+between the pending/, claimed/, done/ and failed/ directories of the queue.
+Workers claim a task by renaming it from pending/ to claimed/, which is
+atomic, so that a task is claimed by one worker only. While running a task,
+a worker refreshes the modification time of the claimed file; tasks whose
+file was not refreshed within the lease are considered abandoned and moved
+back to pending/. Results are written to one file per task in results/, and
+merged into one dataset once all tasks are done.
+
+Usage:
+    python -m simulation.work_queue QUEUE_DIR enqueue --seeds 1 2 3 \\
+        --sweep '{"NUM_UT_PER_SECTOR": [5, 10]}'
+    python -m simulation.work_queue QUEUE_DIR worker    # on each host
+    python -m simulation.work_queue QUEUE_DIR status
+    python -m simulation.work_queue QUEUE_DIR merge results.npz
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import hashlib
+import argparse
+import itertools
+import threading
+import traceback
+import numpy as np
+
+# Task states, one directory each
+QUEUE_STATES = ['pending', 'claimed', 'done', 'failed']
+
+
+class WorkQueue:
+    """ Queue of simulation tasks stored under root.
+    - lease: a claimed task is requeued if its worker did not refresh it for
+      lease seconds
+    - max_attempts: a task failing or abandoned this many times is moved to
+      failed/
+    """
+
+    def __init__(self, root, lease=300., max_attempts=3):
+        self.root = root
+        self.lease = lease
+        self.max_attempts = max_attempts
+        for state in QUEUE_STATES + ['results']:
+            os.makedirs(os.path.join(root, state), exist_ok=True)
+
+    def _path(self, state, task_id):
+        return os.path.join(self.root, state, f'{task_id}.json')
+
+    def result_file(self, task_id):
+        return os.path.join(self.root, 'results', f'{task_id}.npz')
+
+    def _write(self, filename, task, exclusive=False):
+        # Written to a temporary file and renamed, so that readers never see
+        # a partial task. If exclusive, an existing file is not overwritten
+        # and FileExistsError is raised
+        tmp_filename = f'{filename}.{socket.gethostname()}.{os.getpid()}.tmp'
+        with open(tmp_filename, 'w', encoding='utf-8') as f:
+            json.dump(task, f, indent=2)
+        if not exclusive:
+            os.replace(tmp_filename, filename)
+            return
+        try:
+            os.link(tmp_filename, filename)
+        finally:
+            os.remove(tmp_filename)
+
+    def _read(self, filename):
+        with open(filename, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _list(self, state):
+        return sorted(name[:-len('.json')]
+                      for name in os.listdir(os.path.join(self.root, state))
+                      if name.endswith('.json'))
+
+    def enqueue(self, overrides=None, seed=None, task_id=None):
+        """ Add a task running the configuration with overrides and seed.
+        Returns its identifier. Raises a FileExistsError if a task with the
+        same identifier is already in the queue, in any state """
+        if task_id is None:
+            task_id = uuid.uuid4().hex
+        for state in QUEUE_STATES:
+            if os.path.exists(self._path(state, task_id)):
+                raise FileExistsError(
+                    f"Task {task_id} is already {state}")
+        task = {'task_id': task_id,
+                'overrides': overrides or {},
+                'seed': seed,
+                'attempts': 0,
+                'history': []}
+        self._write(self._path('pending', task_id), task, exclusive=True)
+        return task_id
+
+    def enqueue_sweep(self, sweep=None, seeds=(None,)):
+        """ Add one task per combination of the swept parameter values
+        (dictionary of lists) and seed. Tasks are identified by a hash of
+        their overrides and seed, so that sweeps enqueued in the same queue
+        do not overwrite each other's tasks, and a task enqueued twice
+        raises a FileExistsError """
+        sweep = sweep or {}
+        keys = sorted(sweep)
+        task_ids = []
+        for values in itertools.product(*[sweep[key] for key in keys]):
+            for seed in seeds:
+                overrides = dict(zip(keys, values))
+                task_id = hashlib.sha1(json.dumps(
+                    {'overrides': overrides, 'seed': seed},
+                    sort_keys=True).encode()).hexdigest()[:16]
+                task_ids.append(self.enqueue(overrides, seed,
+                                             task_id=task_id))
+        return task_ids
+
+    def claim(self, worker_id):
+        """ Claim a pending task. Returns None if there is none """
+        for task_id in self._list('pending'):
+            claimed = self._path('claimed', task_id)
+            try:
+                os.rename(self._path('pending', task_id), claimed)
+            except FileNotFoundError:
+                # Claimed by another worker
+                continue
+            # The rename keeps the modification time of the enqueued file:
+            # start the lease now, before the task can be found abandoned
+            os.utime(claimed)
+            task = self._read(claimed)
+            if task['history'] and not {'done', 'error'} & \
+                    set(task['history'][-1]):
+                # Previous attempt requeued by requeue_abandoned
+                task['history'][-1]['error'] = 'lease expired'
+            task['attempts'] += 1
+            task['history'].append({'worker': worker_id,
+                                    'claimed': time.time()})
+            self._write(claimed, task)
+            return task
+        return None
+
+    def heartbeat(self, task):
+        """ Refresh the lease of a claimed task. Returns False if the task
+        was requeued in the meantime, possibly claimed by another worker """
+        claimed = self._path('claimed', task['task_id'])
+        if not self._owned(claimed, task):
+            return False
+        try:
+            os.utime(claimed)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _owned(self, filename, task):
+        """ Whether filename holds the same attempt of task, by the same
+        worker """
+        try:
+            current = self._read(filename)
+        except FileNotFoundError:
+            return False
+        return current['attempts'] == task['attempts'] and \
+            current['history'][-1]['worker'] == task['history'][-1]['worker']
+
+    def complete(self, task):
+        """ Mark a claimed task as done """
+        task['history'][-1]['done'] = time.time()
+        self._write(self._path('done', task['task_id']), task)
+        # A task requeued after its lease expired and claimed again belongs
+        # to the other worker, and is left to it. If it was not claimed
+        # again, the result is kept and the pending copy is not run again
+        for state in ['claimed', 'pending']:
+            filename = self._path(state, task['task_id'])
+            if self._owned(filename, task):
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+                return
+
+    def release(self, task, error=None):
+        """ Return a claimed task to pending/, or move it to failed/ after
+        max_attempts. A task requeued in the meantime is left as is """
+        source = self._path('claimed', task['task_id'])
+        if not self._owned(source, task):
+            # Requeued after its lease expired
+            return
+        if error is not None:
+            task['history'][-1]['error'] = error
+        state = 'failed' if task['attempts'] >= self.max_attempts \
+            else 'pending'
+        self._write(self._path(state, task['task_id']), task)
+        try:
+            os.remove(source)
+        except FileNotFoundError:
+            pass
+
+    def requeue_abandoned(self):
+        """ Release claimed tasks whose lease expired, e.g., because their
+        worker was killed. Returns their identifiers """
+        requeued = []
+        now = time.time()
+        for task_id in self._list('claimed'):
+            claimed = self._path('claimed', task_id)
+            try:
+                if now - os.stat(claimed).st_mtime <= self.lease:
+                    continue
+                task = self._read(claimed)
+                state = 'failed' if task['attempts'] >= self.max_attempts \
+                    else 'pending'
+                # A single atomic rename, so that only one worker requeues
+                # the task and that it cannot be lost in between. The
+                # expired attempt is annotated when the task is claimed
+                # again
+                os.rename(claimed, self._path(state, task_id))
+            except FileNotFoundError:
+                continue
+            if state == 'failed':
+                # Not claimed anymore, the file is ours
+                task['history'][-1]['error'] = 'lease expired'
+                self._write(self._path(state, task_id), task)
+            requeued.append(task_id)
+        return requeued
+
+    def status(self):
+        """ Number of tasks per state """
+        return {state: len(self._list(state)) for state in QUEUE_STATES}
+
+    def done_tasks(self):
+        return [self._read(self._path('done', task_id))
+                for task_id in self._list('done')]
+
+
+def save_task_results(filename, task, results):
+    """ Store the per-user averaged results of each policy of a run. Policy
+    names, which may contain '/', are stored in their own field and arrays
+    are keyed by the policy index """
+    if results['simulator'].multi_policy:
+        results_avg = results['results_avg']
+    else:
+        results_avg = {'default': results['results_avg']}
+    arrays = {}
+    for policy_idx, metrics in enumerate(results_avg.values()):
+        for metric, value in metrics.items():
+            arrays[f'{policy_idx}/{metric}'] = np.asarray(value)
+    arrays['policies'] = np.array(json.dumps(list(results_avg)))
+    arrays['task'] = np.array(json.dumps(task))
+    tmp_filename = f'{filename}.{socket.gethostname()}.{os.getpid()}.tmp.npz'
+    np.savez_compressed(tmp_filename, **arrays)
+    os.replace(tmp_filename, filename)
+
+
+def run_task(config, task):
+    """ Run the simulation of a task, without plots """
+    import sionna.phy.config
+    from simulation.run_simulation import override_config, run_simulation
+
+    if task['seed'] is not None:
+        sionna.phy.config.seed = task['seed']
+    return run_simulation(override_config(config, task['overrides']),
+                          make_plots=False)
+
+
+def run_worker(queue, config, worker_id=None, max_tasks=None, poll=10.,
+               exit_when_empty=True):
+    """ Claim and run tasks until the queue is empty, or until max_tasks
+    tasks were run. Returns the number of tasks completed """
+    if worker_id is None:
+        worker_id = f'{socket.gethostname()}-{os.getpid()}'
+    num_done = 0
+    while max_tasks is None or num_done < max_tasks:
+        queue.requeue_abandoned()
+        task = queue.claim(worker_id)
+        if task is None:
+            if exit_when_empty and queue.status()['claimed'] == 0:
+                break
+            # Other workers may still release tasks
+            time.sleep(poll)
+            continue
+
+        # Refresh the lease while the task runs. If the task was requeued in
+        # the meantime, it may run on another worker: its result is dropped
+        stop = threading.Event()
+        lost = threading.Event()
+
+        def beat(task=task):
+            while not stop.wait(queue.lease / 3):
+                if not queue.heartbeat(task):
+                    lost.set()
+                    return
+        heartbeat = threading.Thread(target=beat, daemon=True)
+        heartbeat.start()
+        print(f"[{worker_id}] Running task {task['task_id']} "
+              f"(attempt {task['attempts']})")
+        try:
+            results = run_task(config, task)
+            if lost.is_set() or not queue.heartbeat(task):
+                stop.set()
+                heartbeat.join()
+                print(f"[{worker_id}] Lost task {task['task_id']}, its "
+                      f"lease expired")
+                continue
+            save_task_results(queue.result_file(task['task_id']), task,
+                              results)
+        except Exception:
+            stop.set()
+            heartbeat.join()
+            traceback.print_exc()
+            queue.release(task, error=traceback.format_exc(limit=5))
+            continue
+        stop.set()
+        heartbeat.join()
+        queue.complete(task)
+        num_done += 1
+    return num_done
+
+
+def merge_results(queue, output_file=None):
+    """ Combine the results of all done tasks into one table: one row per
+    (task, policy, user), with the task, seed and swept parameters as
+    columns """
+    columns = {}
+    rows = []
+    for task in queue.done_tasks():
+        filename = queue.result_file(task['task_id'])
+        if not os.path.isfile(filename):
+            continue
+        with np.load(filename) as data:
+            policies = json.loads(str(data['policies']))
+            metrics = {key: data[key] for key in data.files
+                       if key not in ['policies', 'task']}
+        for policy_idx, policy in enumerate(policies):
+            prefix = f'{policy_idx}/'
+            values = {key[len(prefix):]: value
+                      for key, value in metrics.items()
+                      if key.startswith(prefix)}
+            num_users = len(next(iter(values.values())))
+            row = {'task_id': [task['task_id']] * num_users,
+                   'seed': [-1 if task['seed'] is None else task['seed']]
+                   * num_users,
+                   'policy': [policy] * num_users,
+                   'user': np.arange(num_users)}
+            for key, value in task['overrides'].items():
+                if not np.isscalar(value):
+                    # E.g., a list of policies
+                    value = json.dumps(value)
+                row[key] = [value] * num_users
+            row.update(values)
+            rows.append(row)
+    for row in rows:
+        for key in row:
+            columns.setdefault(key, [])
+    for row in rows:
+        num_users = len(row['user'])
+        for key in columns:
+            # Parameters not swept by a task are missing from its rows
+            columns[key].append(np.asarray(row[key]) if key in row
+                                else np.full(num_users, np.nan))
+    dataset = {key: np.concatenate(values) for key, values in columns.items()}
+    if output_file is not None:
+        np.savez_compressed(output_file, **dataset)
+    return dataset
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='File-backed work queue of system-level simulations')
+    parser.add_argument('queue_dir')
+    parser.add_argument('--lease', type=float, default=300.,
+                        help='Lease of a claimed task [s]')
+    parser.add_argument('--max-attempts', type=int, default=3)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    enqueue = subparsers.add_parser('enqueue')
+    enqueue.add_argument('--sweep', type=str, default='{}',
+                         help='JSON dictionary of parameter value lists')
+    enqueue.add_argument('--seeds', type=int, nargs='+', default=[None])
+    worker = subparsers.add_parser('worker')
+    worker.add_argument('--max-tasks', type=int, default=None)
+    worker.add_argument('--poll', type=float, default=10.)
+    worker.add_argument('--wait', action='store_true',
+                        help='Keep polling when the queue is empty')
+    subparsers.add_parser('status')
+    merge = subparsers.add_parser('merge')
+    merge.add_argument('output_file')
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue_dir, lease=args.lease,
+                      max_attempts=args.max_attempts)
+    if args.command == 'enqueue':
+        task_ids = queue.enqueue_sweep(json.loads(args.sweep), args.seeds)
+        print(f"Enqueued {len(task_ids)} tasks")
+    elif args.command == 'worker':
+        import config.simulation_config as config
+        num_done = run_worker(queue, config, max_tasks=args.max_tasks,
+                              poll=args.poll,
+                              exit_when_empty=not args.wait)
+        print(f"Completed {num_done} tasks")
+    elif args.command == 'status':
+        print(queue.status())
+    elif args.command == 'merge':
+        status = queue.status()
+        if status['pending'] or status['claimed']:
+            print(f"Warning: merging while tasks are not done: {status}",
+                  file=sys.stderr)
+        dataset = merge_results(queue, args.output_file)
+        print(f"Merged {len(dataset.get('user', []))} rows into "
+              f"{args.output_file}")
+
+
+if __name__ == '__main__':
+    main()
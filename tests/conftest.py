@@ -0,0 +1,7 @@
+# tests/conftest.py
+
+import os
+import sys
+
+# Modules are imported from the repository root, as by main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
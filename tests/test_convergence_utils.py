@@ -0,0 +1,69 @@
+# tests/test_convergence_utils.py
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from utils.convergence_utils import normalize_convergence, \
+    init_convergence_state, update_convergence_state, confidence_interval, \
+    is_converged
+
+
+def run_slots(state, values, batch_slots, warmup_slots=0, first_slot=0):
+    for slot, value in enumerate(values, first_slot):
+        state = update_convergence_state(
+            state, tf.constant([value, 0., 0.]), slot, batch_slots,
+            warmup_slots=warmup_slots)
+    return state
+
+
+def test_normalize_convergence():
+    assert normalize_convergence(None) is None
+    assert normalize_convergence({})['batch_slots'] == 50
+    with pytest.raises(AssertionError):
+        normalize_convergence({'min_batches': 1})
+
+
+def test_batch_means():
+    state = run_slots(init_convergence_state(), [1., 3., 5., 7., 9.],
+                      batch_slots=2)
+    # Batches (1, 3) and (5, 7); 9 is in the open batch
+    assert int(state['num_batches']) == 2
+    assert float(state['sum'][0]) == pytest.approx(2. + 6.)
+    assert float(state['sum_sq'][0]) == pytest.approx(4. + 36.)
+    assert float(state['batch_sum'][0]) == pytest.approx(9.)
+    mean, half_width = confidence_interval(state, .95)
+    assert float(mean[0]) == pytest.approx(4.)
+    # Sample std. of the batch means is 2 * sqrt(2)
+    assert float(half_width[0]) == pytest.approx(1.96 * 2., rel=1e-3)
+
+
+def test_warmup_slots_are_ignored():
+    state = run_slots(init_convergence_state(), [100., 100., 1., 3.],
+                      batch_slots=2, warmup_slots=2)
+    assert int(state['num_slots']) == 2
+    assert int(state['num_batches']) == 1
+    assert float(state['sum'][0]) == pytest.approx(2.)
+
+
+def test_chunks_close_the_same_batches():
+    values = [float(value) for value in range(10)]
+    single = run_slots(init_convergence_state(), values, batch_slots=3)
+    # Second chunk continues from the state of the first one
+    chunked = run_slots(init_convergence_state(), values[:4], batch_slots=3)
+    chunked = run_slots(chunked, values[4:], batch_slots=3, first_slot=4)
+    for key in single:
+        np.testing.assert_allclose(single[key], chunked[key])
+
+
+def test_is_converged():
+    convergence = normalize_convergence({'min_batches': 2,
+                                         'olla_precision_db': 1.})
+    constant = run_slots(init_convergence_state(), [5.] * 4, batch_slots=2)
+    assert bool(is_converged(constant, convergence))
+    # Too few batches
+    short = run_slots(init_convergence_state(), [5.] * 2, batch_slots=2)
+    assert not bool(is_converged(short, convergence))
+    noisy = run_slots(init_convergence_state(), [0., 0., 10., 10.],
+                      batch_slots=2)
+    assert not bool(is_converged(noisy, convergence))
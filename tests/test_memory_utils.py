@@ -0,0 +1,91 @@
+# tests/test_memory_utils.py
+
+import pytest
+
+from simulation.run_simulation import create_antenna_arrays, \
+    create_resource_grid
+from utils.memory_utils import estimate_memory, fit_to_budget
+
+
+@pytest.fixture(scope='module')
+def setup():
+    bs_array, ut_array = create_antenna_arrays(3.5e9)
+    resource_grid = create_resource_grid(1, 48, 30e3, 4, ut_array)
+    return dict(num_rings=1, num_ut_per_sector=4, bs_array=bs_array,
+                ut_array=ut_array, resource_grid=resource_grid)
+
+
+def test_estimate_scales_with_batch_and_slots(setup):
+    small = estimate_memory(1, num_slots=100, **setup)
+    assert small['peak'] == small['persistent'] + max(small['stages'].values())
+    batch = estimate_memory(2, num_slots=100, **setup)
+    assert batch['peak'] == 2 * small['peak']
+    slots = estimate_memory(1, num_slots=200, **setup)
+    assert slots['history'] == 2 * small['history']
+
+
+def test_estimate_of_options(setup):
+    base = estimate_memory(1, num_slots=100, **setup)
+    carriers = estimate_memory(1, num_slots=100, num_carriers=2, **setup)
+    assert carriers['persistent'] > base['persistent']
+    strided = estimate_memory(1, num_slots=100, freq_stride=4, **setup)
+    assert strided['persistent'] < base['persistent']
+    compact = estimate_memory(1, num_slots=100, compact_hist_float=True,
+                              **setup)
+    assert compact['history'] < base['history']
+    cached = estimate_memory(1, num_slots=100, rzf_cache=True, **setup)
+    assert cached['persistent'] > base['persistent']
+
+
+def test_estimate_is_exact_python_int(setup):
+    # Large runs overflow int32
+    setup = dict(setup, num_rings=2,
+                 resource_grid=create_resource_grid(
+                     14, 128, 30e3, 4, setup['ut_array']))
+    estimate = estimate_memory(8, num_slots=1000, **setup)
+    assert isinstance(estimate['peak'], int)
+    assert estimate['peak'] > 2**31
+
+
+def test_fit_to_budget_with_estimate_memory(setup):
+    def estimate(batch_size, num_slots):
+        return estimate_memory(batch_size, num_slots=num_slots, **setup)
+    full = estimate(8, 1000)['peak']
+    batch_size, chunk_slots, fitted = fit_to_budget(
+        estimate, full // 2, batch_size=8, num_slots=1000)
+    assert fitted['peak'] <= full // 2
+    assert (batch_size, chunk_slots) != (8, None)
+
+
+def estimate_fn(batch_size, num_slots):
+    # Memory growing with the batch size and the chunk length
+    peak = batch_size * (1000 + 10 * num_slots)
+    return {'peak': peak}
+
+
+def test_fit_to_budget_chunks_first():
+    batch_size, chunk_slots, estimate = fit_to_budget(
+        estimate_fn, 8 * (1000 + 10 * 200), batch_size=8, num_slots=1000,
+        min_chunk_slots=100)
+    assert (batch_size, chunk_slots) == (8, 125)
+    assert estimate['peak'] <= 8 * (1000 + 10 * 200)
+
+
+def test_fit_to_budget_then_downscales():
+    batch_size, chunk_slots, _ = fit_to_budget(
+        estimate_fn, 4 * (1000 + 10 * 100), batch_size=8, num_slots=1000,
+        min_chunk_slots=100)
+    assert (batch_size, chunk_slots) == (4, 100)
+
+
+def test_fit_to_budget_fits_unchanged():
+    assert fit_to_budget(estimate_fn, 1e9, batch_size=8,
+                         num_slots=1000)[:2] == (8, None)
+
+
+def test_fit_to_budget_raises():
+    with pytest.raises(MemoryError):
+        fit_to_budget(estimate_fn, 1e3, batch_size=8, num_slots=1000,
+                      downscale=False)
+    with pytest.raises(MemoryError):
+        fit_to_budget(estimate_fn, 10, batch_size=8, num_slots=1000)
@@ -0,0 +1,28 @@
+# tests/test_phy_abstraction.py
+
+import pytest
+from sionna.phy import config
+from sionna.sys import PHYAbstraction
+
+from models.phy_abstraction import CachedPHYAbstraction, \
+    phy_tables_supported, verify_phy_abstraction
+
+pytestmark = pytest.mark.skipif(not phy_tables_supported(),
+                                reason='Sionna version not supported')
+
+
+def test_cached_tables_match_phy_abstraction(tmp_path):
+    built = CachedPHYAbstraction(cache_dir=str(tmp_path))
+    assert built._tables_built
+    loaded = CachedPHYAbstraction(cache_dir=str(tmp_path))
+    assert not loaded._tables_built
+    for candidate in [built, loaded]:
+        mismatch = verify_phy_abstraction(PHYAbstraction(), candidate)
+        assert not any(mismatch.values()), mismatch
+
+
+def test_verification_keeps_random_state(tmp_path):
+    config.seed = 1
+    state = config.tf_rng.state.numpy().copy()
+    CachedPHYAbstraction(cache_dir=str(tmp_path), verify=True)
+    assert (config.tf_rng.state.numpy() == state).all()
@@ -0,0 +1,63 @@
+# tests/test_precoder_cache.py
+
+import numpy as np
+import pytest
+import tensorflow as tf
+from sionna.phy.mimo import rzf_precoding_matrix
+
+from simulation.run_simulation import create_antenna_arrays, \
+    create_resource_grid
+from utils.precoder_cache import RZFPrecoderCache
+from utils.sinr_utils import rzf_regularizer
+from utils.stream_management import get_stream_management
+
+BATCH_SIZE, NUM_BS, NUM_UT_PER_SECTOR, NUM_SC = 2, 6, 2, 4
+NO = .1
+
+
+@pytest.fixture(scope='module')
+def setup():
+    bs_array, ut_array = create_antenna_arrays(3.5e9)
+    resource_grid = create_resource_grid(1, NUM_SC, 30e3, NUM_UT_PER_SECTOR,
+                                         ut_array)
+    num_ut = NUM_BS * NUM_UT_PER_SECTOR
+    stream_management = get_stream_management('downlink', num_ut, NUM_BS, 1,
+                                               NUM_UT_PER_SECTOR)
+    rng = np.random.default_rng(0)
+    shape = [BATCH_SIZE, num_ut, int(ut_array.num_ant), NUM_BS,
+             int(bs_array.num_ant), 1, NUM_SC]
+    h_freq = tf.complex(tf.constant(rng.normal(size=shape), tf.float32),
+                        tf.constant(rng.normal(size=shape), tf.float32))
+    fading = tf.constant(rng.uniform(.5, 1.5, [BATCH_SIZE, num_ut, NUM_BS]),
+                         tf.float32)
+    return resource_grid, stream_management, h_freq, fading
+
+
+@pytest.mark.parametrize('diag_loading', [0., 1e-2])
+@pytest.mark.parametrize('max_update_ratio', [1., .25])
+def test_updated_precoders_match_rzf(setup, diag_loading, max_update_ratio):
+    resource_grid, stream_management, h_freq, fading = setup
+    cache = RZFPrecoderCache(resource_grid, stream_management, alpha=NO,
+                             tolerance=.05, diag_loading=diag_loading,
+                             max_update_ratio=max_update_ratio)
+    state = cache.init_state(h_freq, tf.ones_like(fading))
+    new_state = cache.update_state(state, lambda: h_freq, fading,
+                                   tf.constant(False))
+    # Transmitters which took the new precoder
+    # [batch_size, num_bs]
+    updated = np.any(new_state['amplitude'].numpy() !=
+                     state['amplitude'].numpy(), axis=-1)
+    assert updated.sum() == int(np.ceil(max_update_ratio * updated.size))
+
+    h_fading = h_freq * tf.cast(tf.sqrt(fading), h_freq.dtype)[
+        :, :, tf.newaxis, :, tf.newaxis, tf.newaxis, tf.newaxis]
+    h_pc = cache.get_desired_channels(h_fading)
+    alpha = tf.broadcast_to(tf.reshape(
+        rzf_regularizer(h_fading, NO, diag_loading),
+        [BATCH_SIZE, NUM_BS, 1, NUM_SC] if diag_loading else [1] * 4),
+        h_pc.shape[:4])
+    reference = rzf_precoding_matrix(h_pc, alpha).numpy()
+    np.testing.assert_allclose(new_state['precoder'].numpy()[updated],
+                               reference[updated], atol=1e-5)
+    np.testing.assert_array_equal(new_state['precoder'].numpy()[~updated],
+                                  state['precoder'].numpy()[~updated])
@@ -0,0 +1,130 @@
+# tests/test_results_query.py
+
+import numpy as np
+import pytest
+
+from utils.results_query import ResultsStore, DB_HIST_EDGES, \
+    compute_results_avg_from_store
+from utils.results_utils import TRACE_KEYS
+
+
+def make_hist(num_slots=10, num_bs=3, num_ut_per_sector=2, seed=0):
+    """ Cleaned history with random values and a few masked samples """
+    rng = np.random.default_rng(seed)
+    shape = (num_slots, num_bs, num_ut_per_sector)
+    hist = {key: rng.uniform(1., 10., shape) for key in TRACE_KEYS}
+    hist['pathloss_serving_cell'] = 10**(rng.uniform(80., 120., shape) / 10)
+    hist['sinr_eff'] = 10**(rng.uniform(-5., 30., shape) / 10)
+    hist['mcs_index'] = rng.integers(0, 28, shape).astype(float)
+    hist['harq'] = rng.integers(0, 2, shape).astype(float)
+    masked = rng.uniform(size=shape) < .2
+    for key in TRACE_KEYS:
+        hist[key] = np.where(masked, np.nan, hist[key])
+    return hist
+
+
+def test_user_mean_matches_nanmean():
+    hist = make_hist()
+    store = ResultsStore(bucket_slots=4)
+    store.add(hist)
+    np.testing.assert_allclose(
+        store.user_mean('num_decoded_bits'),
+        np.nanmean(hist['num_decoded_bits'], axis=0).reshape(-1))
+
+
+def test_slot_range_extends_to_buckets():
+    hist = make_hist()
+    store = ResultsStore(bucket_slots=4)
+    store.add(hist)
+    # Slots 5 to 6 lie in the second bucket, slots 4 to 7
+    np.testing.assert_allclose(
+        store.user_mean('tx_power', slots=(5, 6)),
+        np.nanmean(hist['tx_power'][4:8], axis=0).reshape(-1))
+
+
+def test_cell_and_drop_selection():
+    store = ResultsStore(bucket_slots=5)
+    hists = [make_hist(seed=0), make_hist(seed=1)]
+    for hist in hists:
+        store.add(hist)
+    index = store.user_index(drops=1, cells=[2])
+    np.testing.assert_array_equal(index, [[1, 2, 0], [1, 2, 1]])
+    np.testing.assert_allclose(
+        store.user_mean('mcs_index', drops=1, cells=[2]),
+        np.nanmean(hists[1]['mcs_index'][:, 2], axis=0))
+    assert store.user_mean('mcs_index').shape == (12,)
+
+
+def test_out_of_range_samples():
+    hist = make_hist()
+    edges = DB_HIST_EDGES['pathloss_serving_cell']
+    hist['pathloss_serving_cell'][:] = 10**((edges[-1] + 10) / 10)
+    hist['pathloss_serving_cell'][0] = 10**((edges[0] - 10) / 10)
+    store = ResultsStore(bucket_slots=4)
+    store.add(hist)
+    counts, _ = store.histogram('pathloss_serving_cell')
+    underflow, overflow = store.out_of_range('pathloss_serving_cell')
+    assert counts.sum() == 0
+    assert underflow == 6
+    assert overflow == 54
+    # Percentiles falling among out-of-range samples are unknown
+    assert np.isnan(store.percentile('pathloss_serving_cell', 50))
+
+
+def test_percentile_within_bins():
+    hist = make_hist(num_slots=200)
+    store = ResultsStore(bucket_slots=50)
+    store.add(hist)
+    sinr_db = 10 * np.log10(hist['sinr_eff'])
+    expected = np.nanpercentile(sinr_db, 50)
+    assert store.percentile('sinr_eff', 50) == pytest.approx(expected,
+                                                             abs=.5)
+
+
+def test_tbler_by_mcs():
+    hist = make_hist()
+    store = ResultsStore(bucket_slots=3)
+    store.add(hist)
+    tbler, num_tx = store.tbler_by_mcs()
+    mcs = hist['mcs_index'][np.isfinite(hist['harq'])]
+    assert num_tx.sum() == mcs.size
+    ack = hist['harq'][np.isfinite(hist['harq'])]
+    mcs0 = mcs == mcs[0]
+    assert tbler[int(mcs[0])] == pytest.approx(1 - ack[mcs0].mean())
+
+
+def test_save_load(tmp_path):
+    store = ResultsStore(bucket_slots=4)
+    store.add(make_hist(seed=0))
+    store.add(make_hist(seed=1))
+    filename = tmp_path / 'store.npz'
+    store.save(filename)
+    loaded = ResultsStore.load(filename)
+    for metric in TRACE_KEYS:
+        np.testing.assert_array_equal(loaded.user_mean(metric),
+                                      store.user_mean(metric))
+        assert loaded.out_of_range(metric) == store.out_of_range(metric)
+    np.testing.assert_array_equal(loaded.histogram('sinr_eff')[0],
+                                  store.histogram('sinr_eff')[0])
+
+
+def test_extend_rejects_duplicate_drops():
+    store = ResultsStore(bucket_slots=4)
+    store.add(make_hist())
+    # Same samples, hence same linear histogram bins
+    other = ResultsStore(bucket_slots=4)
+    other.add(make_hist())
+    with pytest.raises(AssertionError):
+        store.extend(other)
+    other.drops[0]['drop'] = 1
+    store.extend(other)
+    assert len(store.drops) == 2
+
+
+def test_results_avg_from_store():
+    hist = make_hist()
+    store = ResultsStore(bucket_slots=4)
+    store.add(hist)
+    avg = compute_results_avg_from_store(store)
+    np.testing.assert_allclose(
+        avg['TBLER'], 1 - np.nanmean(hist['harq'], axis=0).reshape(-1))
@@ -0,0 +1,21 @@
+# tests/test_state_utils.py
+
+import numpy as np
+
+from utils.state_utils import save_sim_state, load_sim_state
+
+
+def test_save_load_round_trip(tmp_path):
+    # Policy names may contain '/', as in multi-carrier or duplex runs
+    state = {'carrier_0/pf/downlink': {'olla_offset': np.arange(6.),
+                                       'harq_feedback': -np.ones(6, int)},
+             'default': {'pf_metric': np.ones((2, 3), np.float32)}}
+    filename = tmp_path / 'state.npz'
+    save_sim_state(filename, state)
+    loaded = load_sim_state(filename)
+    assert set(loaded) == set(state)
+    for name, policy_state in state.items():
+        assert set(loaded[name]) == set(policy_state)
+        for key, value in policy_state.items():
+            np.testing.assert_array_equal(loaded[name][key], value)
+            assert loaded[name][key].dtype == value.dtype
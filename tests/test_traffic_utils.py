@@ -0,0 +1,110 @@
+# tests/test_traffic_utils.py
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from utils.traffic_utils import normalize_traffic, init_queue, \
+    init_traffic_counters, draw_arrivals, enqueue_arrivals, is_backlogged, \
+    drain_queue
+
+SHAPE = [1, 2, 3]
+
+
+def make_queue(max_queue=4):
+    return init_queue(SHAPE, max_queue), init_traffic_counters(SHAPE)
+
+
+def test_normalize_traffic():
+    assert normalize_traffic(None) is None
+    traffic = normalize_traffic({'model': 'poisson'})
+    assert traffic['max_queue'] == 16
+    with pytest.raises(AssertionError):
+        normalize_traffic({'model': 'cbr'})
+
+
+@pytest.mark.parametrize('model', ['ftp3', 'poisson'])
+def test_draw_arrivals_mean(model):
+    traffic = normalize_traffic({'model': model, 'arrival_rate': 500.,
+                                 'packet_size': 1e3})
+    num_packets, num_bits = draw_arrivals(traffic, [100, 10, 10], 1e-3,
+                                          tf.constant([1, 2], tf.int32))
+    # .5 packets per slot, of 1e3 bits on average
+    assert np.mean(num_packets) == pytest.approx(.5, rel=.05)
+    assert np.mean(num_bits) == pytest.approx(500., rel=.05)
+    # No bits without packets
+    assert np.all(num_bits.numpy()[num_packets.numpy() == 0] == 0)
+
+
+def test_draw_arrivals_is_stateless():
+    traffic = normalize_traffic({})
+    seed = tf.constant([3, 4], tf.int32)
+    first = draw_arrivals(traffic, SHAPE, 1e-3, seed)
+    second = draw_arrivals(traffic, SHAPE, 1e-3, seed)
+    for x, y in zip(first, second):
+        np.testing.assert_array_equal(x, y)
+
+
+def test_enqueue_then_drain_in_fifo_order():
+    queue, counters = make_queue()
+    ones = tf.ones(SHAPE, tf.int32)
+    queue, counters = enqueue_arrivals(queue, counters, ones,
+                                       100. * tf.ones(SHAPE), slot=0)
+    queue, counters = enqueue_arrivals(queue, counters, ones,
+                                       50. * tf.ones(SHAPE), slot=2)
+    assert np.all(is_backlogged(queue))
+    np.testing.assert_array_equal(counters['num_packets_arrived'], 2)
+
+    # The first packet and half of the second are served in slot 2
+    queue, counters, served = drain_queue(queue, counters,
+                                          125 * ones, slot=2,
+                                          slot_duration=1e-3)
+    np.testing.assert_array_equal(served, 125)
+    np.testing.assert_array_equal(counters['num_packets_done'], 1)
+    np.testing.assert_allclose(counters['packet_latency_sum'], 3e-3)
+    np.testing.assert_array_equal(queue['queue_bits'][..., 0], 25.)
+    np.testing.assert_array_equal(queue['queue_arrival_slot'][..., 0], 2)
+
+    # Bits decoded beyond the buffered ones are not served
+    queue, counters, served = drain_queue(queue, counters,
+                                          100 * ones, slot=3,
+                                          slot_duration=1e-3)
+    np.testing.assert_array_equal(served, 25)
+    assert not np.any(is_backlogged(queue))
+    np.testing.assert_allclose(counters['packet_latency_sum'], 5e-3)
+
+
+def test_large_files_are_exact():
+    queue, counters = make_queue()
+    ones = tf.ones(SHAPE, tf.int32)
+    # Not representable in float32
+    queue, counters = enqueue_arrivals(queue, counters, ones,
+                                       (2.**25 + 1) * tf.ones(SHAPE, tf.float64),
+                                       slot=0)
+    queue, counters, served = drain_queue(queue, counters, ones, slot=0,
+                                          slot_duration=1e-3)
+    np.testing.assert_array_equal(served, 1)
+    np.testing.assert_array_equal(queue['queue_bits'][..., 0], 2.**25)
+
+
+def test_full_queue_drops_packets():
+    queue, counters = make_queue(max_queue=2)
+    ones = tf.ones(SHAPE, tf.int32)
+    for slot in range(3):
+        queue, counters = enqueue_arrivals(queue, counters, 2 * ones,
+                                           10. * tf.ones(SHAPE), slot=slot)
+    np.testing.assert_array_equal(counters['num_packets_arrived'], 6)
+    np.testing.assert_array_equal(counters['num_packets_dropped'], 2)
+    np.testing.assert_array_equal(queue['queue_arrival_slot'][..., 1], 1)
+
+
+def test_counters_not_updated_during_warmup():
+    queue, counters = make_queue()
+    ones = tf.ones(SHAPE, tf.int32)
+    queue, counters = enqueue_arrivals(queue, counters, ones,
+                                       10. * tf.ones(SHAPE), slot=0,
+                                       count=False)
+    queue, counters, _ = drain_queue(queue, counters, 10 * ones, slot=0,
+                                     slot_duration=1e-3, count=False)
+    for value in counters.values():
+        np.testing.assert_array_equal(value, 0)
@@ -0,0 +1,127 @@
+# tests/test_work_queue.py
+
+import os
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from simulation.work_queue import WorkQueue, save_task_results, \
+    merge_results
+
+
+def test_enqueue_sweep(tmp_path):
+    queue = WorkQueue(str(tmp_path))
+    task_ids = queue.enqueue_sweep({'NUM_UT_PER_SECTOR': [5, 10]},
+                                   seeds=[1, 2])
+    assert len(task_ids) == 4
+    assert queue.status() == {'pending': 4, 'claimed': 0, 'done': 0,
+                              'failed': 0}
+
+
+def test_enqueue_rejects_existing_task(tmp_path):
+    queue = WorkQueue(str(tmp_path))
+    first = queue.enqueue_sweep({'NUM_UT_PER_SECTOR': [5]}, seeds=[1])
+    # Another sweep of the same queue does not overwrite the first one
+    second = queue.enqueue_sweep({'NUM_RINGS': [1]}, seeds=[1])
+    assert set(first).isdisjoint(second)
+    with pytest.raises(FileExistsError):
+        queue.enqueue_sweep({'NUM_UT_PER_SECTOR': [5]}, seeds=[1])
+    queue.claim('w1')
+    with pytest.raises(FileExistsError):
+        queue.enqueue(task_id=first[0])
+    assert queue.status()['pending'] + queue.status()['claimed'] == 2
+
+
+def test_claim_is_exclusive(tmp_path):
+    queue = WorkQueue(str(tmp_path))
+    queue.enqueue(task_id='a')
+    task = queue.claim('w1')
+    assert task['task_id'] == 'a'
+    assert task['attempts'] == 1
+    assert queue.claim('w2') is None
+
+
+def test_claim_starts_lease(tmp_path):
+    queue = WorkQueue(str(tmp_path), lease=60.)
+    queue.enqueue(task_id='a')
+    # Task enqueued long before it is claimed
+    pending = os.path.join(str(tmp_path), 'pending', 'a.json')
+    old = time.time() - 3600
+    os.utime(pending, (old, old))
+    queue.claim('w1')
+    assert queue.requeue_abandoned() == []
+
+
+def test_abandoned_task_is_requeued_then_failed(tmp_path):
+    queue = WorkQueue(str(tmp_path), lease=0., max_attempts=2)
+    queue.enqueue(task_id='a')
+    queue.claim('w1')
+    time.sleep(.01)
+    assert queue.requeue_abandoned() == ['a']
+    assert queue.status()['pending'] == 1
+    queue.claim('w2')
+    time.sleep(.01)
+    queue.requeue_abandoned()
+    assert queue.status()['failed'] == 1
+
+
+def test_complete_leaves_task_claimed_again(tmp_path):
+    queue = WorkQueue(str(tmp_path), lease=0.)
+    queue.enqueue(task_id='a')
+    stale = queue.claim('w1')
+    time.sleep(.01)
+    queue.requeue_abandoned()
+    queue.claim('w2')
+    # The first worker completes after the task was claimed by the second
+    queue.complete(stale)
+    assert queue.status()['claimed'] == 1
+    assert queue.status()['done'] == 1
+
+
+def test_complete_removes_requeued_copy(tmp_path):
+    queue = WorkQueue(str(tmp_path), lease=0.)
+    queue.enqueue(task_id='a')
+    task = queue.claim('w1')
+    time.sleep(.01)
+    queue.requeue_abandoned()
+    queue.complete(task)
+    assert queue.status() == {'pending': 0, 'claimed': 0, 'done': 1,
+                              'failed': 0}
+
+
+def test_requeued_task_is_lost_by_its_worker(tmp_path):
+    queue = WorkQueue(str(tmp_path), lease=0.)
+    queue.enqueue(task_id='a')
+    stale = queue.claim('w1')
+    assert queue.heartbeat(stale)
+    time.sleep(.01)
+    queue.requeue_abandoned()
+    task = queue.claim('w2')
+    assert task['history'][0]['error'] == 'lease expired'
+    # The lease of the other worker is not refreshed, nor its task released
+    assert not queue.heartbeat(stale)
+    queue.release(stale, error='failed')
+    assert queue.status()['claimed'] == 1
+    assert queue.heartbeat(task)
+
+
+def test_merge_results_with_slashes_in_names(tmp_path):
+    queue = WorkQueue(str(tmp_path))
+    queue.enqueue({'NUM_UT_PER_SECTOR': 2}, seed=3, task_id='a')
+    task = queue.claim('w1')
+    results = {'simulator': SimpleNamespace(multi_policy=True),
+               'results_avg': {
+                   'carrier_0/pf/downlink': {'MCS': np.array([1., 2.])},
+                   'carrier_0/rr/downlink': {'MCS': np.array([3., 4.])}}}
+    save_task_results(queue.result_file('a'), task, results)
+    queue.complete(task)
+    dataset = merge_results(queue)
+    np.testing.assert_array_equal(
+        dataset['policy'], ['carrier_0/pf/downlink'] * 2 +
+        ['carrier_0/rr/downlink'] * 2)
+    np.testing.assert_array_equal(dataset['MCS'], [1., 2., 3., 4.])
+    np.testing.assert_array_equal(dataset['user'], [0, 1, 0, 1])
+    np.testing.assert_array_equal(dataset['seed'], [3] * 4)
+    np.testing.assert_array_equal(dataset['NUM_UT_PER_SECTOR'], [2] * 4)
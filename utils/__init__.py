@@ -1,5 +1,20 @@
 # utils/__init__.py
 
 from .stream_management import get_stream_management
-from .sinr_utils import get_sinr, estimate_achievable_rate
-from .results_utils import init_result_history, record_results, clean_hist
+from .sinr_utils import get_sinr, get_sinr_active_set, estimate_achievable_rate
+from .results_utils import init_result_history, record_results, clean_hist, \
+    compute_results_avg, concat_hists, aggregate_carrier_throughput, \
+    compute_traffic_avg
+from .cache_utils import get_cache_dir, hash_key, file_signature
+from .convergence_utils import CONVERGENCE_METRICS, normalize_convergence, \
+    format_convergence_report
+from .state_utils import save_sim_state, load_sim_state
+from .precoder_cache import RZFPrecoderCache
+from .memory_utils import estimate_memory, format_memory_estimate, fit_to_budget
+from .tuning_utils import load_tuning, save_tuning, apply_thread_settings
+from .topology_cache import TopologyCache
+from .rng_utils import RNG_STAGES, RNGStreams
+from .telemetry import Telemetry, interval_metrics
+from .results_query import ResultsStore, compute_results_avg_from_store
+from .traffic_utils import TRAFFIC_MODELS, normalize_traffic, draw_arrivals, \
+    enqueue_arrivals, drain_queue
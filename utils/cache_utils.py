@@ -0,0 +1,30 @@
+# utils/cache_utils.py
+
+import os
+import json
+import hashlib
+
+# Default root directory of the on-disk caches
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'sionna_sls')
+
+
+def get_cache_dir(subdir, cache_dir=None):
+    """ Return (and create) the cache directory for a given cache type """
+    if cache_dir is None:
+        cache_dir = os.getenv('SIONNA_SLS_CACHE_DIR', DEFAULT_CACHE_DIR)
+    path = os.path.join(cache_dir, subdir)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def hash_key(key):
+    """ Hash a JSON-serializable key into a short hexadecimal string """
+    key_str = json.dumps(key, sort_keys=True, default=str)
+    return hashlib.sha256(key_str.encode('utf-8')).hexdigest()[:24]
+
+
+def file_signature(filename):
+    """ Identify the content of a file by its name, size and modification
+    time, without reading it """
+    stat = os.stat(filename)
+    return [os.path.abspath(filename), stat.st_size, stat.st_mtime_ns]
@@ -0,0 +1,107 @@
+# utils/convergence_utils.py
+
+from statistics import NormalDist
+import tensorflow as tf
+
+# Network-level metrics whose convergence is monitored, in this order
+CONVERGENCE_METRICS = ['throughput', 'tbler', 'olla_offset']
+
+
+def normalize_convergence(convergence):
+    """ Fill in default convergence settings.
+    - rel_precision: target CI half-width relative to the mean, for
+      throughput and TBLER
+    - olla_precision_db: target CI half-width [dB] for the OLLA offset
+    - batch_slots: number of slots per batch in the batch-means method
+    - min_batches: minimum number of batches before stopping
+    - confidence: confidence level of the intervals
+    """
+    if convergence is None:
+        return None
+    convergence = dict(convergence)
+    convergence.setdefault('rel_precision', 0.02)
+    convergence.setdefault('olla_precision_db', 0.1)
+    convergence.setdefault('batch_slots', 50)
+    convergence.setdefault('min_batches', 10)
+    convergence.setdefault('confidence', 0.95)
+    assert convergence['batch_slots'] > 0
+    assert convergence['min_batches'] > 1
+    assert 0 < convergence['confidence'] < 1
+    return convergence
+
+
+def init_convergence_state(dtype=tf.float32):
+    """ Initialize the batch-means accumulators. num_slots counts the slots
+    accumulated after the warm-up, so that batches are closed at the same
+    slots when a run is split into warm-started chunks """
+    num_metrics = len(CONVERGENCE_METRICS)
+    return {'batch_sum': tf.zeros([num_metrics], dtype),
+            'sum': tf.zeros([num_metrics], dtype),
+            'sum_sq': tf.zeros([num_metrics], dtype),
+            'num_batches': tf.zeros([], tf.int32),
+            'num_slots': tf.zeros([], tf.int32)}
+
+
+def slot_metrics(num_decoded_bits, harq_feedback, olla_offset, dtype=tf.float32):
+    """ Network-level metrics of one slot: mean decoded bits per user, TBLER
+    across scheduled users and mean OLLA offset """
+    throughput = tf.reduce_mean(tf.cast(num_decoded_bits, dtype))
+    num_nack = tf.reduce_sum(tf.cast(harq_feedback == 0, dtype))
+    num_scheduled = tf.reduce_sum(tf.cast(harq_feedback >= 0, dtype))
+    tbler = tf.math.divide_no_nan(num_nack, num_scheduled)
+    offset = tf.reduce_mean(tf.cast(olla_offset, dtype))
+    return tf.stack([throughput, tbler, offset])
+
+
+def update_convergence_state(state, metrics, slot, batch_slots,
+                             warmup_slots=0):
+    """ Accumulate the metrics of one slot and close the batch every
+    batch_slots slots. Slots within the warm-up window are ignored """
+    in_warmup = slot < warmup_slots
+    metrics = tf.where(in_warmup, tf.zeros_like(metrics), metrics)
+    batch_sum = state['batch_sum'] + metrics
+    num_slots = state['num_slots'] + tf.cast(tf.logical_not(in_warmup),
+                                             tf.int32)
+    end_of_batch = tf.logical_and(
+        tf.logical_not(in_warmup),
+        tf.math.mod(num_slots, batch_slots) == 0)
+    batch_mean = batch_sum / tf.cast(batch_slots, metrics.dtype)
+    one = tf.cast(end_of_batch, metrics.dtype)
+    return {'batch_sum': (1 - one) * batch_sum,
+            'sum': state['sum'] + one * batch_mean,
+            'sum_sq': state['sum_sq'] + one * batch_mean**2,
+            'num_batches': state['num_batches'] + tf.cast(end_of_batch, tf.int32),
+            'num_slots': num_slots}
+
+
+def confidence_interval(state, confidence):
+    """ Mean and confidence interval half-width of each metric, from the
+    batch means """
+    z = NormalDist().inv_cdf(.5 + confidence / 2)
+    n = tf.cast(state['num_batches'], state['sum'].dtype)
+    mean = tf.math.divide_no_nan(state['sum'], n)
+    var = tf.math.divide_no_nan(state['sum_sq'] - n * mean**2, n - 1)
+    half_width = z * tf.sqrt(tf.maximum(var, 0.) / tf.maximum(n, 1.))
+    return mean, half_width
+
+
+def is_converged(state, convergence):
+    """ Whether all metrics reached the target precision """
+    mean, half_width = confidence_interval(state, convergence['confidence'])
+    target = tf.stack([convergence['rel_precision'] * tf.abs(mean[0]),
+                       convergence['rel_precision'] * tf.abs(mean[1]),
+                       tf.cast(convergence['olla_precision_db'], mean.dtype)])
+    return tf.logical_and(
+        state['num_batches'] >= convergence['min_batches'],
+        tf.reduce_all(half_width <= target))
+
+
+def format_convergence_report(hist):
+    """ Summarize the number of simulated slots and the achieved confidence
+    interval of each metric """
+    lines = [f"Slots simulated: {int(hist['num_slots_simulated'])}"]
+    for metric, mean, ci in zip(CONVERGENCE_METRICS,
+                                hist['convergence_mean'],
+                                hist['convergence_ci']):
+        lines.append(f"  {metric}: {mean:.4g} +/- {ci:.3g}")
+    return '\n'.join(lines)
@@ -0,0 +1,169 @@
+# utils/memory_utils.py
+
+import tensorflow as tf
+from sionna.sys import get_num_hex_in_grid
+
+from utils.results_utils import TRACE_KEYS, get_hist_dtypes
+
+# Bytes per real and complex element, per precision
+DTYPE_BYTES = {'single': (4, 8),
+               'double': (8, 16)}
+
+
+def estimate_memory(batch_size,
+                    num_rings,
+                    num_ut_per_sector,
+                    bs_array,
+                    ut_array,
+                    resource_grid,
+                    num_slots,
+                    direction='downlink',
+                    freq_stride=1,
+                    num_policies=1,
+                    num_carriers=1,
+                    active_set_sinr=False,
+                    rzf_cache=False,
+                    compact_hist_float=False,
+                    num_paths=24,
+                    num_rays=20,
+                    precision='single'):
+    """ Estimate the device memory [bytes] of a run, per stage.
+
+    Stages are executed one after the other within a slot, hence the peak is
+    estimated as the memory held across slots (channel loop state, cached
+    precoder, result history) plus the largest transient stage. Sizes are
+    those of the largest tensors of each stage; XLA temporaries are not
+    accounted for, so a margin should be kept on the budget.
+    - num_paths: max. number of clusters of the 3GPP channel model
+    - num_rays: number of rays per cluster
+    - num_carriers: number of carriers, each holding its own channel and
+      cached precoder across slots. num_policies counts the policy branches
+      of all carriers
+    """
+    r, c = DTYPE_BYTES[precision]
+    num_bs = int(get_num_hex_in_grid(num_rings)) * 3
+    num_ut = num_bs * num_ut_per_sector
+    # Sizes are Python ints: the array and grid attributes may be int32
+    # tensors, whose products overflow
+    num_ut_ant = int(ut_array.num_ant)
+    num_bs_ant = int(bs_array.num_ant)
+    num_sym = int(resource_grid.num_ofdm_symbols)
+    fft_size = int(resource_grid.fft_size)
+    num_streams_per_ut = int(resource_grid.num_streams_per_tx)
+    # Frequency samples of the generated channel
+    if freq_stride > 1:
+        num_freq_samples = -(-fft_size // freq_stride) + 1
+    else:
+        num_freq_samples = fft_size
+
+    # Number of antenna pairs across all BS-UT links
+    num_links = num_ut * num_ut_ant * num_bs * num_bs_ant
+    # Channel on the generated and on the full frequency grid
+    h_gen = batch_size * num_links * num_sym * num_freq_samples * c
+    h_full = batch_size * num_links * num_sym * fft_size * c
+
+    stages = {}
+    # Per-ray coefficients, before summing the rays of each cluster
+    stages['channel_coefficients'] = batch_size * num_links * num_paths * \
+        num_rays * num_sym * c
+    # Frequency response of each cluster, before summing the clusters
+    stages['ofdm_channel'] = batch_size * num_links * num_paths * num_sym * \
+        num_freq_samples * c + h_gen
+    # New realization, blending with the previous one, fading, interpolation
+    stages['channel_update'] = 3 * h_gen + (h_full if freq_stride > 1 else 0)
+
+    # DL precoding: desired channels, Gram matrix and precoder
+    num_streams_per_bs = num_ut_per_sector * num_streams_per_ut
+    h_pc = batch_size * num_bs * num_sym * fft_size * num_streams_per_bs * \
+        num_bs_ant * c
+    gram = batch_size * num_bs * num_sym * fft_size * num_streams_per_bs**2 * c
+    precoder_state = 2 * h_pc + gram if rzf_cache else 0
+    if direction in ['downlink', 'duplex']:
+        stages['precoding'] = 3 * h_pc + gram
+
+    # Effective channel and LMMSE equalization
+    if active_set_sinr:
+        num_rx_ant = num_ut_ant if direction == 'downlink' else num_bs_ant
+        num_tx_ant = num_bs_ant if direction == 'downlink' else num_ut_ant
+        h_active = batch_size * num_bs**2 * num_rx_ant * num_tx_ant * \
+            num_sym * fft_size * c
+        h_eff = batch_size * num_bs**2 * num_rx_ant * num_streams_per_ut * \
+            num_sym * fft_size * c
+        stages['sinr'] = h_active + 3 * h_eff
+    else:
+        sinr = 0
+        for link_direction in (['downlink', 'uplink']
+                               if direction == 'duplex' else [direction]):
+            if link_direction == 'downlink':
+                h_eff = batch_size * num_ut * num_ut_ant * num_bs * \
+                    num_streams_per_bs * num_sym * fft_size * c
+            else:
+                h_eff = batch_size * num_bs * num_bs_ant * num_ut * \
+                    num_streams_per_ut * num_sym * fft_size * c
+            sinr = max(sinr, h_full + 3 * h_eff)
+        stages['sinr'] = sinr
+
+    # Scheduler, power control and PHY abstraction of all policies
+    stages['policies'] = num_policies * batch_size * num_bs * num_sym * \
+        fft_size * num_ut_per_sector * num_streams_per_ut * 4 * r
+
+    # Result history: TensorArray and stacked output
+    dtypes = get_hist_dtypes(num_sym * fft_size * num_streams_per_ut,
+                             compact_hist_float)
+    bytes_per_entry = sum(dtypes[key].size for key in TRACE_KEYS) + \
+        tf.bool.size
+    history = 2 * num_policies * num_slots * batch_size * num_ut * \
+        bytes_per_entry
+
+    # The channel of the last slot is also stored for warm-starting the next
+    # run
+    persistent = num_carriers * (2 * h_gen + precoder_state) + history
+    return {'stages': stages,
+            'history': history,
+            'persistent': persistent,
+            'peak': persistent + max(stages.values())}
+
+
+def format_memory_estimate(estimate):
+    """ Summarize a memory estimate in GB """
+    lines = ['Estimated memory [GB]:']
+    for stage, num_bytes in estimate['stages'].items():
+        lines.append(f'  {stage}: {num_bytes / 1e9:.3f}')
+    lines.append(f"  history: {estimate['history'] / 1e9:.3f}")
+    lines.append(f"  peak: {estimate['peak'] / 1e9:.3f}")
+    return '\n'.join(lines)
+
+
+def fit_to_budget(estimate_fn,
+                  budget_bytes,
+                  batch_size,
+                  num_slots,
+                  chunk_slots=None,
+                  min_chunk_slots=100,
+                  downscale=True):
+    """ Admission control of a run.
+    estimate_fn(batch_size, num_slots) returns the estimate of a run. If the
+    peak exceeds the budget, the run is split into chunks of halved length,
+    down to min_chunk_slots, then the batch size is halved. Raises a
+    MemoryError if downscale is False or if no configuration fits.
+    Returns the batch size, the chunk length (None if not chunked) and the
+    estimate """
+    chunk = num_slots if chunk_slots is None else min(chunk_slots, num_slots)
+    estimate = estimate_fn(batch_size, chunk)
+    while estimate['peak'] > budget_bytes:
+        if not downscale:
+            raise MemoryError(
+                f"Estimated peak memory {estimate['peak'] / 1e9:.2f} GB "
+                f"exceeds the budget of {budget_bytes / 1e9:.2f} GB")
+        if chunk > min_chunk_slots:
+            chunk = max(chunk // 2, min_chunk_slots)
+        elif batch_size > 1:
+            batch_size = batch_size // 2
+        else:
+            raise MemoryError(
+                f"Estimated peak memory {estimate['peak'] / 1e9:.2f} GB of a "
+                f"single example exceeds the budget of "
+                f"{budget_bytes / 1e9:.2f} GB")
+        estimate = estimate_fn(batch_size, chunk)
+    chunk_slots = None if chunk >= num_slots else int(chunk)
+    return batch_size, chunk_slots, estimate
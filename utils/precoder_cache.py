@@ -0,0 +1,212 @@
+# utils/precoder_cache.py
+
+import math
+import tensorflow as tf
+from sionna.phy.ofdm import RZFPrecodedChannel
+
+
+class RZFPrecoderCache(RZFPrecodedChannel):
+    """ Regularized zero-forcing precoder cached across slots.
+
+    Within a coherence block, the channel only changes by the per-link fading
+    amplitudes applied by ChannelMatrix.apply_fading, i.e., the desired
+    channel of each transmitter evolves as D H, with D diagonal. The Gram
+    matrix H H^H is computed once per coherence block, and the precoder is
+    obtained from (D H H^H D + alpha I)^{-1} D H, which avoids recomputing
+    the Gram matrix. The precoder of a transmitter whose fading amplitudes
+    moved by less than ``tolerance`` (relative) since its last update is
+    reused as is. The Cholesky factorization and solve are only run on the
+    transmitters that drifted: at most ``max_update_ratio`` of the
+    transmitters of the batch are gathered per slot, those with the largest
+    drift first, and their precoders are scattered back. Transmitters beyond
+    this budget keep their precoder until a later slot. ``diag_loading`` adds the regularization of
+    rzf_regularizer, from the per-link channel gains computed once per
+    coherence block. With ``tolerance=0`` the precoder matches
+    RZFPrecodedChannel with the regularizer of get_sinr up to numerical
+    precision.
+    """
+
+    def __init__(self,
+                 resource_grid,
+                 stream_management,
+                 alpha,
+                 tolerance=0.,
+                 diag_loading=0.,
+                 max_update_ratio=1.,
+                 precision=None):
+        super().__init__(resource_grid=resource_grid,
+                         stream_management=stream_management,
+                         precision=precision)
+        self.alpha = tf.cast(alpha, self.cdtype)
+        self.tolerance = tolerance
+        self.diag_loading = diag_loading
+        assert 0 < max_update_ratio <= 1
+        self.max_update_ratio = max_update_ratio
+        # Indices of the receivers served by each transmitter
+        # [num_tx, num_rx_per_tx]
+        self._precoding_ind = tf.convert_to_tensor(
+            stream_management.precoding_ind, tf.int32)
+
+    def _desired_fading_amplitude(self, fading, num_rx_ant):
+        """ Fading amplitude of each row of the desired channels
+        - Input: [batch_size, num_rx, num_tx]
+        - Output: [batch_size, num_tx, num_rx_per_tx * num_rx_ant]
+        """
+        # [num_tx, num_rx, batch_size]
+        fading = tf.transpose(fading, [2, 1, 0])
+        # [num_tx, num_rx_per_tx, batch_size]
+        fading = tf.gather(fading, self._precoding_ind, axis=1, batch_dims=1)
+        # [batch_size, num_tx, num_rx_per_tx]
+        fading = tf.transpose(fading, [2, 0, 1])
+        # [batch_size, num_tx, num_rx_per_tx * num_rx_ant]
+        return tf.repeat(tf.sqrt(fading), num_rx_ant, axis=-1)
+
+    def _regularizer(self, link_gain, fading):
+        """ Regularizer alpha of each transmitter, as rzf_regularizer on the
+        channel with fading
+        - link_gain: [batch_size, num_rx, num_tx, num_ofdm_sym,
+                      num_subcarriers], channel gain without fading
+        - fading: [batch_size, num_rx, num_tx]
+        - Output: [batch_size, num_tx, num_ofdm_sym, num_subcarriers, 1, 1]
+        """
+        if self.diag_loading == 0:
+            return self.alpha
+        # [batch_size, num_tx, num_ofdm_sym, num_subcarriers]
+        gain = tf.reduce_mean(
+            fading[..., tf.newaxis, tf.newaxis] * link_gain, axis=1)
+        alpha = self.alpha + tf.cast(self.diag_loading * gain, self.cdtype)
+        return alpha[..., tf.newaxis, tf.newaxis]
+
+    def _precoder_from_gram(self, gram, h_pc, amplitude, alpha):
+        """ RZF precoder of the channel D H from the Gram matrix of H """
+        # [batch_size, num_tx, 1, 1, num_streams_per_tx]
+        d = tf.cast(amplitude[:, :, tf.newaxis, tf.newaxis, :], self.cdtype)
+        # D H H^H D + alpha I
+        # [batch_size, num_tx, num_ofdm_sym, fft_size, num_streams_per_tx,
+        #  num_streams_per_tx]
+        a = gram * d[..., :, tf.newaxis] * d[..., tf.newaxis, :]
+        a = a + alpha * tf.eye(a.shape[-1], dtype=self.cdtype)
+        l = tf.linalg.cholesky(a)
+        # [batch_size, num_tx, num_ofdm_sym, fft_size, num_tx_ant,
+        #  num_streams_per_tx]
+        g = tf.linalg.adjoint(
+            tf.linalg.cholesky_solve(l, h_pc * d[..., tf.newaxis]))
+
+        # Normalize each column to unit power
+        norm = tf.sqrt(tf.reduce_sum(tf.abs(g)**2, axis=-2, keepdims=True))
+        return tf.math.divide_no_nan(g, tf.cast(norm, g.dtype))
+
+    def init_state(self, h_freq, fading):
+        """ Compute Gram matrix and precoder of a new channel realization
+        - h_freq: [batch_size, num_rx, num_rx_ant, num_tx, num_tx_ant,
+                   num_ofdm_sym, num_subcarriers], channel without fading
+        - fading: [batch_size, num_rx, num_tx]
+        """
+        # [batch_size, num_tx, num_ofdm_sym, fft_size, num_streams_per_tx,
+        #  num_tx_ant]
+        h_pc = self.get_desired_channels(tf.cast(h_freq, self.cdtype))
+        gram = tf.matmul(h_pc, h_pc, adjoint_b=True)
+        amplitude = self._desired_fading_amplitude(fading, h_freq.shape[2])
+        state = {'h_pc': h_pc,
+                 'gram': gram,
+                 'amplitude': amplitude}
+        if self.diag_loading != 0:
+            # Average gain of the rows of each link, as in rzf_regularizer
+            # [batch_size, num_rx, num_tx, num_ofdm_sym, num_subcarriers]
+            state['link_gain'] = tf.reduce_mean(
+                tf.abs(h_freq)**2, axis=[2, 4]) * h_freq.shape[4]
+        state['precoder'] = self._precoder_from_gram(
+            gram, h_pc, amplitude,
+            self._regularizer(state.get('link_gain'), fading))
+        return state
+
+    def update_state(self, state, get_h_freq, fading, new_block):
+        """ Update the cached precoder for the current slot
+        - get_h_freq: callable returning the channel without fading. It is
+          only evaluated at the beginning of a coherence block
+        - new_block: whether a new channel realization starts in this slot
+        """
+        amplitude = self._desired_fading_amplitude(fading,
+                                                   state['h_pc'].shape[-2] //
+                                                   self._precoding_ind.shape[-1])
+        # Relative drift of the fading amplitudes of each transmitter
+        # [batch_size, num_tx]
+        drift = tf.reduce_max(tf.abs(
+            tf.math.divide_no_nan(amplitude, state['amplitude']) - 1),
+            axis=-1)
+        update = drift > self.tolerance
+
+        def full_update():
+            return self.init_state(get_h_freq(), fading)
+
+        def diagonal_update():
+            # Only the transmitters whose amplitudes drifted beyond the
+            # tolerance take the new precoder
+            batch_size, num_tx = drift.shape
+            num_updates = math.ceil(self.max_update_ratio * batch_size *
+                                    num_tx)
+            alpha = self._regularizer(state.get('link_gain'), fading)
+            if num_updates == batch_size * num_tx:
+                precoder = self._precoder_from_gram(state['gram'],
+                                                    state['h_pc'],
+                                                    amplitude,
+                                                    alpha)
+                new_state = dict(state)
+                new_state['amplitude'] = tf.where(update[..., tf.newaxis],
+                                                  amplitude,
+                                                  state['amplitude'])
+                new_state['precoder'] = tf.where(
+                    update[..., tf.newaxis, tf.newaxis, tf.newaxis,
+                           tf.newaxis],
+                    precoder, state['precoder'])
+                return new_state
+
+            # Gather the transmitters with the largest drift, flattened across
+            # the batch
+            # [num_updates]
+            _, ind = tf.math.top_k(
+                tf.reshape(tf.where(update, drift, -tf.ones_like(drift)),
+                           [-1]),
+                k=num_updates)
+            selected = tf.gather(tf.reshape(update, [-1]), ind)
+
+            def gather(value):
+                # [1, num_updates, ...]
+                value = tf.reshape(value, [batch_size * num_tx] +
+                                   list(value.shape[2:]))
+                return tf.gather(value, ind)[tf.newaxis]
+
+            if self.diag_loading != 0:
+                alpha = gather(tf.broadcast_to(
+                    alpha, [batch_size, num_tx] + list(alpha.shape[2:])))
+            precoder = self._precoder_from_gram(gather(state['gram']),
+                                                gather(state['h_pc']),
+                                                gather(amplitude),
+                                                alpha)[0]
+            amplitude_selected = gather(amplitude)[0]
+
+            def scatter(old, new):
+                # Selected transmitters which did not drift, if fewer than
+                # num_updates did, keep their value
+                flat = tf.reshape(old, [batch_size * num_tx] +
+                                  list(old.shape[2:]))
+                new = tf.where(
+                    tf.reshape(selected, [-1] + [1] * (len(new.shape) - 1)),
+                    new, tf.gather(flat, ind))
+                flat = tf.tensor_scatter_nd_update(flat, ind[:, tf.newaxis],
+                                                   new)
+                return tf.reshape(flat, old.shape)
+
+            new_state = dict(state)
+            new_state['amplitude'] = scatter(state['amplitude'],
+                                             amplitude_selected)
+            new_state['precoder'] = scatter(state['precoder'], precoder)
+            return new_state
+
+        def reuse():
+            return state
+
+        return tf.cond(
+            new_block,
+            full_update,
+            lambda: tf.cond(tf.reduce_any(update), diagonal_update, reuse))
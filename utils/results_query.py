@@ -0,0 +1,346 @@
+# utils/results_query.py
+
+import json
+import numpy as np
+
+from utils.results_utils import TRACE_KEYS
+
+# Metrics whose histograms are binned in dB, and their bin edges [dB]
+DB_HIST_EDGES = {'sinr_eff': np.arange(-20., 50.5, .5),
+                 'pathloss_serving_cell': np.arange(40., 201., 1.),
+                 'tx_power': np.arange(-60., 61., 1.)}
+
+# Number of linear histogram bins of the other metrics
+NUM_HIST_BINS = 64
+
+# MCS indices counted in the MCS/HARQ table
+NUM_MCS = 32
+
+# Aggregates stored per metric
+AGGREGATE_STATS = ['sum', 'count', 'min', 'max', 'hist', 'underflow',
+                   'overflow']
+
+
+class ResultsStore:
+    """ Indexed, time-bucketed aggregates of cleaned result histories.
+
+    Each history added to the store (one per drop) is reduced at write time
+    to buckets of bucket_slots slots. Per bucket, the store holds:
+    - per user and metric: sum, count, min and max of the valid samples
+    - per cell and metric: a histogram of the samples, and the number of
+      samples below and above the histogram bins
+    - per cell: the number of transmissions and of ACKs per MCS index
+    Users are indexed by drop, cell and position in the cell. Queries select
+    drops, cells and a slot range, and are answered from the aggregates.
+    Slot ranges are extended to the boundaries of the buckets they overlap.
+    """
+
+    def __init__(self, bucket_slots=100, metrics=None):
+        self.bucket_slots = int(bucket_slots)
+        self.metrics = list(TRACE_KEYS) if metrics is None else list(metrics)
+        self.hist_edges = {}
+        self.drops = []
+
+    def _edges(self, metric, values):
+        """ Histogram bin edges of a metric, fixed on first use so that
+        drops can be merged """
+        if metric not in self.hist_edges:
+            if metric in DB_HIST_EDGES:
+                self.hist_edges[metric] = DB_HIST_EDGES[metric]
+            else:
+                finite = values[np.isfinite(values)]
+                vmin = float(finite.min()) if finite.size else 0.
+                vmax = float(finite.max()) if finite.size else 1.
+                # Headroom for later drops
+                vmax = vmin + 1.5 * max(vmax - vmin, 1e-9)
+                self.hist_edges[metric] = np.linspace(vmin, vmax,
+                                                      NUM_HIST_BINS + 1)
+        return self.hist_edges[metric]
+
+    def add(self, hist, drop=None):
+        """ Add a cleaned history (see clean_hist) of one drop. Returns the
+        drop index """
+        if drop is None:
+            drop = len(self.drops)
+        num_slots, num_bs, num_ut_per_sector = hist['harq'].shape
+        num_buckets = -(-num_slots // self.bucket_slots)
+        # Pad to an integer number of buckets with masked samples
+        pad = num_buckets * self.bucket_slots - num_slots
+
+        def bucketize(values):
+            values = np.asarray(values, np.float64)
+            values = np.concatenate(
+                [values, np.full((pad,) + values.shape[1:], np.nan)])
+            # [num_buckets, bucket_slots, num_bs, num_ut_per_sector]
+            return values.reshape((num_buckets, self.bucket_slots) +
+                                  values.shape[1:])
+
+        aggregates = {}
+        for metric in self.metrics:
+            values = bucketize(hist[metric])
+            valid = np.isfinite(values)
+            # [num_buckets, num_bs, num_ut_per_sector]
+            count = valid.sum(axis=1)
+            aggregates[metric] = {
+                'sum': np.where(valid, values, 0.).sum(axis=1),
+                'count': count,
+                'min': np.where(valid, values, np.inf).min(axis=1),
+                'max': np.where(valid, values, -np.inf).max(axis=1)}
+
+            # Histogram per bucket and cell
+            if metric in DB_HIST_EDGES:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    values = 10 * np.log10(values)
+            edges = self._edges(metric, values)
+            valid = np.isfinite(values)
+            with np.errstate(invalid='ignore'):
+                underflow = valid & (values < edges[0])
+                overflow = valid & (values > edges[-1])
+            # The last bin includes its upper edge
+            bins = np.minimum(
+                np.searchsorted(edges, values, side='right') - 1,
+                len(edges) - 2)
+            in_range = valid & ~underflow & ~overflow
+            # [num_buckets, num_bs, num_bins]
+            counts = np.zeros((num_buckets, num_bs, len(edges) - 1), np.int64)
+            bucket_idx, _, cell_idx, _ = np.nonzero(in_range)
+            np.add.at(counts, (bucket_idx, cell_idx, bins[in_range]), 1)
+            aggregates[metric]['hist'] = counts
+            # [num_buckets, num_bs]
+            aggregates[metric]['underflow'] = underflow.sum(axis=(1, 3))
+            aggregates[metric]['overflow'] = overflow.sum(axis=(1, 3))
+
+        # Transmissions and ACKs per MCS index
+        # [num_buckets, num_bs, NUM_MCS]
+        mcs = bucketize(hist['mcs_index'])
+        harq = bucketize(hist['harq'])
+        tx = np.isfinite(harq) & np.isfinite(mcs)
+        bucket_idx, _, cell_idx, _ = np.nonzero(tx)
+        mcs_idx = np.clip(mcs[tx].astype(int), 0, NUM_MCS - 1)
+        num_tx = np.zeros((num_buckets, num_bs, NUM_MCS), np.int64)
+        num_ack = np.zeros((num_buckets, num_bs, NUM_MCS), np.int64)
+        np.add.at(num_tx, (bucket_idx, cell_idx, mcs_idx), 1)
+        np.add.at(num_ack, (bucket_idx, cell_idx, mcs_idx),
+                  (harq[tx] == 1).astype(np.int64))
+
+        self.drops.append({'drop': drop,
+                           'num_slots': num_slots,
+                           'num_bs': num_bs,
+                           'num_ut_per_sector': num_ut_per_sector,
+                           'aggregates': aggregates,
+                           'num_tx': num_tx,
+                           'num_ack': num_ack})
+        return drop
+
+    def extend(self, other):
+        """ Add the drops of another store, e.g., of another run, with the
+        same bucket length and histogram bins. Drop identifiers must differ """
+        assert other.bucket_slots == self.bucket_slots, \
+            "Stores must have the same bucket length"
+        for metric, edges in other.hist_edges.items():
+            if metric in self.hist_edges:
+                assert np.array_equal(edges, self.hist_edges[metric]), \
+                    f"Histogram bins of {metric} differ"
+            else:
+                self.hist_edges[metric] = edges
+        ids = {entry['drop'] for entry in self.drops}
+        assert not ids & {entry['drop'] for entry in other.drops}, \
+            "Drop identifiers must differ"
+        self.drops.extend(other.drops)
+
+    # ------- #
+    # Indexes #
+    # ------- #
+    def user_index(self, drops=None, cells=None):
+        """ Drop, cell and position in the cell of the selected users, as a
+        [num_users, 3] array, in the order of per-user query results """
+        index = []
+        for entry in self._select_drops(drops):
+            for cell in self._select_cells(entry, cells):
+                for ut in range(entry['num_ut_per_sector']):
+                    index.append((entry['drop'], cell, ut))
+        return np.array(index, dtype=np.int64).reshape(-1, 3)
+
+    def _select_drops(self, drops):
+        if drops is None:
+            return self.drops
+        drops = set(np.atleast_1d(drops).tolist())
+        return [entry for entry in self.drops if entry['drop'] in drops]
+
+    def _select_cells(self, entry, cells):
+        if cells is None:
+            return np.arange(entry['num_bs'])
+        cells = np.atleast_1d(cells)
+        return cells[cells < entry['num_bs']]
+
+    def _select_buckets(self, entry, slots):
+        num_buckets = -(-entry['num_slots'] // self.bucket_slots)
+        if slots is None:
+            return slice(0, num_buckets)
+        first, last = slots
+        return slice(max(first // self.bucket_slots, 0),
+                     min(-(-last // self.bucket_slots), num_buckets))
+
+    # ------- #
+    # Queries #
+    # ------- #
+    def _reduce(self, metric, stat, drops, cells, slots, per):
+        """ Reduce an aggregate over buckets, per user or per cell, and
+        concatenate the drops """
+        reduce_fn = {'sum': np.sum, 'count': np.sum,
+                     'min': np.min, 'max': np.max}[stat]
+        # Value of an empty selection of buckets
+        empty = {'sum': 0., 'count': 0, 'min': np.inf, 'max': -np.inf}[stat]
+        out = []
+        for entry in self._select_drops(drops):
+            # [num_buckets, num_bs, num_ut_per_sector]
+            values = entry['aggregates'][metric][stat]
+            values = values[self._select_buckets(entry, slots)]
+            values = values[:, self._select_cells(entry, cells)]
+            if values.shape[0] == 0:
+                values = np.full((1,) + values.shape[1:], empty)
+            values = reduce_fn(values, axis=0)
+            out.append(values.reshape(-1) if per == 'user'
+                       else reduce_fn(values, axis=-1))
+        return np.concatenate(out) if out else np.zeros(0)
+
+    def user_mean(self, metric, drops=None, cells=None, slots=None):
+        """ Time average of a metric per selected user, NaN for users without
+        samples. Users are ordered as in user_index """
+        total = self._reduce(metric, 'sum', drops, cells, slots, 'user')
+        count = self._reduce(metric, 'count', drops, cells, slots, 'user')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+
+    def cell_mean(self, metric, drops=None, cells=None, slots=None):
+        """ Average of a metric over the samples of each selected cell """
+        total = self._reduce(metric, 'sum', drops, cells, slots, 'cell')
+        count = self._reduce(metric, 'count', drops, cells, slots, 'cell')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+
+    def user_percentile(self, metric, q, drops=None, cells=None, slots=None):
+        """ q-th percentile across selected users of the per-user time
+        average, e.g., the 5th-percentile user throughput with
+        metric='num_decoded_bits' and q=5 """
+        return np.nanpercentile(
+            self.user_mean(metric, drops, cells, slots), q)
+
+    def extrema(self, metric, drops=None, cells=None, slots=None):
+        """ Minimum and maximum of a metric over the selection """
+        return (np.min(self._reduce(metric, 'min', drops, cells, slots,
+                                    'cell')),
+                np.max(self._reduce(metric, 'max', drops, cells, slots,
+                                    'cell')))
+
+    def _sum_hist(self, metric, stat, drops, cells, slots):
+        """ Sum of a histogram aggregate over buckets and cells """
+        total = 0
+        for entry in self._select_drops(drops):
+            values = entry['aggregates'][metric][stat]
+            values = values[self._select_buckets(entry, slots)]
+            total = total + values[:, self._select_cells(entry, cells)].sum(
+                axis=(0, 1))
+        return total
+
+    def histogram(self, metric, drops=None, cells=None, slots=None):
+        """ Sample counts and bin edges of a metric over the selection. Edges
+        are in dB for the metrics of DB_HIST_EDGES. Samples outside the bins
+        are not counted, see out_of_range """
+        counts = np.zeros(len(self.hist_edges[metric]) - 1, np.int64)
+        counts += self._sum_hist(metric, 'hist', drops, cells, slots)
+        return counts, self.hist_edges[metric]
+
+    def out_of_range(self, metric, drops=None, cells=None, slots=None):
+        """ Number of samples of a metric below and above the histogram bins
+        over the selection """
+        return (int(self._sum_hist(metric, 'underflow', drops, cells, slots)),
+                int(self._sum_hist(metric, 'overflow', drops, cells, slots)))
+
+    def percentile(self, metric, q, drops=None, cells=None, slots=None):
+        """ q-th percentile of the samples of a metric over the selection,
+        interpolated within histogram bins. NaN if the percentile falls among
+        the samples below or above the bins """
+        counts, edges = self.histogram(metric, drops, cells, slots)
+        underflow, overflow = self.out_of_range(metric, drops, cells, slots)
+        total = counts.sum() + underflow + overflow
+        if total == 0:
+            return np.nan
+        cdf = (underflow + np.concatenate([[0], np.cumsum(counts)])) / total
+        if not cdf[0] <= q / 100. <= cdf[-1]:
+            return np.nan
+        return float(np.interp(q / 100., cdf, edges))
+
+    def tbler_by_mcs(self, drops=None, cells=None, slots=None):
+        """ TBLER and number of transmissions per MCS index """
+        num_tx = np.zeros(NUM_MCS, np.int64)
+        num_ack = np.zeros(NUM_MCS, np.int64)
+        for entry in self._select_drops(drops):
+            buckets = self._select_buckets(entry, slots)
+            cells_sel = self._select_cells(entry, cells)
+            num_tx += entry['num_tx'][buckets][:, cells_sel].sum(axis=(0, 1))
+            num_ack += entry['num_ack'][buckets][:, cells_sel].sum(
+                axis=(0, 1))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tbler = np.where(num_tx > 0, 1. - num_ack / num_tx, np.nan)
+        return tbler, num_tx
+
+    # ----------- #
+    # Persistence #
+    # ----------- #
+    def save(self, filename):
+        """ Store the aggregates in a compressed .npz file """
+        arrays = {'meta': np.array(json.dumps({
+            'bucket_slots': self.bucket_slots,
+            'metrics': self.metrics,
+            'drops': [{key: int(entry[key]) for key in
+                       ['drop', 'num_slots', 'num_bs', 'num_ut_per_sector']}
+                      for entry in self.drops]}))}
+        for metric, edges in self.hist_edges.items():
+            arrays[f'edges/{metric}'] = edges
+        for ii, entry in enumerate(self.drops):
+            arrays[f'{ii}/num_tx'] = entry['num_tx']
+            arrays[f'{ii}/num_ack'] = entry['num_ack']
+            for metric, stats in entry['aggregates'].items():
+                for stat, value in stats.items():
+                    arrays[f'{ii}/{metric}/{stat}'] = value
+        np.savez_compressed(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        """ Load aggregates stored with save """
+        with np.load(filename) as data:
+            arrays = {key: data[key] for key in data.files}
+        meta = json.loads(str(arrays['meta']))
+        store = cls(meta['bucket_slots'], meta['metrics'])
+        store.hist_edges = {key[len('edges/'):]: value
+                            for key, value in arrays.items()
+                            if key.startswith('edges/')}
+        for ii, entry in enumerate(meta['drops']):
+            entry['num_tx'] = arrays[f'{ii}/num_tx']
+            entry['num_ack'] = arrays[f'{ii}/num_ack']
+            entry['aggregates'] = {
+                metric: {stat: arrays[f'{ii}/{metric}/{stat}']
+                         for stat in AGGREGATE_STATS}
+                for metric in store.metrics}
+            store.drops.append(entry)
+        return store
+
+
+def compute_results_avg_from_store(store, drops=None, slots=None):
+    """ Per-user averages of compute_results_avg, from the aggregates of a
+    store rather than from the full traces """
+    def mean(metric):
+        return store.user_mean(metric, drops=drops, slots=slots)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'TBLER': 1 - mean('harq'),
+            'MCS': mean('mcs_index'),
+            '# decoded bits / slot': mean('num_decoded_bits'),
+            'Effective SINR [dB]': 10*np.log10(mean('sinr_eff')),
+            'OLLA offset': mean('olla_offset'),
+            'TX power [dBm]': 10*np.log10(mean('tx_power')) + 30,
+            'Pathloss [dB]': 10*np.log10(mean('pathloss_serving_cell')),
+            '# allocated REs / slot': mean('num_allocated_re'),
+            'PF metric': mean('pf_metric')
+        }
@@ -3,24 +3,75 @@
 import tensorflow as tf
 import numpy as np
 
+from utils.traffic_utils import TRAFFIC_KEYS
+
+
+# Per-slot metrics stored in the result history
+TRACE_KEYS = ['pathloss_serving_cell',
+              'tx_power', 'olla_offset',
+              'sinr_eff', 'pf_metric',
+              'num_decoded_bits', 'mcs_index',
+              'harq', 'num_allocated_re']
+
+# Storage type of each metric in the result history
+HIST_DTYPES = {'pathloss_serving_cell': tf.float32,
+               'tx_power': tf.float32,
+               'olla_offset': tf.float32,
+               'sinr_eff': tf.float32,
+               'pf_metric': tf.float32,
+               'num_decoded_bits': tf.int32,
+               'mcs_index': tf.int8,
+               'harq': tf.int8,
+               'num_allocated_re': tf.int16}
+
+# Metrics stored as float16 if compact_float is True: in dB for the positive
+# linear ones, to preserve their dynamic range, as is for the OLLA offset,
+# which is already in dB
+DB_KEYS = ['pathloss_serving_cell', 'tx_power', 'sinr_eff', 'pf_metric']
+COMPACT_FLOAT_KEYS = DB_KEYS + ['olla_offset']
+
+# Code of MCS index and HARQ feedback when the user is not scheduled
+NOT_SCHEDULED = -1
+
+
+def get_hist_dtypes(max_num_re=None, compact_float=False):
+    """ Storage type of each metric. The number of allocated REs is stored
+    in int32 if max_num_re does not fit in int16 """
+    dtypes = dict(HIST_DTYPES)
+    if max_num_re is not None and max_num_re > tf.int16.max:
+        dtypes['num_allocated_re'] = tf.int32
+    if compact_float:
+        for key in COMPACT_FLOAT_KEYS:
+            dtypes[key] = tf.float16
+    return dtypes
+
+
+def _to_storage(key, value, dtype):
+    """ Cast a metric to its storage type, in dB if compact """
+    if dtype == tf.float16 and key in DB_KEYS:
+        value = 10. * tf.math.log(tf.cast(value, tf.float32)) / \
+            tf.math.log(10.)
+    return tf.cast(value, dtype)
+
 
 def init_result_history(batch_size,
                         num_slots,
                         num_bs,
-                        num_ut_per_sector):
-    """ Initialize dictionary containing history of results """
+                        num_ut_per_sector,
+                        max_num_re=None,
+                        compact_float=False):
+    """ Initialize dictionary containing history of results.
+    Besides the metrics, hist['valid'] flags the users whose results were
+    recorded in each slot """
+    dtypes = get_hist_dtypes(max_num_re, compact_float)
     hist = {}
-    for key in ['pathloss_serving_cell',
-                'tx_power', 'olla_offset',
-                'sinr_eff', 'pf_metric',
-                'num_decoded_bits', 'mcs_index',
-                'harq', 'num_allocated_re']:
+    for key in TRACE_KEYS + ['valid']:
         hist[key] = tf.TensorArray(
             size=num_slots,
             element_shape=[batch_size,
                            num_bs,
                            num_ut_per_sector],
-            dtype=tf.float32)
+            dtype=dtypes.get(key, tf.bool))
     return hist
 
 
@@ -36,47 +87,168 @@ def record_results(hist,
                    olla_offset=None,
                    sinr_eff=None,
                    pf_metric=None,
+                   valid=None,
                    shape=None):
-    """ Record results of last slot """
+    """ Record results of last slot. If the slot failed, zeros are stored
+    and the users are flagged as not valid. valid flags the users whose
+    results are valid, e.g., outside of sectors where the SINR computation
+    failed """
     if not sim_failed:
+        # The MCS index of users that are not scheduled is not meaningful
+        mcs_index = tf.where(harq_feedback == NOT_SCHEDULED,
+                             tf.cast(NOT_SCHEDULED, mcs_index.dtype),
+                             mcs_index)
         for key, value in zip(['pathloss_serving_cell', 'olla_offset', 'sinr_eff',
                                'num_allocated_re', 'tx_power', 'num_decoded_bits',
                                'mcs_index', 'harq'],
                               [pathloss_serving_cell, olla_offset, sinr_eff,
                                num_allocated_re, tx_power_per_ut, num_decoded_bits,
                                mcs_index, harq_feedback]):
-            hist[key] = hist[key].write(slot, tf.cast(value, tf.float32))
+            hist[key] = hist[key].write(
+                slot, _to_storage(key, value, hist[key].dtype))
         # Average PF metric across resources
         hist['pf_metric'] = hist['pf_metric'].write(
-            slot, tf.reduce_mean(pf_metric, axis=[-2, -3]))
+            slot, _to_storage('pf_metric',
+                              tf.reduce_mean(pf_metric, axis=[-2, -3]),
+                              hist['pf_metric'].dtype))
+        if valid is None:
+            valid = tf.ones(harq_feedback.shape, tf.bool)
+        hist['valid'] = hist['valid'].write(slot, valid)
     else:
-        nan_tensor = tf.cast(tf.fill(shape,
-                                     float('nan')), dtype=tf.float32)
-        for key in hist:
-            hist[key] = hist[key].write(slot, nan_tensor)
+        for key in TRACE_KEYS:
+            hist[key] = hist[key].write(slot, tf.zeros(shape, hist[key].dtype))
+        hist['valid'] = hist['valid'].write(slot, tf.zeros(shape, tf.bool))
     return hist
 
 
-def clean_hist(hist, batch=0):
-    """ Extract batch, convert to Numpy, and mask metrics when user is not
-    scheduled """
+def clean_hist(hist, batch=0, warmup_slots=0):
+    """ Extract batch, convert to Numpy, drop the warm-up slots and mask
+    metrics when user is not scheduled or results are not valid. Metrics are
+    returned as float arrays, with NaN for masked entries """
     # Extract batch and convert to Numpy
     for key in hist:
-        try:
+        if hasattr(hist[key], 'numpy'):
+            hist[key] = hist[key].numpy()
+        if key in TRACE_KEYS + ['valid']:
             # [num_slots, num_bs, num_ut_per_sector]
-            hist[key] = hist[key].numpy()[:, batch, :, :]
-        except:
-            pass
+            hist[key] = hist[key][:, batch, :, :]
+        elif key in TRAFFIC_KEYS:
+            # [num_bs, num_ut_per_sector]
+            hist[key] = hist[key][batch]
+
+    # Discard slots that were not simulated because metrics had converged
+    if 'num_slots_simulated' in hist:
+        num_slots = int(hist['num_slots_simulated'])
+        for key in TRACE_KEYS + ['valid']:
+            hist[key] = hist[key][:num_slots]
+
+    # Discard the transient at the beginning of the simulation
+    for key in TRACE_KEYS + ['valid']:
+        hist[key] = hist[key][warmup_slots:]
+
+    # Convert compact storage types back to float
+    for key in TRACE_KEYS:
+        if hist[key].dtype == np.float16 and key in DB_KEYS:
+            hist[key] = 10**(hist[key].astype(np.float32) / 10)
+        else:
+            hist[key] = hist[key].astype(np.float32)
+
+    # Mask results that were not recorded
+    valid = hist.pop('valid')
+    for key in TRACE_KEYS:
+        hist[key] = np.where(valid, hist[key], np.nan)
 
     # Mask metrics when user is not scheduled
     hist['mcs_index'] = np.where(
-        hist['harq'] == -1, np.nan, hist['mcs_index'])
+        hist['harq'] == NOT_SCHEDULED, np.nan, hist['mcs_index'])
     hist['sinr_eff'] = np.where(
-        hist['harq'] == -1, np.nan, hist['sinr_eff'])
+        hist['harq'] == NOT_SCHEDULED, np.nan, hist['sinr_eff'])
     hist['tx_power'] = np.where(
-        hist['harq'] == -1, np.nan, hist['tx_power'])
+        hist['harq'] == NOT_SCHEDULED, np.nan, hist['tx_power'])
     hist['num_allocated_re'] = np.where(
-        hist['harq'] == -1, 0, hist['num_allocated_re'])
+        hist['harq'] == NOT_SCHEDULED, 0, hist['num_allocated_re'])
     hist['harq'] = np.where(
-        hist['harq'] == -1, np.nan, hist['harq'])
+        hist['harq'] == NOT_SCHEDULED, np.nan, hist['harq'])
     return hist
+
+
+def concat_hists(hists):
+    """ Concatenate along the slot axis the histories of consecutive runs,
+    e.g., the chunks of a long simulation. Run statistics, such as the
+    convergence intervals, are taken from the last run, which accumulates
+    them over the warm-started chunks """
+    merged = {key: [] for key in TRACE_KEYS + ['valid']}
+    num_slots = 0
+    for hist in hists:
+        if 'num_slots_simulated' in hist:
+            num_slots_run = int(hist['num_slots_simulated'])
+        else:
+            num_slots_run = hist['harq'].shape[0]
+        for key in merged:
+            merged[key].append(np.asarray(hist[key])[:num_slots_run])
+        num_slots += num_slots_run
+    for key in merged:
+        merged[key] = np.concatenate(merged[key], axis=0)
+    for key, value in hists[-1].items():
+        if key not in merged:
+            merged[key] = np.asarray(value)
+    if 'num_slots_simulated' in merged:
+        merged['num_slots_simulated'] = num_slots
+    if 'num_sector_failures' in merged:
+        merged['num_sector_failures'] = sum(
+            int(hist['num_sector_failures']) for hist in hists)
+    for key in TRAFFIC_KEYS:
+        # Traffic counters are accumulated per run
+        if key in merged:
+            merged[key] = sum(np.asarray(hist[key]) for hist in hists)
+    return merged
+
+
+def compute_results_avg(hist):
+    """ Average the cleaned history across slots for each user. With
+    finite-buffer traffic, the mean packet latency and the ratio of dropped
+    packets of each user are added """
+    results_avg = {
+        'TBLER': (1 - np.nanmean(hist['harq'], axis=0)).flatten(),
+        'MCS': np.nanmean(hist['mcs_index'], axis=0).flatten(),
+        '# decoded bits / slot': np.nanmean(hist['num_decoded_bits'], axis=0).flatten(),
+        'Effective SINR [dB]': 10*np.log10(np.nanmean(hist['sinr_eff'], axis=0).flatten()),
+        'OLLA offset': np.nanmean(hist['olla_offset'], axis=0).flatten(),
+        'TX power [dBm]': 10*np.log10(np.nanmean(hist['tx_power'], axis=0).flatten()) + 30,
+        'Pathloss [dB]': 10*np.log10(np.nanmean(hist['pathloss_serving_cell'], axis=0).flatten()),
+        '# allocated REs / slot': np.nanmean(hist['num_allocated_re'], axis=0).flatten(),
+        'PF metric': np.nanmean(hist['pf_metric'], axis=0).flatten()
+    }
+    if 'num_packets_done' in hist:
+        results_avg.update(compute_traffic_avg(hist))
+    return results_avg
+
+
+def compute_traffic_avg(hist):
+    """ Mean packet latency and ratio of dropped packets of each user, from
+    the traffic counters of a cleaned history. NaN for users without
+    completed or arrived packets """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        latency = 1e3 * np.asarray(hist['packet_latency_sum'], np.float64) / \
+            np.asarray(hist['num_packets_done'])
+        drop_ratio = np.asarray(hist['num_packets_dropped'], np.float64) / \
+            np.asarray(hist['num_packets_arrived'])
+    return {'Packet latency [ms]': latency.flatten(),
+            'Packet drop ratio': drop_ratio.flatten()}
+
+
+def aggregate_carrier_throughput(results_avg, policies, carrier_names,
+                                 slot_duration):
+    """ Per-user throughput [Mbps] of each policy on each carrier and
+    aggregated across carriers, from the per-user averages of each branch.
+    policies are the branches of SystemLevelSimulator, with the policy name
+    and carrier index of each """
+    throughput = {}
+    for branch in policies:
+        # [num_ut]
+        per_carrier = results_avg[branch['name']]['# decoded bits / slot'] / \
+            slot_duration / 1e6
+        policy = throughput.setdefault(branch['policy'], {})
+        policy[carrier_names[branch['carrier']]] = per_carrier
+        policy['aggregate'] = policy.get('aggregate', 0) + per_carrier
+    return throughput
@@ -0,0 +1,50 @@
+# utils/rng_utils.py
+
+import tensorflow as tf
+from sionna.phy import config
+
+# Independent random streams, one per simulation stage
+RNG_STAGES = {'topology': 0,
+              'fading_init': 1,
+              'channel': 2,
+              'fading': 3,
+              'lsp': 4,
+              'phy': 5,
+              'traffic': 6}
+
+
+class RNGStreams:
+    """ Counter-based random streams derived from (seed, drop, stage,
+    counters), e.g., the slot or coherence block index.
+
+    Each stream is identified by a stateless seed obtained by folding the
+    stage and counters into (seed, drop), so that the random numbers of any
+    slot of any drop do not depend on what was executed before. Stages using
+    TensorFlow stateless ops take the seed directly. Stages drawing from the
+    global generator internally, such as Sionna channel models and the PHY
+    abstraction, are run after positioning the global generator at the start
+    of their stream.
+    """
+
+    def __init__(self, seed, drop=0):
+        self.base_seed = tf.constant([seed, drop], tf.int64)
+
+    def seed(self, stage, *counters):
+        """ Stateless seed [2] of a stream """
+        seed = tf.random.experimental.stateless_fold_in(
+            self.base_seed, RNG_STAGES[stage])
+        for counter in counters:
+            seed = tf.random.experimental.stateless_fold_in(
+                seed, tf.cast(counter, tf.int64))
+        return seed
+
+    def reset_global(self, stage, *counters):
+        """ Position the global generator sionna.phy.config.tf_rng at the
+        start of a stream """
+        # Stateless seeds are int32, generator states int64
+        seed = tf.cast(self.seed(stage, *counters), tf.int64)
+        # The counter has one entry less than the generator state
+        counter_size = config.tf_rng.state.shape[0] - 1
+        counter = tf.concat([seed[1:], tf.zeros([counter_size - 1], tf.int64)],
+                            axis=0)
+        config.tf_rng.reset_from_key_counter(seed[0], counter)
@@ -1,7 +1,8 @@
 # utils/sinr_utils.py
 
 import tensorflow as tf
-from sionna.phy.utils import db_to_lin, log2, insert_dims
+from sionna.phy.utils import db_to_lin, log2, insert_dims, expand_to_rank
+from sionna.phy.mimo import rzf_precoding_matrix
 from sionna.phy.ofdm import RZFPrecodedChannel, EyePrecodedChannel, \
     LMMSEPostEqualizationSINR
 
@@ -14,11 +15,17 @@ def get_sinr(tx_power,
              num_bs,
              num_ut_per_sector,
              num_streams_per_ut,
-             resource_grid):
+             resource_grid,
+             precoder=None,
+             diag_loading=0.):
     """ Compute post-equalization SINR. It is assumed:
      - DL: Regularized zero-forcing precoding
      - UL: No precoding, only power allocation
     LMMSE equalizer is used in both DL and UL.
+    In the DL, a unit-norm precoder computed beforehand (e.g., by
+    RZFPrecoderCache) can be provided instead of recomputing it.
+    diag_loading adds a regularization relative to the channel gain to the
+    RZF precoder, see rzf_regularizer.
     """
     # tx_power: [batch_size, num_bs, num_tx_per_sector,
     #            num_streams_per_tx, num_ofdm_sym, num_subcarriers]
@@ -34,9 +41,17 @@ def get_sinr(tx_power,
         # Regularized zero-forcing precoding in the DL
         precoded_channel = RZFPrecodedChannel(resource_grid=resource_grid,
                                               stream_management=stream_management)
-        h_eff = precoded_channel(h_freq_fading,
-                                 tx_power=tx_power,
-                                 alpha=no)  # Regularizer
+        if precoder is None:
+            h_eff = precoded_channel(h_freq_fading,
+                                     tx_power=tx_power,
+                                     alpha=rzf_regularizer(  # Regularizer
+                                         h_freq_fading, no, diag_loading))
+        else:
+            # [batch_size, num_tx, num_ofdm_symbols, fft_size, num_tx_ant,
+            #  num_streams_per_tx]
+            g = precoded_channel.apply_tx_power(precoder, tx_power)
+            h_eff = precoded_channel.compute_effective_channel(h_freq_fading,
+                                                               g)
     else:
         # No precoding in the UL: just power allocation
         precoded_channel = EyePrecodedChannel(resource_grid=resource_grid,
@@ -65,6 +80,40 @@ def get_sinr(tx_power,
     return sinr
 
 
+def rzf_regularizer(h_freq, no, diag_loading=0.):
+    """ Regularization of the RZF precoder: the noise power, plus
+    diag_loading times the average channel gain of each transmitter. The
+    latter keeps the inverted matrix well conditioned when the noise power is
+    negligible with respect to the channel gains
+    - Input: [batch_size, num_rx, num_rx_ant, num_tx, num_tx_ant,
+              num_ofdm_sym, num_subcarriers]
+    - Output: [batch_size, num_tx, num_ofdm_sym, num_subcarriers]
+    """
+    if diag_loading == 0:
+        return no
+    # Average diagonal entry of H H^H
+    # [batch_size, num_tx, num_ofdm_sym, num_subcarriers]
+    gain = tf.reduce_mean(tf.abs(h_freq)**2, axis=[1, 2, 4]) * \
+        h_freq.shape[4]
+    return no + diag_loading * gain
+
+
+def sanitize_sinr(sinr):
+    """ Detect sectors where the SINR computation failed numerically, e.g.,
+    on a singular matrix, and zero their SINR
+    - Input: [batch_size, num_bs, num_ofdm_sym, num_subcarriers,
+              num_ut_per_sector, num_streams_per_ut]
+    - Output: SINR of same shape, failure mask [batch_size, num_bs]
+    """
+    invalid = tf.logical_or(tf.logical_not(tf.math.is_finite(sinr)),
+                            sinr < 0)
+    # [batch_size, num_bs]
+    sector_failed = tf.reduce_any(invalid, axis=[2, 3, 4, 5])
+    sinr = tf.where(insert_dims(sector_failed, 4, axis=-1),
+                    tf.zeros_like(sinr), sinr)
+    return sinr, sector_failed
+
+
 def estimate_achievable_rate(sinr_eff_db_last,
                              num_ofdm_sym,
                              num_subcarriers):
@@ -80,3 +129,143 @@ def estimate_achievable_rate(sinr_eff_db_last,
     rate_achievable_est = tf.tile(rate_achievable_est,
                                   [1, 1, num_ofdm_sym, num_subcarriers, 1])
     return rate_achievable_est
+
+
+def get_sinr_active_set(tx_power,
+                        is_scheduled,
+                        stream_management,
+                        stream_management_active,
+                        no,
+                        direction,
+                        h_freq_fading,
+                        num_bs,
+                        num_ut_per_sector,
+                        num_streams_per_ut,
+                        resource_grid,
+                        precoder=None,
+                        diag_loading=0.):
+    """ Compute post-equalization SINR for scheduled users only.
+    With SU-MIMO scheduling, at most one user per sector is active on each
+    resource element. The scheduled user of each sector is gathered per
+    (symbol, subcarrier), yielding a compact channel with one transmitter
+    and one receiver per sector. SINR is computed on it as in get_sinr, with
+    stream_management_active associating receiver and transmitter of each
+    sector, and scattered back to the scheduled users.
+    In the DL, the RZF precoder is computed as in get_sinr on the full
+    channel of each sector, with stream_management, or provided beforehand
+    (e.g., by RZFPrecoderCache). The precoding vectors of the scheduled
+    streams are then gathered, so that the SINR matches that of get_sinr.
+    """
+    # is_scheduled: [batch_size, num_bs, num_ofdm_sym, num_subcarriers,
+    #                num_ut_per_sector, num_streams_per_ut]
+    # Index of the scheduled user within each sector
+    # [batch_size, num_bs, num_ofdm_sym, num_subcarriers]
+    ut_is_scheduled = tf.reduce_any(is_scheduled, axis=-1)
+    scheduled_ut = tf.argmax(tf.cast(ut_is_scheduled, tf.int32), axis=-1,
+                             output_type=tf.int32)
+
+    # tx_power: [batch_size, num_bs, num_tx_per_sector,
+    #            num_streams_per_tx, num_ofdm_sym, num_subcarriers]
+    # Power of the scheduled user's streams
+    # [batch_size, num_bs, num_ofdm_sym, num_subcarriers, num_ut_per_sector,
+    #  num_streams_per_ut]
+    s = tx_power.shape
+    tx_power = tf.reshape(tx_power, [s[0], num_bs, num_ut_per_sector,
+                                     num_streams_per_ut] + s[4:])
+    tx_power = tf.transpose(tx_power, [0, 1, 4, 5, 2, 3])
+    # [batch_size, num_bs, num_ofdm_sym, num_subcarriers, num_streams_per_ut]
+    tx_power = tf.gather(tx_power, scheduled_ut, axis=4, batch_dims=4)
+    # [batch_size, num_bs, num_streams_per_ut, num_ofdm_sym, num_subcarriers]
+    tx_power = tf.transpose(tx_power, [0, 1, 4, 2, 3])
+
+    # h_freq_fading: [batch_size, num_rx, num_rx_ant, num_tx, num_tx_ant,
+    #                 num_ofdm_sym, num_subcarriers]
+    s = h_freq_fading.shape
+    if direction == 'downlink':
+        if precoder is None:
+            # RZF precoder of all co-sector users, as in get_sinr
+            precoded_channel = RZFPrecodedChannel(
+                resource_grid=resource_grid,
+                stream_management=stream_management)
+            # [batch_size, num_bs, num_ofdm_sym, num_subcarriers,
+            #  num_streams_per_tx, num_tx_ant]
+            h_pc = precoded_channel.get_desired_channels(h_freq_fading)
+            alpha = tf.cast(rzf_regularizer(h_freq_fading, no, diag_loading),
+                            h_pc.dtype.real_dtype)
+            alpha = tf.broadcast_to(expand_to_rank(alpha, 4, axis=-1),
+                                    h_pc.shape[:4])
+            # [batch_size, num_bs, num_ofdm_sym, num_subcarriers, num_tx_ant,
+            #  num_streams_per_tx]
+            precoder = rzf_precoding_matrix(h_pc, alpha)
+        # Precoding vectors of the scheduled user's streams
+        # [batch_size, num_bs, num_ofdm_sym, num_subcarriers,
+        #  num_ut_per_sector, num_tx_ant, num_streams_per_ut]
+        g = tf.reshape(precoder, precoder.shape[:5] + [num_ut_per_sector,
+                                                       num_streams_per_ut])
+        g = tf.transpose(g, [0, 1, 2, 3, 5, 4, 6])
+        # [batch_size, num_bs, num_ofdm_sym, num_subcarriers, num_tx_ant,
+        #  num_streams_per_ut]
+        g = tf.gather(g, scheduled_ut, axis=4, batch_dims=4)
+
+        # Gather the scheduled user along the receiver axis
+        # [batch_size, num_bs, num_ut_per_sector, num_rx_ant, num_tx,
+        #  num_tx_ant, num_ofdm_sym, num_subcarriers]
+        h = tf.reshape(h_freq_fading,
+                       [s[0], num_bs, num_ut_per_sector] + s[2:])
+        # [batch_size, num_bs, num_ofdm_sym, num_subcarriers,
+        #  num_ut_per_sector, num_rx_ant, num_tx, num_tx_ant]
+        h = tf.transpose(h, [0, 1, 6, 7, 2, 3, 4, 5])
+        # [batch_size, num_bs, num_ofdm_sym, num_subcarriers, num_rx_ant,
+        #  num_tx, num_tx_ant]
+        h = tf.gather(h, scheduled_ut, axis=4, batch_dims=4)
+        # [batch_size, num_bs, num_rx_ant, num_tx, num_tx_ant, num_ofdm_sym,
+        #  num_subcarriers]
+        h = tf.transpose(h, [0, 1, 4, 5, 6, 2, 3])
+
+        precoded_channel = RZFPrecodedChannel(
+            resource_grid=resource_grid,
+            stream_management=stream_management_active)
+        g = precoded_channel.apply_tx_power(g, tx_power)
+        h_eff = precoded_channel.compute_effective_channel(h, g)
+    else:
+        # Gather the scheduled user along the transmitter axis
+        # [batch_size, num_rx, num_rx_ant, num_bs, num_ut_per_sector,
+        #  num_tx_ant, num_ofdm_sym, num_subcarriers]
+        h = tf.reshape(h_freq_fading,
+                       s[:3] + [num_bs, num_ut_per_sector] + s[4:])
+        # [batch_size, num_bs, num_ofdm_sym, num_subcarriers,
+        #  num_ut_per_sector, num_rx, num_rx_ant, num_tx_ant]
+        h = tf.transpose(h, [0, 3, 6, 7, 4, 1, 2, 5])
+        # [batch_size, num_bs, num_ofdm_sym, num_subcarriers, num_rx,
+        #  num_rx_ant, num_tx_ant]
+        h = tf.gather(h, scheduled_ut, axis=4, batch_dims=4)
+        # [batch_size, num_rx, num_rx_ant, num_bs, num_tx_ant, num_ofdm_sym,
+        #  num_subcarriers]
+        h = tf.transpose(h, [0, 4, 5, 1, 6, 2, 3])
+
+        precoded_channel = EyePrecodedChannel(
+            resource_grid=resource_grid,
+            stream_management=stream_management_active)
+        h_eff = precoded_channel(h,
+                                 tx_power=tx_power)
+
+    # LMMSE equalizer
+    lmmse_posteq_sinr = LMMSEPostEqualizationSINR(
+        resource_grid=resource_grid,
+        stream_management=stream_management_active)
+    # Post-equalization SINR of the scheduled user of each sector
+    # [batch_size, num_ofdm_symbols, num_subcarriers, num_bs,
+    #  num_streams_per_ut]
+    sinr = lmmse_posteq_sinr(h_eff, no=no, interference_whitening=True)
+    # [batch_size, num_bs, num_ofdm_symbols, num_subcarriers,
+    #  num_streams_per_ut]
+    sinr = tf.transpose(sinr, [0, 3, 1, 2, 4])
+
+    # Scatter back to the scheduled users
+    # [batch_size, num_bs, num_ofdm_sym, num_subcarriers, num_ut_per_sector,
+    #  num_streams_per_ut]
+    sinr = insert_dims(sinr, 1, axis=-2) * insert_dims(
+        tf.one_hot(scheduled_ut, num_ut_per_sector, dtype=sinr.dtype),
+        1, axis=-1)
+    sinr = tf.where(is_scheduled, sinr, tf.zeros_like(sinr))
+    return sinr
@@ -0,0 +1,26 @@
+# utils/state_utils.py
+
+import numpy as np
+
+# Separator between policy name and state key in the stored file
+STATE_KEY_SEP = '::'
+
+
+def save_sim_state(filename, state):
+    """ Save a state returned by SystemLevelSimulator.export_state to a
+    NumPy .npz file """
+    arrays = {}
+    for name, policy_state in state.items():
+        for key, value in policy_state.items():
+            arrays[f'{name}{STATE_KEY_SEP}{key}'] = value
+    np.savez(filename, **arrays)
+
+
+def load_sim_state(filename):
+    """ Load a state saved by save_sim_state """
+    state = {}
+    with np.load(filename) as data:
+        for full_key in data.files:
+            name, key = full_key.rsplit(STATE_KEY_SEP, 1)
+            state.setdefault(name, {})[key] = data[full_key]
+    return state
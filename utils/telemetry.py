@@ -0,0 +1,183 @@
+# utils/telemetry.py
+
+import os
+import json
+import time
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.results_utils import NOT_SCHEDULED
+
+# Metrics exported in Prometheus format: name, help, per-policy
+PROMETHEUS_METRICS = [
+    ('slot', 'Slots simulated', False),
+    ('num_slots', 'Slots to simulate', False),
+    ('slots_per_sec', 'Simulated slots per second', False),
+    ('eta_seconds', 'Estimated time to completion [s]', False),
+    ('tbler', 'TBLER over the last reporting interval', True),
+    ('throughput_mbps',
+     'Average cell throughput over the last reporting interval [Mbps]', True),
+    ('telemetry_reporting_ratio',
+     'Fraction of the run time spent reporting', False)]
+
+
+def interval_metrics(hist, slot_duration):
+    """ TBLER and average cell throughput [Mbps] of the slots of a (chunk)
+    history, as returned by the simulator """
+    num_slots = int(hist['num_slots_simulated']) \
+        if 'num_slots_simulated' in hist else hist['harq'].shape[0]
+    harq = np.asarray(hist['harq'])[:num_slots]
+    valid = np.asarray(hist['valid'])[:num_slots]
+    num_bits = np.asarray(hist['num_decoded_bits'])[:num_slots]
+
+    # Transmissions of scheduled users with valid results
+    scheduled = valid & (harq != NOT_SCHEDULED)
+    num_tx = scheduled.sum()
+    tbler = 1. - (harq == 1)[scheduled].sum() / num_tx if num_tx > 0 \
+        else float('nan')
+    # [batch_size, num_bs, num_ut_per_sector]
+    batch_size, num_bs = harq.shape[1:3]
+    throughput = np.where(valid, num_bits, 0).sum(dtype=np.float64) / \
+        (max(num_slots, 1) * slot_duration * batch_size * num_bs) / 1e6
+    return {'num_slots': num_slots,
+            'tbler': float(tbler),
+            'throughput_mbps': float(throughput)}
+
+
+class Telemetry:
+    """ Progress and throughput reporting of a chunked run.
+
+    The XLA-compiled slot loop cannot call back to the host, hence metrics
+    are reported at chunk boundaries, after each chunk of the run. Each report
+    is appended to metrics_file as one JSON line, written to prometheus_file
+    in the Prometheus text format, and served on http://localhost:port/metrics
+    if port is not None. The time spent reporting is measured. The overhead
+    of the chunked run, which also includes the setup of each chunk and the
+    copy of its history to the host, is measured against the time of the
+    unchunked run, see overhead_ratio.
+    """
+
+    def __init__(self,
+                 metrics_file=None,
+                 prometheus_file=None,
+                 port=None,
+                 policy_names=None,
+                 slot_duration=1e-3):
+        self.metrics_file = metrics_file
+        self.prometheus_file = prometheus_file
+        self.policy_names = policy_names or ['default']
+        self.slot_duration = slot_duration
+        self.num_slots = None
+        self.start_time = None
+        self.end_time = None
+        self.reporting_time = 0.
+        self.last = {}
+        self._prometheus_text = ''
+        self._server = None
+        if port is not None:
+            self._start_server(port)
+
+    def _start_server(self, port):
+        telemetry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') != '/metrics':
+                    self.send_error(404)
+                    return
+                body = telemetry._prometheus_text.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+
+    def start(self, num_slots):
+        """ Start timing a run of num_slots slots, before its first chunk
+        is traced and compiled """
+        self.num_slots = num_slots
+        self.reporting_time = 0.
+        self.start_time = time.perf_counter()
+        self.end_time = None
+
+    def stop(self):
+        """ Stop timing the run, after its last chunk """
+        self.end_time = time.perf_counter()
+
+    def run_time(self):
+        """ Time since start, until stop if called [s] """
+        end_time = time.perf_counter() if self.end_time is None \
+            else self.end_time
+        return end_time - self.start_time
+
+    def report(self, slot, hists):
+        """ Report progress after slot slots, given the history of each
+        policy over the last interval """
+        start = time.perf_counter()
+        elapsed = start - self.start_time
+        slots_per_sec = slot / elapsed if elapsed > 0 else 0.
+        record = {
+            'time': time.time(),
+            'slot': slot,
+            'num_slots': self.num_slots,
+            'elapsed': elapsed,
+            'slots_per_sec': slots_per_sec,
+            'eta_seconds': (self.num_slots - slot) / slots_per_sec
+            if slots_per_sec > 0 else float('nan'),
+            'policies': {name: interval_metrics(hist, self.slot_duration)
+                         for name, hist in zip(self.policy_names, hists)}}
+        self.last = record
+
+        if self.metrics_file is not None:
+            with open(self.metrics_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+        self._prometheus_text = self._format_prometheus(record)
+        if self.prometheus_file is not None:
+            # Written atomically for scrapers reading the file
+            tmp_filename = f'{self.prometheus_file}.{os.getpid()}.tmp'
+            with open(tmp_filename, 'w', encoding='utf-8') as f:
+                f.write(self._prometheus_text)
+            os.replace(tmp_filename, self.prometheus_file)
+        self.reporting_time += time.perf_counter() - start
+        return record
+
+    def reporting_ratio(self):
+        """ Fraction of the run time spent reporting """
+        total = self.run_time()
+        return self.reporting_time / total if total > 0 else 0.
+
+    def overhead_ratio(self, reference_time):
+        """ Relative overhead of the run against reference_time, the time of
+        the same run without chunks and telemetry, both including setup,
+        tracing and compilation """
+        return self.run_time() / reference_time - 1.
+
+    def _format_prometheus(self, record):
+        values = dict(record, telemetry_reporting_ratio=self.reporting_ratio())
+        lines = []
+        for name, help_text, per_policy in PROMETHEUS_METRICS:
+            lines.append(f'# HELP sls_{name} {help_text}')
+            lines.append(f'# TYPE sls_{name} gauge')
+            if per_policy:
+                for policy, metrics in record['policies'].items():
+                    lines.append(f'sls_{name}{{policy="{policy}"}} '
+                                 f'{metrics[name]}')
+            else:
+                lines.append(f'sls_{name} {values[name]}')
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        """ Stop the metrics endpoint """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
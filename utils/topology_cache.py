@@ -0,0 +1,74 @@
+# utils/topology_cache.py
+
+import os
+import time
+import numpy as np
+
+from utils.cache_utils import get_cache_dir, hash_key
+
+
+class TopologyCache:
+    """ On-disk cache of topology drops.
+
+    Each entry is a compressed ``.npz`` file named after the hash of the
+    parameters that determine the drop. Loading an entry refreshes its
+    modification time, so that eviction removes the least recently used
+    entries first.
+    - max_size_mb: entries are evicted beyond this total size [MB]
+    - max_age_days: entries not used for longer are evicted
+    """
+
+    def __init__(self, cache_dir=None, max_size_mb=1024, max_age_days=30):
+        self.path = get_cache_dir('topology', cache_dir)
+        self.max_size_mb = max_size_mb
+        self.max_age_days = max_age_days
+
+    def _filename(self, params):
+        return os.path.join(self.path, f'{hash_key(params)}.npz')
+
+    def load(self, params):
+        """ Return the cached arrays as a dictionary, or None if missing """
+        filename = self._filename(params)
+        if not os.path.isfile(filename):
+            return None
+        with np.load(filename) as data:
+            arrays = {key: data[key] for key in data.files}
+        os.utime(filename)
+        return arrays
+
+    def save(self, params, arrays):
+        """ Store arrays atomically and evict old entries """
+        filename = self._filename(params)
+        tmp_filename = f'{filename}.{os.getpid()}.tmp.npz'
+        np.savez_compressed(tmp_filename, **arrays)
+        os.replace(tmp_filename, filename)
+        self.evict()
+
+    def evict(self):
+        """ Remove entries older than max_age_days, then the least recently
+        used ones until the cache fits in max_size_mb """
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.path):
+            filename = os.path.join(self.path, name)
+            if not name.endswith('.npz') or '.tmp.' in name:
+                continue
+            try:
+                stat = os.stat(filename)
+                if now - stat.st_mtime > self.max_age_days * 86400:
+                    os.remove(filename)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, filename))
+            except FileNotFoundError:
+                # Removed by a concurrent run
+                continue
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total_size <= self.max_size_mb * 1e6:
+                break
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            total_size -= size
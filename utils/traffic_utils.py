@@ -0,0 +1,176 @@
+# utils/traffic_utils.py
+
+import math
+import numpy as np
+import tensorflow as tf
+
+# Traffic models: Poisson arrivals of fixed-size files (FTP model 3 of 3GPP
+# TR 36.814) or of exponentially distributed packet sizes
+TRAFFIC_MODELS = ['ftp3', 'poisson']
+
+# Per-user queue carried in the loop state, as the HARQ/SINR feedback.
+# Each queue entry holds the packets arrived in one slot, in FIFO order.
+# Bits are float64, exact for the integer sizes of large files
+# [batch_size, num_bs, num_ut_per_sector, max_queue]
+QUEUE_KEYS = ['queue_bits', 'queue_arrival_slot', 'queue_num_packets']
+
+# Per-user traffic counters accumulated over a run, after the warm-up slots
+# [batch_size, num_bs, num_ut_per_sector]
+TRAFFIC_KEYS = ['num_packets_arrived', 'num_packets_dropped',
+                'num_packets_done', 'packet_latency_sum']
+
+
+def normalize_traffic(traffic):
+    """ Fill in default traffic settings. None stands for full buffer.
+    - model: 'ftp3' or 'poisson'
+    - arrival_rate: mean number of packets arriving per user and second
+    - packet_size: packet size [bits], mean size for 'poisson'
+    - max_queue: max. number of queue entries per user, one per slot with
+      arrivals. Packets arriving at a full queue are dropped
+    """
+    if traffic is None:
+        return None
+    traffic = dict(traffic)
+    traffic.setdefault('model', 'ftp3')
+    traffic.setdefault('arrival_rate', 1.)
+    traffic.setdefault('packet_size', 4e6)
+    traffic.setdefault('max_queue', 16)
+    assert traffic['model'] in TRAFFIC_MODELS
+    assert traffic['arrival_rate'] > 0
+    assert traffic['packet_size'] > 0
+    assert traffic['max_queue'] > 0
+    return traffic
+
+
+def init_queue(shape, max_queue):
+    """ Empty per-user queues """
+    shape = list(shape) + [max_queue]
+    return {'queue_bits': tf.zeros(shape, tf.float64),
+            'queue_arrival_slot': tf.zeros(shape, tf.int32),
+            'queue_num_packets': tf.zeros(shape, tf.int32)}
+
+
+def init_traffic_counters(shape, dtype=tf.float32):
+    """ Zero traffic counters """
+    return {'num_packets_arrived': tf.zeros(shape, tf.int32),
+            'num_packets_dropped': tf.zeros(shape, tf.int32),
+            'num_packets_done': tf.zeros(shape, tf.int32),
+            'packet_latency_sum': tf.zeros(shape, dtype)}
+
+
+def draw_arrivals(traffic, shape, slot_duration, seed, dtype=tf.float32):
+    """ Number of packets and bits arriving at each user within a slot,
+    drawn from the stateless seed [2]. Only uniform draws are used, which
+    XLA compiles. Bits are float64 """
+    seed_num, seed_size = tf.unstack(
+        tf.random.experimental.stateless_split(seed, num=2))
+    # Poisson number of arrivals per slot, by inversion of the CDF truncated
+    # where the tail is negligible
+    lam = traffic['arrival_rate'] * slot_duration
+    max_num = int(np.ceil(lam + 10 * np.sqrt(lam) + 10))
+    cdf = np.cumsum([np.exp(k * np.log(lam) - lam - math.lgamma(k + 1))
+                     for k in range(max_num)])
+    u = tf.random.stateless_uniform(shape, seed_num, dtype=dtype)
+    # [batch_size, num_bs, num_ut_per_sector]
+    num_packets = tf.reduce_sum(
+        tf.cast(u[..., tf.newaxis] > tf.constant(cdf, dtype), tf.int32),
+        axis=-1)
+    if traffic['model'] == 'ftp3':
+        size = tf.cast(num_packets, dtype)
+    else:
+        # Sum of num_packets unit-mean exponential sizes
+        # [batch_size, num_bs, num_ut_per_sector, max_num]
+        u = tf.random.stateless_uniform(list(shape) + [max_num], seed_size,
+                                        minval=1e-7, dtype=dtype)
+        arrived = tf.range(max_num) < num_packets[..., tf.newaxis]
+        size = tf.reduce_sum(tf.where(arrived, -tf.math.log(u),
+                                      tf.zeros_like(u)), axis=-1)
+    num_bits = tf.math.ceil(tf.cast(size, tf.float64) *
+                            traffic['packet_size'])
+    return num_packets, num_bits
+
+
+def enqueue_arrivals(queue, counters, num_packets, num_bits, slot,
+                     count=True):
+    """ Append the packets arrived in slot to the tail of each queue, or
+    drop them if the queue is full. Counters are updated if count is True """
+    bits = queue['queue_bits']
+    max_queue = bits.shape[-1]
+    # Number of occupied entries, at the head of the queue
+    # [batch_size, num_bs, num_ut_per_sector]
+    num_entries = tf.reduce_sum(tf.cast(bits > 0, tf.int32), axis=-1)
+    arrived = num_packets > 0
+    full = num_entries >= max_queue
+    # [batch_size, num_bs, num_ut_per_sector, max_queue]
+    tail = tf.logical_and(
+        tf.one_hot(tf.minimum(num_entries, max_queue - 1), max_queue,
+                   on_value=True, off_value=False),
+        tf.logical_and(arrived, tf.logical_not(full))[..., tf.newaxis])
+    num_bits = tf.cast(num_bits, bits.dtype)
+    queue = {'queue_bits': tf.where(tail, num_bits[..., tf.newaxis], bits),
+             'queue_arrival_slot': tf.where(
+                 tail, tf.cast(slot, tf.int32), queue['queue_arrival_slot']),
+             'queue_num_packets': tf.where(
+                 tail, num_packets[..., tf.newaxis],
+                 queue['queue_num_packets'])}
+
+    count = tf.cast(count, tf.int32)
+    counters = dict(counters)
+    counters['num_packets_arrived'] += count * num_packets
+    counters['num_packets_dropped'] += count * tf.where(
+        full, num_packets, tf.zeros_like(num_packets))
+    return queue, counters
+
+
+def is_backlogged(queue):
+    """ Users with buffered bits [batch_size, num_bs, num_ut_per_sector] """
+    return tf.reduce_any(queue['queue_bits'] > 0, axis=-1)
+
+
+def drain_queue(queue, counters, num_decoded_bits, slot, slot_duration,
+                count=True):
+    """ Serve each queue in FIFO order with the bits decoded in slot.
+    Packets completed in slot add their latency [s], from the start of their
+    arrival slot to the end of slot, to the counters if count is True.
+    Returns the queue, the counters and the number of bits served, i.e., the
+    decoded bits capped to the buffered ones """
+    bits = queue['queue_bits']
+    max_queue = bits.shape[-1]
+    # [batch_size, num_bs, num_ut_per_sector, 1]
+    decoded = tf.cast(num_decoded_bits, bits.dtype)[..., tf.newaxis]
+    # [batch_size, num_bs, num_ut_per_sector, max_queue]
+    cum_bits = tf.cumsum(bits, axis=-1)
+    # Entries fully served in this slot, at the head of the queue
+    done = tf.logical_and(cum_bits <= decoded, bits > 0)
+    remaining = tf.minimum(bits, tf.maximum(cum_bits - decoded, 0.))
+    # [batch_size, num_bs, num_ut_per_sector]
+    served_bits = tf.reduce_sum(bits - remaining, axis=-1)
+
+    # Latency of the completed packets
+    num_packets_done = tf.where(done, queue['queue_num_packets'], 0)
+    dtype = counters['packet_latency_sum'].dtype
+    latency = tf.cast(slot + 1 - queue['queue_arrival_slot'], dtype) * \
+        slot_duration
+    count = tf.cast(count, tf.int32)
+    counters = dict(counters)
+    counters['num_packets_done'] += count * tf.reduce_sum(num_packets_done,
+                                                          axis=-1)
+    counters['packet_latency_sum'] += tf.cast(count, dtype) * \
+        tf.reduce_sum(tf.cast(num_packets_done, dtype) * latency, axis=-1)
+
+    # Remove the completed entries from the head of the queue
+    num_done = tf.reduce_sum(tf.cast(done, tf.int32), axis=-1,
+                             keepdims=True)
+    idx = tf.range(max_queue) + num_done
+    valid = idx < max_queue
+    idx = tf.minimum(idx, max_queue - 1)
+
+    def shift(value):
+        return tf.where(valid,
+                        tf.gather(value, idx, batch_dims=3),
+                        tf.zeros_like(value))
+    queue = {'queue_bits': shift(remaining),
+             'queue_arrival_slot': shift(queue['queue_arrival_slot']),
+             'queue_num_packets': shift(queue['queue_num_packets'])}
+    served_bits = tf.cast(served_bits, num_decoded_bits.dtype)
+    return queue, counters, served_bits
@@ -0,0 +1,102 @@
+# utils/tuning_utils.py
+
+import os
+import json
+import socket
+import tensorflow as tf
+
+from utils.cache_utils import get_cache_dir, hash_key
+
+# Settings chosen by the auto-tuner
+TUNING_KEYS = ['batch_size', 'chunk_slots', 'intra_op_threads',
+               'inter_op_threads', 'jit_compile']
+
+
+def tuning_key(config, precision='single'):
+    """ Identify the configurations sharing the same tuned settings. Tuned
+    settings and the number of slots are not part of the key """
+    return hash_key({
+        'scenario': config.SCENARIO,
+        'direction': config.DIRECTION,
+        'num_rings': config.NUM_RINGS,
+        'num_ut_per_sector': config.NUM_UT_PER_SECTOR,
+        'num_ofdm_sym': config.NUM_OFDM_SYM,
+        'num_subcarriers': config.NUM_SUBCARRIERS,
+        'freq_stride': config.FREQ_STRIDE,
+        # Policy branches of all carriers
+        'num_policies': (1 if config.POLICIES is None
+                         else len(config.POLICIES)) *
+                        (1 if config.CARRIERS is None
+                         else len(config.CARRIERS)),
+        'active_set_sinr': config.ACTIVE_SET_SINR,
+        'rzf_cache_tolerance': config.RZF_CACHE_TOLERANCE,
+        'rzf_cache_max_update_ratio': config.RZF_CACHE_MAX_UPDATE_RATIO,
+        'channel_source': config.CHANNEL_SOURCE,
+        'traffic': config.TRAFFIC,
+        'convergence': config.CONVERGENCE,
+        'compact_hist_float': config.COMPACT_HIST_FLOAT,
+        'memory_budget_gb': config.MEMORY_BUDGET_GB,
+        'precision': precision,
+        'tf_version': tf.__version__})
+
+
+def get_tuning_cache_file(cache_dir=None):
+    """ Tuning cache of the current host """
+    return os.path.join(get_cache_dir('autotune', cache_dir),
+                        f'{socket.gethostname()}.json')
+
+
+def load_tuning(config, precision='single', cache_dir=None):
+    """ Return the tuned settings of a configuration on the current host, or
+    None if it was not tuned """
+    filename = get_tuning_cache_file(cache_dir)
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'r', encoding='utf-8') as f:
+        cache = json.load(f)
+    return cache.get(tuning_key(config, precision))
+
+
+def save_tuning(config, tuning, precision='single', cache_dir=None):
+    """ Store the tuned settings of a configuration for the current host """
+    filename = get_tuning_cache_file(cache_dir)
+    cache = {}
+    if os.path.isfile(filename):
+        with open(filename, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    cache[tuning_key(config, precision)] = tuning
+    tmp_filename = f'{filename}.{os.getpid()}.tmp'
+    with open(tmp_filename, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_filename, filename)
+
+
+def apply_thread_settings(tuning):
+    """ Set TensorFlow intra/inter-op thread counts (0: TensorFlow default).
+    Returns False if TensorFlow was already initialized with other thread
+    counts """
+    if tf.config.threading.get_intra_op_parallelism_threads() == \
+            tuning['intra_op_threads'] and \
+            tf.config.threading.get_inter_op_parallelism_threads() == \
+            tuning['inter_op_threads']:
+        return True
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(
+            tuning['intra_op_threads'])
+        tf.config.threading.set_inter_op_parallelism_threads(
+            tuning['inter_op_threads'])
+    except RuntimeError:
+        return False
+    return True
+
+
+def apply_tuned_thread_settings(config, precision='single', cache_dir=None):
+    """ Apply the thread counts tuned for a configuration on the current
+    host, if any. Must be called before TensorFlow is initialized, e.g.,
+    before setting sionna.phy.config.seed. Returns the tuned settings, or
+    None if the configuration was not tuned """
+    tuning = load_tuning(config, precision=precision, cache_dir=cache_dir)
+    if tuning is not None and not apply_thread_settings(tuning):
+        print("TensorFlow already initialized, tuned thread counts are not "
+              "applied")
+    return tuning
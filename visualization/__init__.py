@@ -2,4 +2,5 @@
 
 from .plots import (get_cdf, plot_performance_metrics, pairplot, 
                    plot_sinr_mcs_throughput, plot_bler_mcs_olla, 
-                   plot_pf_resources_mcs, show_network_topology)
+                   plot_pf_resources_mcs, show_network_topology,
+                   plot_policy_comparison)
@@ -44,6 +44,35 @@ def plot_performance_metrics(results_avg, bler_target):
     return fig
 
 
+def plot_policy_comparison(results_avg_per_policy, bler_target):
+    """
+    Overlay the CDFs of per-user metrics of several policies
+    """
+    policy_names = list(results_avg_per_policy.keys())
+    metrics = list(results_avg_per_policy[policy_names[0]].keys())
+
+    fig, axs = plt.subplots(3, 3, figsize=(8, 6.5))
+    fig.suptitle('Per-user performance metrics per policy', y=.99)
+
+    for ii in range(3):
+        for jj in range(3):
+            ax = axs[ii, jj]
+            metric = metrics[3*ii+jj]
+            for name in policy_names:
+                ax.plot(*get_cdf(results_avg_per_policy[name][metric]),
+                        label=name)
+            if metric == 'TBLER':
+                # Visualize BLER target
+                ax.plot([bler_target]*2, [0, 1], '--k')
+            ax.set_xlabel(metric)
+            ax.grid()
+            ax.set_ylabel('CDF')
+    axs[0, 0].legend()
+
+    fig.tight_layout()
+    return fig
+
+
 def pairplot(dict, keys, suptitle=None, figsize=2.5):
     """
     Create a pairplot for selected metrics